@@ -0,0 +1,167 @@
+# Process-pool executor for CPU heavy analysis of raw blocks (runs outside the MQTT thread and the GIL)
+import os
+import threading
+import time
+import traceback
+import multiprocessing
+from collections import deque
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+from spectrum import compute_spectra
+
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+ANALYSIS_MAX_IN_FLIGHT = int(os.getenv("ANALYSIS_MAX_IN_FLIGHT", str(ANALYSIS_WORKERS * 2)))  # batches
+ANALYSIS_BATCH_SIZE = int(os.getenv("ANALYSIS_BATCH_SIZE", "64"))  # blocks per task
+ANALYSIS_BATCH_TIMEOUT = float(os.getenv("ANALYSIS_BATCH_TIMEOUT", "0.25"))  # seconds
+ANALYSIS_MAX_PENDING = int(os.getenv("ANALYSIS_MAX_PENDING", "4096"))  # blocks waiting for a free slot
+
+
+def _picklable(block):
+    """
+    memoryview payloads cannot be pickled. Send the underlying buffer instead (pickled in one pass,
+    like bytes) rather than materializing another copy with bytes(view).
+    """
+    payload = block.get("payload")
+    if isinstance(payload, memoryview):
+        base = payload.obj
+        whole = isinstance(base, (bytes, bytearray)) and payload.nbytes == len(base) and payload.contiguous
+        return dict(block, payload=base if whole else payload.tobytes())
+    return block
+
+
+class AnalysisExecutor:
+    """
+    Batches completed raw blocks and runs `task(blocks) -> results` on a ProcessPoolExecutor.
+    - submit() never blocks: it appends to a bounded pending deque and returns False when that is full
+      (the caller decides what to do with the rejected block).
+    - a dispatcher thread cuts batches (size or timeout) and waits for a free in-flight slot, so a slow
+      pool pushes back into the pending deque instead of growing an unbounded futures list.
+    - on_result(results, blocks) is called from the pool's callback thread for every finished batch,
+      with the submitted block dicts; results is [] when the task failed.
+    task must be a module level function (it is pickled by reference), e.g. spectrum.compute_spectra.
+    """
+
+    def __init__(self, on_result, task=compute_spectra, workers=ANALYSIS_WORKERS,
+                 max_in_flight=ANALYSIS_MAX_IN_FLIGHT, batch_size=ANALYSIS_BATCH_SIZE,
+                 batch_timeout=ANALYSIS_BATCH_TIMEOUT, max_pending=ANALYSIS_MAX_PENDING):
+        self.on_result = on_result
+        self.task = task
+        self.workers = workers
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.max_pending = max_pending
+        self.max_in_flight = max_in_flight
+
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._count_lock = threading.Lock()
+        self._pool = None
+        self._thread = None
+        self._running = False
+
+        self.submitted = 0
+        self.rejected = 0
+        self.completed_batches = 0
+        self.failed_batches = 0
+        self.in_flight = 0
+
+    def start(self):
+        # forkserver: workers are forked from a single-threaded server process, not from this threaded one.
+        # Each worker still re-runs the __main__ script as __mp_main__ (multiprocessing's preparation data),
+        # so the processes are started via app/run.py, whose module body imports nothing; main.py /
+        # ingest.py only load under its guard. The task module is preloaded once in the server.
+        ctx = multiprocessing.get_context("forkserver")
+        ctx.set_forkserver_preload([self.task.__module__])
+        self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx)
+        self._running = True
+        self._thread = threading.Thread(target=self._dispatch_loop, name="analysis-dispatch", daemon=True)
+        self._thread.start()
+        print(f"[ANALYSIS] started {self.workers} workers (batch={self.batch_size}, in_flight={self.max_in_flight})", flush=True)
+        return self
+
+    def submit(self, block) -> bool:
+        """Queue one RAW_BLOCK data dict for analysis. Returns False if the pending window is full."""
+        with self._cond:
+            if not self._running or len(self._pending) >= self.max_pending:
+                self.rejected += 1
+                return False
+            self._pending.append(block)
+            self.submitted += 1
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+        return True
+
+    def _next_batch(self):
+        with self._cond:
+            deadline = time.time() + self.batch_timeout
+            while self._running and len(self._pending) < self.batch_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            n = min(self.batch_size, len(self._pending))
+            return [self._pending.popleft() for _ in range(n)]
+
+    def _dispatch_loop(self):
+        while self._running:
+            batch = self._next_batch()
+            if not batch:
+                continue
+            # backpressure: wait for an in-flight slot; meanwhile new blocks accumulate in _pending
+            self._slots.acquire()
+            with self._count_lock:
+                self.in_flight += 1
+            try:
+                fut = self._pool.submit(self.task, [_picklable(b) for b in batch])
+            except Exception as e:
+                print("[ANALYSIS] submit to pool failed:", e)
+                self._release(failed=True)
+                self._callback([], batch)
+                continue
+            fut.add_done_callback(partial(self._on_done, batch))
+
+    def _release(self, failed=False):
+        with self._count_lock:
+            self.in_flight -= 1
+            if failed:
+                self.failed_batches += 1
+            else:
+                self.completed_batches += 1
+        self._slots.release()
+
+    def _on_done(self, batch, fut):
+        try:
+            results = fut.result()
+        except Exception as e:
+            print("[ANALYSIS] task failed:", e)
+            self._release(failed=True)
+            self._callback([], batch)
+            return
+        self._release()
+        self._callback(results, batch)
+
+    def _callback(self, results, batch):
+        try:
+            self.on_result(results, batch)
+        except Exception:
+            print("[ANALYSIS] on_result callback failed")
+            traceback.print_exc()
+
+    def stats(self) -> dict:
+        return {
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "pending": len(self._pending),
+            "in_flight": self.in_flight,
+            "completed_batches": self.completed_batches,
+            "failed_batches": self.failed_batches,
+        }
+
+    def shutdown(self, wait=True):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait, cancel_futures=not wait)
@@ -1,4 +1,8 @@
 import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 from passlib.hash import bcrypt
 from datetime import timedelta
 from flask_jwt_extended import create_access_token, create_refresh_token, decode_token
@@ -7,6 +11,75 @@ from datetime import datetime, timezone, timedelta
 JWT_ACCESS_EXPIRES = int(os.getenv("JWT_ACCESS_EXPIRES_SEC", 900)) # default 15 minutes
 JWT_REFRESH_EXPIRES = int(os.getenv("JWT_REFRESH_EXPIRES_SEC", 60*60*24*7)) # default 7 days
 
+# bcrypt runs on a small dedicated pool (the bcrypt C/Rust core releases the GIL), so a login burst
+# occupies AUTH_HASH_WORKERS threads instead of every request thread.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))  # cost factor of new hashes; existing hashes keep theirs
+AUTH_HASH_WORKERS = int(os.getenv("AUTH_HASH_WORKERS", "2"))
+AUTH_HASH_MAX_PENDING = int(os.getenv("AUTH_HASH_MAX_PENDING", "32"))  # queued + running before AuthBusy
+AUTH_HASH_TIMEOUT_SEC = float(os.getenv("AUTH_HASH_TIMEOUT_SEC", "10"))
+
+_bcrypt = bcrypt.using(rounds=BCRYPT_ROUNDS)
+
+
+class AuthBusy(Exception):
+    """The hashing pool is full (or too slow): answer 503 and let the client retry."""
+
+
+class PasswordHasher:
+    """
+    Bounded ThreadPoolExecutor for bcrypt. run() rejects work beyond max_pending instead of queueing
+    without limit, and records queue wait and hash time of the last 1000 calls for stats().
+    """
+
+    def __init__(self, workers=AUTH_HASH_WORKERS, max_pending=AUTH_HASH_MAX_PENDING, timeout=AUTH_HASH_TIMEOUT_SEC):
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._lock = threading.Lock()
+        self._samples = {"hash": deque(maxlen=1000), "verify": deque(maxlen=1000)}  # (wait_s, run_s)
+        self.rejected = 0
+        self.timeouts = 0
+
+    def _timed(self, op, fn, args, queued_at):
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self._samples[op].append((started - queued_at, time.perf_counter() - started))
+
+    def run(self, op, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise AuthBusy(f"{op}: password hashing pool is saturated")
+        try:
+            future = self._pool.submit(self._timed, op, fn, args, time.perf_counter())
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            # the hash still finishes in the pool (and holds its slot until then); this request gives up
+            self.timeouts += 1
+            raise AuthBusy(f"{op}: password hashing timed out")
+
+    def stats(self) -> dict:
+        out = {"workers": self.workers, "rejected": self.rejected, "timeouts": self.timeouts, "rounds": BCRYPT_ROUNDS}
+        with self._lock:
+            for op, samples in self._samples.items():
+                runs = sorted(r for _, r in samples)
+                waits = sorted(w for w, _ in samples)
+                pct = lambda xs, q: round(xs[min(len(xs) - 1, int(q * len(xs)))] * 1000, 1) if xs else 0.0
+                out[op] = {"samples": len(samples), "run_p50_ms": pct(runs, 0.5), "run_p95_ms": pct(runs, 0.95),
+                           "wait_p50_ms": pct(waits, 0.5), "wait_p95_ms": pct(waits, 0.95)}
+        return out
+
+
+hasher = PasswordHasher()
+
 def hash_password(password) -> str:
     """
     Hash a password using passlib bcrypt backend, but guard against
@@ -21,11 +94,12 @@ def hash_password(password) -> str:
     if len(pw_bytes) > 72:
         # return a helpful error; don't auto-truncate silently
         raise ValueError("Password too long (more than 72 bytes). Please use a shorter password.")
-    # now it's safe to hash
-    return bcrypt.hash(password)
+    # now it's safe to hash (on the hashing pool; raises AuthBusy when it is saturated)
+    return hasher.run("hash", _bcrypt.hash, password)
 
 def verify_password(plaintext, hashed):
-    return bcrypt.verify(plaintext, hashed)
+    """bcrypt check on the hashing pool; raises AuthBusy when it is saturated."""
+    return hasher.run("verify", bcrypt.verify, plaintext, hashed)
 
 def build_tokens(identity_claims: dict):
     '''
@@ -0,0 +1,162 @@
+# In-process caches for the auth endpoints (refresh token revocation, users by email)
+# and the background sweeper that purges expired refresh tokens.
+# A token revoked through another API process is still accepted here for up to
+# AUTH_REVOCATION_CACHE_SEC; revocations made by this process apply immediately.
+import os
+import threading
+import time
+from db import get_user_by_email, is_refresh_token_revoked, revoke_refresh_token, insert_user
+from db import purge_expired_refresh_tokens
+from auth import JWT_REFRESH_EXPIRES
+
+AUTH_REVOCATION_CACHE_SEC = float(os.getenv("AUTH_REVOCATION_CACHE_SEC", "30"))
+AUTH_USER_CACHE_SEC = float(os.getenv("AUTH_USER_CACHE_SEC", "60"))
+AUTH_USER_MISS_CACHE_SEC = float(os.getenv("AUTH_USER_MISS_CACHE_SEC", "5"))  # "no such user" answers
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000"))
+REFRESH_TOKEN_SWEEP_SEC = float(os.getenv("REFRESH_TOKEN_SWEEP_SEC", "3600"))  # 0 = no sweeper
+REFRESH_TOKEN_SWEEP_BATCH = int(os.getenv("REFRESH_TOKEN_SWEEP_BATCH", "1000"))
+REFRESH_TOKEN_SWEEP_GRACE_SEC = int(os.getenv("REFRESH_TOKEN_SWEEP_GRACE_SEC", "86400"))  # keep expired rows this long
+
+
+class TTLCache:
+    """
+    Thread-safe key -> value cache with per-entry expiry and a size bound (oldest entries evicted).
+    get_or_load() runs one loader per missing key: concurrent callers for the same key wait for
+    that result instead of each querying the DB (a refresh storm costs one query per token).
+    """
+
+    def __init__(self, name, ttl, max_entries=AUTH_CACHE_MAX_ENTRIES):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data = {}  # key -> (value, expires_at); insertion ordered
+        self._loading = {}  # key -> Event of the in-flight load
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, key, now):
+        entry = self._data.get(key)
+        if entry is not None and entry[1] > now:
+            return True, entry[0]
+        return False, None
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, time.monotonic() + ttl)
+            while len(self._data) > self.max_entries:
+                del self._data[next(iter(self._data))]
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def get_or_load(self, key, loader, ttl_fn=None):
+        """Cached value of key, else loader(key) (cached for ttl_fn(value) seconds, or the cache ttl)."""
+        while True:
+            with self._lock:
+                found, value = self._get(key, time.monotonic())
+                if found:
+                    self.hits += 1
+                    return value
+                pending = self._loading.get(key)
+                if pending is None:
+                    pending = self._loading[key] = threading.Event()
+                    self.misses += 1
+                    break
+            pending.wait()  # another caller is loading it; retry (it may have failed)
+        try:
+            value = loader(key)
+            self.set(key, value, ttl_fn(value) if ttl_fn else None)
+            return value
+        finally:
+            with self._lock:
+                del self._loading[key]
+            pending.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+revocations = TTLCache("revocations", AUTH_REVOCATION_CACHE_SEC)
+users = TTLCache("users", AUTH_USER_CACHE_SEC)
+
+
+def _revocation_ttl(revoked):
+    # a revoked (or unknown) jti never becomes valid again: keep it until the token itself has expired
+    return float(JWT_REFRESH_EXPIRES) if revoked else AUTH_REVOCATION_CACHE_SEC
+
+
+def is_revoked(jti):
+    return revocations.get_or_load(jti, is_refresh_token_revoked, _revocation_ttl)
+
+
+def revoke(jti):
+    revoke_refresh_token(jti)
+    revocations.set(jti, True, _revocation_ttl(True))
+
+
+def user_by_email(email):
+    """users row dict (with password_hash) or None; misses are cached for AUTH_USER_MISS_CACHE_SEC only."""
+    return users.get_or_load(email, get_user_by_email,
+                             lambda user: AUTH_USER_CACHE_SEC if user else AUTH_USER_MISS_CACHE_SEC)
+
+
+def create_user(username, email, password_hash, role="technician"):
+    users.invalidate(email)
+    try:
+        insert_user(username, email, password_hash, role)
+    finally:
+        users.invalidate(email)
+
+
+def stats() -> dict:
+    return {"revocations": revocations.stats(), "users": users.stats(), "sweeper": _sweeper_stats}
+
+
+# --- expired refresh token sweeper
+
+_sweeper = None
+_sweeper_lock = threading.Lock()
+_sweeper_stats = {"runs": 0, "purged": 0, "last_error": None}
+
+
+def sweep_expired_tokens():
+    """Delete refresh tokens expired more than REFRESH_TOKEN_SWEEP_GRACE_SEC ago, in batches. Returns rows deleted."""
+    total = 0
+    while True:
+        n = purge_expired_refresh_tokens(REFRESH_TOKEN_SWEEP_BATCH, REFRESH_TOKEN_SWEEP_GRACE_SEC)
+        total += n
+        if n < REFRESH_TOKEN_SWEEP_BATCH:
+            return total
+        time.sleep(0.1)  # let other writers in between batches
+
+
+def _sweep_loop():
+    while True:
+        try:
+            n = sweep_expired_tokens()
+            _sweeper_stats["runs"] += 1
+            _sweeper_stats["purged"] += n
+            _sweeper_stats["last_error"] = None
+            if n:
+                print(f"[AUTH] purged {n} expired refresh tokens", flush=True)
+        except Exception as e:
+            _sweeper_stats["last_error"] = str(e)
+            print("[AUTH] refresh token sweep failed:", e, flush=True)
+        time.sleep(REFRESH_TOKEN_SWEEP_SEC)
+
+
+def ensure_token_sweeper():
+    """Start (once per process) the sweeper thread. Lazy, so it also runs under WSGI servers."""
+    global _sweeper
+    if REFRESH_TOKEN_SWEEP_SEC <= 0:
+        return None
+    with _sweeper_lock:
+        if _sweeper is None:
+            _sweeper = threading.Thread(target=_sweep_loop, name="refresh-token-sweeper", daemon=True)
+            _sweeper.start()
+        return _sweeper
@@ -0,0 +1,58 @@
+# Backfill the typed metric columns of readings_parameters from the JSONB metrics of older rows.
+# Run after sql/migrations/001_typed_metrics.sql, once the writers use READINGS_SCHEMA=typed:
+#   python app/backfill_typed_metrics.py [--window-hours 24] [--keep-json] [--dry-run]
+# Works through the table one time window per transaction, so it can be stopped and rerun at any point.
+import argparse
+import time
+from datetime import timedelta
+from sqlalchemy import text
+from db import engine, wait_for_db, TYPED_METRICS
+
+_HAS_TYPED_KEYS = "metrics ?| ARRAY[" + ", ".join(f"'{m}'" for m in TYPED_METRICS) + "]"
+
+
+def backfill_window(conn, start, end, keep_json=False):
+    """Move the typed metrics of rows in [start, end) from JSONB to their columns. Returns rows updated."""
+    sets = [f"{m} = COALESCE({m}, (metrics->>'{m}')::real)" for m in TYPED_METRICS]
+    if not keep_json:
+        # strip the moved keys; an empty object becomes NULL
+        sets.append("metrics = NULLIF(metrics - ARRAY[" + ", ".join(f"'{m}'" for m in TYPED_METRICS) + "], '{}'::jsonb)")
+    r = conn.execute(text(f"""
+        UPDATE readings_parameters SET {", ".join(sets)}
+        WHERE time >= :start AND time < :end AND {_HAS_TYPED_KEYS}
+    """), {"start": start, "end": end})
+    return r.rowcount
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill typed metric columns from readings_parameters.metrics")
+    parser.add_argument("--window-hours", type=float, default=24, help="time range updated per transaction")
+    parser.add_argument("--keep-json", action="store_true", help="copy to the columns but leave the JSONB keys")
+    parser.add_argument("--dry-run", action="store_true", help="only count rows that still need a backfill")
+    args = parser.parse_args()
+
+    wait_for_db()
+    with engine.connect() as conn:
+        first, last, pending = conn.execute(text(
+            f"SELECT min(time), max(time), count(*) FROM readings_parameters WHERE {_HAS_TYPED_KEYS}"
+        )).fetchone()
+    print(f"[BACKFILL] {pending} rows with typed metrics in JSONB ({first} .. {last})", flush=True)
+    if args.dry_run or not pending:
+        return
+
+    window = timedelta(hours=args.window_hours)
+    start = first
+    total = 0
+    t0 = time.time()
+    while start <= last:
+        end = start + window
+        with engine.begin() as conn:
+            n = backfill_window(conn, start, end, keep_json=args.keep_json)
+        total += n
+        print(f"[BACKFILL] {start} .. {end}: {n} rows ({total}/{pending}, {time.time() - t0:.1f}s)", flush=True)
+        start = end
+    print(f"[BACKFILL] done: {total} rows in {time.time() - t0:.1f}s", flush=True)
+
+
+if __name__ == "__main__":
+    main()
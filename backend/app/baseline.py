@@ -0,0 +1,242 @@
+# Per-device streaming baselines: incremental statistics per (device_id, metric), checkpointed to the DB
+import os
+import math
+import threading
+import time
+
+BASELINE_EWMA_ALPHA = float(os.getenv("BASELINE_EWMA_ALPHA", "0.01"))
+BASELINE_CHECKPOINT_SEC = float(os.getenv("BASELINE_CHECKPOINT_SEC", "60"))
+BASELINE_QUANTILES = (0.5, 0.95, 0.99)
+AXIS_NAMES = ("ax", "ay", "az")
+
+
+class P2Quantile:
+    """
+    P-square streaming quantile estimator (Jain & Chlamtac): constant memory, five markers.
+    """
+
+    def __init__(self, p):
+        self.p = p
+        self.q = []  # marker heights (first 5 observations until initialised)
+        self.n = [0, 1, 2, 3, 4]  # marker positions
+        self.np = [0.0, 2 * p, 4 * p, 2 + 2 * p, 4.0]  # desired positions
+        self.dn = [0.0, p / 2, p, (1 + p) / 2, 1.0]
+
+    def add(self, x):
+        q = self.q
+        if len(q) < 5:
+            q.append(x)
+            q.sort()
+            return
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while k < 3 and x >= q[k + 1]:
+                k += 1
+        n = self.n
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.np[i] += self.dn[i]
+        for i in (1, 2, 3):
+            d = self.np[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                s = 1 if d > 0 else -1
+                # parabolic prediction, fall back to linear if it leaves the bracket
+                qp = q[i] + s / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + s) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - s) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                if not (q[i - 1] < qp < q[i + 1]):
+                    qp = q[i] + s * (q[i + s] - q[i]) / (n[i + s] - n[i])
+                q[i] = qp
+                n[i] += s
+
+    def value(self):
+        if not self.q:
+            return None
+        if len(self.q) < 5:
+            # exact quantile of the few samples seen so far
+            idx = min(len(self.q) - 1, int(round(self.p * (len(self.q) - 1))))
+            return self.q[idx]
+        return self.q[2]
+
+    def to_state(self):
+        return {"p": self.p, "q": self.q, "n": self.n, "np": self.np}
+
+    @classmethod
+    def from_state(cls, st):
+        obj = cls(st["p"])
+        obj.q = list(st["q"])
+        obj.n = list(st["n"])
+        obj.np = list(st["np"])
+        return obj
+
+
+class RunningStat:
+    """Welford mean/variance + EWMA (mean and variance) + min/max + P-square quantiles for one series."""
+
+    def __init__(self, alpha=BASELINE_EWMA_ALPHA):
+        self.alpha = alpha
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.ewma = None
+        self.ewm_var = 0.0
+        self.min = None
+        self.max = None
+        self.last = None
+        self.quantiles = {p: P2Quantile(p) for p in BASELINE_QUANTILES}
+
+    def add(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        if self.ewma is None:
+            self.ewma = x
+        else:
+            d = x - self.ewma
+            self.ewma += self.alpha * d
+            self.ewm_var = (1 - self.alpha) * (self.ewm_var + self.alpha * d * d)
+        self.min = x if self.min is None else min(self.min, x)
+        self.max = x if self.max is None else max(self.max, x)
+        self.last = x
+        for est in self.quantiles.values():
+            est.add(x)
+
+    @property
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+    def zscore(self, x):
+        """Deviation of x from the long-run mean in standard deviations (None until there is a spread)."""
+        sd = self.std
+        if self.count < 2 or sd == 0:
+            return None
+        return (x - self.mean) / sd
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "std": self.std,
+            "ewma": self.ewma,
+            "ewm_std": math.sqrt(self.ewm_var),
+            "min": self.min,
+            "max": self.max,
+            "last": self.last,
+            **{f"p{int(p * 100)}": est.value() for p, est in self.quantiles.items()},
+        }
+
+    def to_state(self):
+        return {
+            "alpha": self.alpha, "count": self.count, "mean": self.mean, "m2": self.m2,
+            "ewma": self.ewma, "ewm_var": self.ewm_var, "min": self.min, "max": self.max, "last": self.last,
+            "quantiles": [est.to_state() for est in self.quantiles.values()],
+        }
+
+    @classmethod
+    def from_state(cls, st):
+        obj = cls(alpha=st.get("alpha", BASELINE_EWMA_ALPHA))
+        for k in ("count", "mean", "m2", "ewma", "ewm_var", "min", "max", "last"):
+            setattr(obj, k, st.get(k, getattr(obj, k)))
+        for q in st.get("quantiles", []):
+            obj.quantiles[q["p"]] = P2Quantile.from_state(q)
+        return obj
+
+
+def band_metric_name(axis, lo, hi):
+    """Metric key for a spectrum band energy, e.g. ax_band_50_100_g2."""
+    return f"{axis}_band_{lo:g}_{hi:g}_g2"
+
+
+class BaselineStore:
+    """
+    In-memory baselines keyed by (device_id, metric). Updated incrementally from METRIC items and
+    SPECTRUM rows; lookups (get / zscore) are O(1). Dirty entries are written back by checkpoint().
+    """
+
+    def __init__(self):
+        self._stats = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self.last_checkpoint = time.time()
+
+    def _update(self, device_id, metric, value):
+        key = (device_id, metric)
+        st = self._stats.get(key)
+        if st is None:
+            st = self._stats[key] = RunningStat()
+        st.add(value)
+        self._dirty.add(key)
+
+    def update_metrics(self, device_id, metrics: dict):
+        """Feed one telemetry metrics dict (ax_rms_g, magnitude_peak_g, ...). Non-numeric values are ignored."""
+        if not device_id or not isinstance(metrics, dict):
+            return
+        with self._lock:
+            for name, value in metrics.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value):
+                    self._update(device_id, name, float(value))
+
+    def update_spectrum(self, row: dict):
+        """Feed one spectrum row (see spectrum.compute_spectra): per-axis band energies and rms."""
+        device_id = row.get("device_id")
+        edges = row.get("band_edges_hz") or []
+        if not device_id:
+            return
+        with self._lock:
+            for a, axis in enumerate(AXIS_NAMES):
+                for b, energy in enumerate(row.get("band_energy", [[]] * 3)[a]):
+                    self._update(device_id, band_metric_name(axis, edges[b], edges[b + 1]), float(energy))
+                if row.get("rms_g"):
+                    self._update(device_id, f"{axis}_ac_rms_g", float(row["rms_g"][a]))
+
+    def get(self, device_id, metric):
+        return self._stats.get((device_id, metric))
+
+    def zscore(self, device_id, metric, value):
+        st = self._stats.get((device_id, metric))
+        return st.zscore(value) if st is not None else None
+
+    def device_summary(self, device_id):
+        with self._lock:
+            return {m: st.summary() for (d, m), st in self._stats.items() if d == device_id}
+
+    def load(self, rows):
+        """rows: iterable of {"device_id", "metric", "state"} (as returned by db.get_all_baselines)."""
+        n = 0
+        with self._lock:
+            for r in rows:
+                self._stats[(r["device_id"], r["metric"])] = RunningStat.from_state(r["state"])
+                n += 1
+        return n
+
+    def checkpoint(self, save_fn):
+        """Write dirty entries with save_fn(list of {"device_id", "metric", "state"}). Returns number saved."""
+        # due again one interval from now whether or not this write succeeds (no retry storm while the DB is down)
+        self.last_checkpoint = time.time()
+        with self._lock:
+            dirty = self._dirty
+            self._dirty = set()
+            rows = [{"device_id": d, "metric": m, "state": self._stats[(d, m)].to_state()} for d, m in dirty]
+        try:
+            save_fn(rows)
+        except Exception:
+            # keep them dirty so the next checkpoint retries
+            with self._lock:
+                self._dirty |= dirty
+            raise
+        return len(rows)
+
+    def checkpoint_due(self, now=None):
+        return ((now or time.time()) - self.last_checkpoint) >= BASELINE_CHECKPOINT_SEC
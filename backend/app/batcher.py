@@ -0,0 +1,171 @@
+# Size / byte / time bounded batch buffer with per-batch statistics (used by db_writer_worker)
+import time
+import traceback
+from collections import deque
+from logs import sampled
+from metrics import BATCH_ITEMS, FLUSH_SECONDS
+from wal import WAL_PIN_MAX_SEC
+
+
+class Batcher:
+    """
+    Collects items and hands them to flush_fn(list) when max_items or max_bytes is reached,
+    or when the oldest buffered item is older than max_age seconds.
+    A failed flush is logged and the batch handed to on_failure(name, items, attempts, error) if given
+    (spill journal), otherwise dropped. attempts: how often these items already failed before.
+    min_lsn(): oldest WAL LSN among buffered and in-flight items (None without a WAL, see wal.py).
+    Rows of a failed batch that on_failure did not keep (no spill journal, too many retries) leave
+    their LSN pinned for pin_max_age seconds: until then the WAL is not checkpointed past it and a
+    restart replays them; after that they count as dropped (pins_released) so the WAL can be trimmed.
+    """
+
+    def __init__(self, name, flush_fn, max_items=100, max_age=1.0, max_bytes=None, on_failure=None,
+                 pin_max_age=WAL_PIN_MAX_SEC):
+        self.name = name
+        self.flush_fn = flush_fn
+        self.max_items = max_items
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.on_failure = on_failure
+        self.items = []
+        self.attempts = 0
+        self.taken_attempts = 0
+        self.lsn = None
+        self.taken_lsn = None
+        self.pin_max_age = pin_max_age
+        self._pins = deque()  # (lsn, pinned at) of dropped batches, oldest first
+        self.pins_released = 0
+        self.bytes = 0
+        self.first_added = None
+
+        # per-batch metrics
+        self.batches = 0
+        self.failed_batches = 0
+        self.flushed_items = 0
+        self.flushed_bytes = 0
+        self.last_batch_items = 0
+        self.last_batch_bytes = 0
+        self.last_flush_sec = 0.0
+        self.total_flush_sec = 0.0
+        self.max_flush_sec = 0.0
+        self.last_ok = True
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, item, size=0, attempts=0, lsn=None):
+        if not self.items:
+            self.first_added = time.time()
+        self.items.append(item)
+        self.bytes += size
+        self.attempts = max(self.attempts, attempts)
+        if lsn is not None and (self.lsn is None or lsn < self.lsn):
+            self.lsn = lsn
+
+    def extend(self, items, attempts=0, lsn=None):
+        for item in items:
+            self.add(item, attempts=attempts, lsn=lsn)
+
+    @property
+    def pinned_lsn(self):
+        self._release_pins()
+        return min(lsn for lsn, _ in self._pins) if self._pins else None
+
+    def _release_pins(self, now=None):
+        now = now or time.time()
+        while self._pins and now - self._pins[0][1] >= self.pin_max_age:
+            lsn, _ = self._pins.popleft()
+            self.pins_released += 1
+            print(f"[WAL] {self.name} rows from lsn {lsn} still not written after {self.pin_max_age:.0f}s, "
+                  f"dropped (WAL_PIN_MAX_SEC)", flush=True)
+
+    def min_lsn(self):
+        lsns = [lsn for lsn in (self.lsn, self.taken_lsn, self.pinned_lsn) if lsn is not None]
+        return min(lsns) if lsns else None
+
+    def due(self, now=None):
+        if not self.items:
+            return False
+        if len(self.items) >= self.max_items:
+            return True
+        if self.max_bytes is not None and self.bytes >= self.max_bytes:
+            return True
+        return ((now or time.time()) - self.first_added) >= self.max_age
+
+    def take(self):
+        """Detach and return (items, nbytes) for a caller that flushes on its own (e.g. async writers)."""
+        batch, nbytes = self.items, self.bytes
+        self.items, self.bytes, self.first_added = [], 0, None
+        self.taken_attempts, self.attempts = self.attempts, 0
+        self.taken_lsn, self.lsn = self.lsn, None
+        return batch, nbytes
+
+    def record(self, n_items, nbytes, elapsed, ok=True):
+        """Account one flushed batch (items, bytes, seconds spent, success)."""
+        self.batches += 1
+        self.last_batch_items = n_items
+        self.last_batch_bytes = nbytes
+        self.last_flush_sec = elapsed
+        self.total_flush_sec += elapsed
+        self.max_flush_sec = max(self.max_flush_sec, elapsed)
+        self.last_ok = ok
+        if ok:
+            self.taken_lsn = None  # committed
+        BATCH_ITEMS.observe(n_items, self.name)
+        FLUSH_SECONDS.observe(elapsed, self.name, "ok" if ok else "error")
+        if ok:
+            self.flushed_items += n_items
+            self.flushed_bytes += nbytes
+        else:
+            self.failed_batches += 1
+
+    def flush(self):
+        """Flush whatever is buffered with flush_fn. Returns True on success (or if empty)."""
+        if not self.items:
+            return True
+        batch, nbytes = self.take()
+        t0 = time.perf_counter()
+        ok = True
+        error = None
+        try:
+            self.flush_fn(batch)
+        except Exception as e:
+            ok = False
+            error = e
+            print(f"[DB_WORKER ERROR] Failed to flush {self.name} batch ({len(batch)} items):", e)
+            traceback.print_exc()
+        self.record(len(batch), nbytes, time.perf_counter() - t0, ok)
+        if not ok:
+            self.failed(self.on_failure is not None and self.on_failure(self.name, batch, self.taken_attempts, error))
+        return ok
+
+    def failed(self, kept):
+        """After record(ok=False): kept = on_failure journaled the batch, else its WAL LSN stays pinned."""
+        if not kept and self.taken_lsn is not None:
+            self._pins.append((self.taken_lsn, time.time()))
+            sampled(f"{self.name}_wal_pinned", f"[WAL] dropped {self.name} rows stay in the WAL from lsn "
+                                               f"{self.taken_lsn} for up to {self.pin_max_age:.0f}s, "
+                                               f"replayed on the next start")
+        self.taken_lsn = None
+
+    def flush_if_due(self, now=None):
+        if self.due(now):
+            return self.flush()
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "buffered": len(self.items),
+            "buffered_bytes": self.bytes,
+            "batches": self.batches,
+            "failed_batches": self.failed_batches,
+            "items": self.flushed_items,
+            "bytes": self.flushed_bytes,
+            "last_batch_items": self.last_batch_items,
+            "last_batch_bytes": self.last_batch_bytes,
+            "last_flush_ms": round(self.last_flush_sec * 1000, 2),
+            "avg_flush_ms": round(self.total_flush_sec * 1000 / self.batches, 2) if self.batches else 0.0,
+            "max_flush_ms": round(self.max_flush_sec * 1000, 2),
+            "wal_pinned": self.pinned_lsn is not None,
+            "wal_pins_released": self.pins_released,
+        }
@@ -0,0 +1,196 @@
+# Raw block payload encodings (vectorized with NumPy)
+#   int16_le_axayaz_bin_chunks        firmware format: little-endian int16, ax/ay/az interleaved per sample
+#   int16_axayaz_delta_zzvarint_zstd  per-axis deinterleave -> delta -> zigzag -> LEB128 varint -> zstd frame
+import os
+import struct
+import threading
+import numpy as np
+import zstandard
+
+RAW_ENCODING = "int16_le_axayaz_bin_chunks"
+DELTA_ENCODING = "int16_axayaz_delta_zzvarint_zstd"
+SAMPLE_DTYPE = np.dtype("<i2")
+AXES = 3
+
+# Encoding raw blocks are stored with. Analysis always runs on the firmware payload before it is encoded.
+RAW_BLOCK_ENCODING = os.getenv("RAW_BLOCK_ENCODING", RAW_ENCODING)
+RAW_BLOCK_ZSTD_LEVEL = int(os.getenv("RAW_BLOCK_ZSTD_LEVEL", "3"))
+
+_HEADER = struct.Struct("<BI")  # format version, samples per axis
+_VERSION = 1
+_local = threading.local()  # zstd contexts are not thread safe
+
+
+def _zstd():
+    ctx = getattr(_local, "ctx", None)
+    if ctx is None:
+        ctx = _local.ctx = (zstandard.ZstdCompressor(level=RAW_BLOCK_ZSTD_LEVEL), zstandard.ZstdDecompressor())
+    return ctx
+
+
+def decode_raw(payload) -> np.ndarray:
+    """
+    Zero-copy view of a firmware payload as an (N, 3) int16 array [ax, ay, az].
+    payload: bytes / bytearray / memoryview. The returned array shares its memory.
+    """
+    if len(payload) % (AXES * SAMPLE_DTYPE.itemsize) != 0:
+        raise ValueError(f"payload length {len(payload)} is not a multiple of {AXES * SAMPLE_DTYPE.itemsize}")
+    return np.frombuffer(payload, dtype=SAMPLE_DTYPE).reshape(-1, AXES)
+
+
+def _varint_encode(u: np.ndarray) -> np.ndarray:
+    """
+    uint32 values < 2**21 -> LEB128 bytes (uint8 array): 7 bits per byte, high bit = more bytes follow.
+    Zigzagged int16 deltas need at most 17 bits, so each value is 1..3 bytes: build the three byte
+    planes and keep the used ones (row-major boolean selection keeps them in stream order).
+    """
+    planes = np.empty((len(u), 3), dtype=np.uint8)
+    planes[:, 0] = (u & 0x7F) | np.where(u >= 1 << 7, 0x80, 0)
+    planes[:, 1] = ((u >> 7) & 0x7F) | np.where(u >= 1 << 14, 0x80, 0)
+    planes[:, 2] = u >> 14
+    used = np.empty((len(u), 3), dtype=bool)
+    used[:, 0] = True
+    used[:, 1] = u >= 1 << 7
+    used[:, 2] = u >= 1 << 14
+    return planes[used]
+
+
+def _varint_decode(b: np.ndarray) -> np.ndarray:
+    """LEB128 bytes (uint8 array) of values < 2**21 -> uint32 values."""
+    if len(b) and b[-1] & 0x80:
+        raise ValueError("truncated varint stream")
+    ends = np.flatnonzero(b < 0x80)
+    starts = np.empty_like(ends)
+    starts[:1] = 0
+    starts[1:] = ends[:-1] + 1
+    length = ends - starts + 1
+    if len(length) and length.max() > 3:
+        raise ValueError("varint longer than 3 bytes")
+    padded = np.concatenate([b, np.zeros(2, dtype=np.uint8)]).astype(np.uint32) & 0x7F
+    return (padded[starts] | (padded[starts + 1] << 7) * (length > 1)
+            | (padded[starts + 2] << 14) * (length > 2)).astype(np.uint32)
+
+
+def _by_length(sizes):
+    """Indices of equal-size items, so same-length blocks are stacked and processed in one NumPy call."""
+    groups = {}
+    for i, n in enumerate(sizes):
+        groups.setdefault(n, []).append(i)
+    return groups.items()
+
+
+def encode_many(blocks: list) -> list:
+    """
+    List of (N, 3) int16 sample arrays -> list of DELTA_ENCODING payloads.
+    Delta / zigzag / varint run once per batch (blocks of one length are stacked), so the per-block
+    cost is mostly the zstd call.
+    """
+    zz = [None] * len(blocks)
+    for n, idx in _by_length([len(b) for b in blocks]):
+        x = np.stack([blocks[i] for i in idx]).astype(np.int32).transpose(0, 2, 1)  # (B, 3, N): one run per axis
+        d = np.diff(x, axis=2, prepend=0)  # first sample of each axis kept as is
+        u = ((d << 1) ^ (d >> 31)).astype(np.uint32)  # small +/- deltas -> small unsigned values
+        for j, i in enumerate(idx):
+            zz[i] = u[j].ravel()
+    if not zz:
+        return []
+    u = np.concatenate(zz)
+    stream = _varint_encode(u)
+    block_bytes = 1 + (u >= 1 << 7).astype(np.intp) + (u >= 1 << 14)
+    ends = np.cumsum(block_bytes)[np.cumsum([len(z) for z in zz]) - 1] if len(u) else np.zeros(len(zz), np.intp)
+    cctx = _zstd()[0]
+    out, offset = [], 0
+    for samples, z, end in zip(blocks, zz, ends):
+        end = end if len(z) else offset
+        out.append(_HEADER.pack(_VERSION, len(samples)) + cctx.compress(stream[offset:end].tobytes()))
+        offset = end
+    return out
+
+
+def decode_many(payloads: list) -> list:
+    """
+    List of DELTA_ENCODING payloads -> list of (N, 3) int16 arrays (batched as in encode_many).
+    Any malformed payload (short header, bad version, corrupt or oversized zstd frame) raises ValueError.
+    """
+    dctx = _zstd()[1]
+    sizes, bodies = [], []
+    for payload in payloads:
+        if len(payload) < _HEADER.size:
+            raise ValueError(f"{DELTA_ENCODING} payload of {len(payload)} bytes is shorter than its header")
+        version, n = _HEADER.unpack_from(payload)
+        if version != _VERSION:
+            raise ValueError(f"unsupported {DELTA_ENCODING} version {version}")
+        body = memoryview(payload)[_HEADER.size:]
+        try:
+            # max_output_size only applies to frames without a content size: check the declared one too
+            if zstandard.frame_content_size(body) > n * AXES * 3:
+                raise ValueError(f"{DELTA_ENCODING} frame is larger than {n} samples can encode to")
+            bodies.append(dctx.decompress(body, max_output_size=n * AXES * 3))
+        except zstandard.ZstdError as e:
+            raise ValueError(f"corrupt {DELTA_ENCODING} payload: {e}")
+        sizes.append(n)
+    zz = _varint_decode(np.frombuffer(b"".join(bodies), dtype=np.uint8))
+    if len(zz) != sum(sizes) * AXES:
+        raise ValueError(f"{DELTA_ENCODING} payloads have {len(zz)} values, expected {sum(sizes) * AXES}")
+    d = (zz >> 1).astype(np.int32) ^ -(zz & 1).astype(np.int32)
+    starts = np.cumsum(sizes, dtype=np.intp) * AXES - np.asarray(sizes, dtype=np.intp) * AXES
+    out = [None] * len(payloads)
+    for n, idx in _by_length(sizes):
+        take = (starts[idx][:, None] + np.arange(n * AXES)).reshape(len(idx), AXES, n)
+        x = np.cumsum(d[take], axis=2).astype(SAMPLE_DTYPE).transpose(0, 2, 1)  # (B, N, 3)
+        for j, i in enumerate(idx):
+            out[i] = x[j]
+    return out
+
+
+def encode_samples(samples: np.ndarray) -> bytes:
+    """(N, 3) int16 samples -> DELTA_ENCODING payload."""
+    return encode_many([samples])[0]
+
+
+def decode_samples(payload) -> np.ndarray:
+    """DELTA_ENCODING payload -> (N, 3) int16 array."""
+    return decode_many([payload])[0]
+
+
+def decode_block(payload, encoding=RAW_ENCODING) -> np.ndarray:
+    """(N, 3) int16 samples of a stored payload; a zero-copy view for the firmware format."""
+    if encoding == RAW_ENCODING:
+        return decode_raw(payload)
+    if encoding == DELTA_ENCODING:
+        return decode_samples(payload)
+    raise ValueError(f"unknown raw block encoding {encoding}")
+
+
+def encode_rows(rows: list, encoding=RAW_BLOCK_ENCODING) -> list:
+    """
+    raw_blocks rows with firmware payloads -> rows stored in `encoding` (one batched encode per DB write).
+    Rows already in another encoding, or without whole samples, are left as they are.
+    """
+    if encoding == RAW_ENCODING:
+        return rows
+    if encoding != DELTA_ENCODING:
+        raise ValueError(f"unknown raw block encoding {encoding}")
+    todo = [i for i, r in enumerate(rows) if r.get("encoding") == RAW_ENCODING
+            and len(r["payload"]) % (AXES * SAMPLE_DTYPE.itemsize) == 0]
+    if not todo:
+        return rows
+    encoded = encode_many([decode_raw(rows[i]["payload"]) for i in todo])
+    rows = list(rows)
+    for i, payload in zip(todo, encoded):
+        rows[i] = dict(rows[i], payload=payload, encoding=DELTA_ENCODING)
+    return rows
+
+
+def decode_blocks(blocks: list) -> list:
+    """(N, 3) int16 samples for a list of {"payload", "encoding"} dicts, delta payloads decoded in one batch."""
+    out = [None] * len(blocks)
+    delta = []
+    for i, b in enumerate(blocks):
+        if b.get("encoding", RAW_ENCODING) == DELTA_ENCODING:
+            delta.append(i)
+        else:
+            out[i] = decode_block(b["payload"], b.get("encoding", RAW_ENCODING))
+    for i, samples in zip(delta, decode_many([blocks[i]["payload"] for i in delta]) if delta else []):
+        out[i] = samples
+    return out
@@ -0,0 +1,88 @@
+# asyncpg helpers for the standalone ingest service (ingest.py). Same tables and upsert semantics as db.py.
+import os
+import json
+import asyncpg
+from codec import encode_rows
+from db import DATABASE_URL, to_utc_datetime, fold_metric_rows
+from db import METRIC_COPY_COLUMNS, RAW_BLOCK_COPY_COLUMNS, METRIC_MERGE_SQL, RAW_BLOCK_MERGE_SQL
+
+INGEST_DB_POOL_MIN = int(os.getenv("INGEST_DB_POOL_MIN", "2"))
+INGEST_DB_POOL_MAX = int(os.getenv("INGEST_DB_POOL_MAX", "8"))
+
+
+def _asyncpg_dsn(url):
+    # SQLAlchemy style URLs ("postgresql+psycopg2://") are not understood by asyncpg
+    scheme, sep, rest = url.partition("://")
+    return "postgresql://" + rest if sep else url
+
+
+def _encode_jsonb(value):
+    # binary jsonb: version byte 1 + JSON text (metrics are already serialized by telemetry.metric_row)
+    return b"\x01" + (value if isinstance(value, str) else json.dumps(value)).encode("utf-8")
+
+
+async def _init_connection(conn):
+    # binary codec so jsonb columns also work with copy_records_to_table
+    await conn.set_type_codec("jsonb", encoder=_encode_jsonb, decoder=lambda b: json.loads(b[1:]),
+                              schema="pg_catalog", format="binary")
+
+
+async def create_pool():
+    return await asyncpg.create_pool(_asyncpg_dsn(DATABASE_URL), min_size=INGEST_DB_POOL_MIN,
+                                     max_size=INGEST_DB_POOL_MAX, init=_init_connection)
+
+
+async def _copy_merge(pool, target, columns, rows, merge_sql):
+    """
+    Binary COPY rows into a session-local staging table shaped like `target`, then run merge_sql
+    in the same transaction (async counterpart of db._copy_merge).
+    """
+    staging = f"stage_{target}"
+    names = [name for name, _ in columns]
+    records = [tuple(row.get(name) for name in names) for row in rows]
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute(f"CREATE TEMP TABLE IF NOT EXISTS {staging} (LIKE {target} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS")
+            await conn.copy_records_to_table(staging, records=records, columns=names)
+            await conn.execute(merge_sql)
+
+
+async def insert_metrics_bulk(pool, readings_list: list):
+    if not readings_list:
+        return
+    await _copy_merge(pool, "readings_parameters", METRIC_COPY_COLUMNS, fold_metric_rows(readings_list), METRIC_MERGE_SQL)
+
+
+async def insert_raw_blocks_bulk(pool, blocks: list):
+    """Duplicate (time, device_id, block_id) keys are ignored. Payloads may be memoryviews."""
+    if not blocks:
+        return
+    rows = [dict(b, time=to_utc_datetime(b.get("time"))) for b in encode_rows(blocks)]
+    await _copy_merge(pool, "raw_blocks", RAW_BLOCK_COPY_COLUMNS, rows, RAW_BLOCK_MERGE_SQL)
+
+
+async def insert_spectra_bulk(pool, spectra_list: list):
+    if not spectra_list:
+        return
+    args = [(to_utc_datetime(r.get("time")), r["device_id"], r["block_id"], r.get("sample_rate"), r.get("samples"),
+             r["rms_g"], r["band_edges_hz"], r["band_energy"], r["peak_hz"], r["peak_amp_g"]) for r in spectra_list]
+    async with pool.acquire() as conn:
+        await conn.executemany("""
+            INSERT INTO raw_spectra (time, device_id, block_id, sample_rate, samples,
+                                     rms_g, band_edges_hz, band_energy, peak_hz, peak_amp_g)
+            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
+            ON CONFLICT (time, device_id, block_id) DO NOTHING
+        """, args)
+
+
+async def insert_alerts_bulk(pool, alerts_list: list):
+    if not alerts_list:
+        return
+    args = [(a["device_id"], a.get("asset_id"), a.get("severity"), a.get("rule"), a.get("message"),
+             to_utc_datetime(a.get("created_at"))) for a in alerts_list]
+    async with pool.acquire() as conn:
+        await conn.executemany("""
+            INSERT INTO alerts (device_id, asset_id, severity, rule, message, created_at)
+            VALUES ($1, $2, $3, $4, $5, $6)
+            ON CONFLICT (device_id, rule, created_at) DO NOTHING
+        """, args)
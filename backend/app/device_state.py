@@ -0,0 +1,179 @@
+# Latest per-device state (last metrics, last raw block, last seen, online status), kept in memory
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from metrics import INGEST_LAG
+
+DEVICE_OFFLINE_SEC = float(os.getenv("DEVICE_OFFLINE_SEC", "120"))  # silent this long -> offline
+DEVICE_STATE_FLUSH_SEC = float(os.getenv("DEVICE_STATE_FLUSH_SEC", "5"))  # coalesced write-back to devices
+DEVICE_STATE_REFRESH_SEC = float(os.getenv("DEVICE_STATE_REFRESH_SEC", "10"))  # registry / state reload from devices
+
+_REGISTRY_FIELDS = ("name", "config", "created_by", "created_at")
+
+
+def _utc(ts):
+    return datetime.fromtimestamp(ts, tz=timezone.utc) if ts else None
+
+
+class DeviceStateCache:
+    """
+    device_id -> latest state. Ingest calls seen() for every device message; readers (/api/devices)
+    get the fleet from memory. Changed devices are written to the devices table by flush(), at most
+    once per device per flush, however many messages arrived in between.
+    Processes that do not ingest (INGEST_MODE=external API) keep it current with load() from the
+    devices table every DEVICE_STATE_REFRESH_SEC instead of querying per request.
+    """
+
+    def __init__(self, offline_after=DEVICE_OFFLINE_SEC):
+        self.offline_after = offline_after
+        self._devices = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self.last_flush = time.time()
+        self.last_load = 0.0
+        self.messages = 0
+
+    def _entry(self, device_id):
+        e = self._devices.get(device_id)
+        if e is None:
+            e = self._devices[device_id] = {"device_id": device_id, "last_seen": None, "last_metrics": None,
+                                            "last_metrics_at": None, "last_raw_block_id": None,
+                                            "flushed_status": None, "heard": False, "lag": None}
+        return e
+
+    def status(self, entry, now=None):
+        seen = entry["last_seen"]
+        return "online" if seen and (now or time.time()) - seen < self.offline_after else "offline"
+
+    def seen(self, device_id, metrics=None, metrics_at=None, raw_block_id=None, now=None):
+        """Record a message from device_id (telemetry metrics and/or a completed raw block id)."""
+        if not device_id:
+            return
+        now = now or time.time()
+        with self._lock:
+            self.messages += 1
+            e = self._entry(device_id)
+            e["last_seen"] = now
+            e["heard"] = True
+            if metrics is not None:
+                e["last_metrics"] = metrics
+                e["last_metrics_at"] = metrics_at or now
+                if metrics_at:
+                    e["lag"] = now - metrics_at
+                    INGEST_LAG.observe(e["lag"])
+            if raw_block_id is not None:
+                e["last_raw_block_id"] = raw_block_id
+            self._dirty.add(device_id)
+
+    def load(self, rows, now=None):
+        """
+        rows: dicts from db.get_device_states(). Registry fields are replaced; state fields only
+        when the row is newer than what this process has seen itself.
+        """
+        n = 0
+        with self._lock:
+            known = set()
+            for r in rows:
+                e = self._entry(r["device_id"])
+                known.add(r["device_id"])
+                for k in _REGISTRY_FIELDS:
+                    e[k] = r.get(k)
+                e["registered"] = True
+                last_seen = r["last_seen"].timestamp() if r.get("last_seen") else None
+                if last_seen and (e["last_seen"] is None or last_seen > e["last_seen"]):
+                    e["last_seen"] = last_seen
+                    e["last_metrics"] = r.get("last_metrics") or e["last_metrics"]
+                    e["last_metrics_at"] = r["last_metrics_at"].timestamp() if r.get("last_metrics_at") else e["last_metrics_at"]
+                    e["last_raw_block_id"] = r.get("last_raw_block_id") or e["last_raw_block_id"]
+                if e["flushed_status"] is None:
+                    e["flushed_status"] = r.get("status")
+                n += 1
+            for device_id, e in self._devices.items():
+                if device_id not in known:
+                    e["registered"] = False  # deleted, or not provisioned (yet)
+            self.last_load = now or time.time()
+        return n
+
+    def load_due(self, now=None):
+        return ((now or time.time()) - self.last_load) >= DEVICE_STATE_REFRESH_SEC
+
+    def _public(self, e, now):
+        return {
+            "device_id": e["device_id"],
+            "name": e.get("name"),
+            "status": self.status(e, now),
+            "last_seen": _utc(e["last_seen"]).isoformat() if e["last_seen"] else None,
+            "config": e.get("config"),
+            "last_metrics": e["last_metrics"],
+            "last_metrics_at": _utc(e["last_metrics_at"]).isoformat() if e["last_metrics_at"] else None,
+            "last_raw_block_id": e["last_raw_block_id"],
+        }
+
+    def get(self, device_id):
+        """Public state of a registered device plus its created_by, or None."""
+        with self._lock:
+            e = self._devices.get(device_id)
+            if e is None or not e.get("registered"):
+                return None
+            return dict(self._public(e, time.time()), created_by=e.get("created_by"))
+
+    def list(self, user_id=None, limit=100):
+        """Registered devices (of user_id if given), newest first, like db.get_all_devices."""
+        now = time.time()
+        with self._lock:
+            entries = [e for e in self._devices.values() if e.get("registered")
+                       and (user_id is None or e.get("created_by") == user_id)]
+            entries.sort(key=lambda e: e.get("created_at") or datetime.min.replace(tzinfo=timezone.utc), reverse=True)
+            return [self._public(e, now) for e in entries[:limit]]
+
+    def lags(self, limit=None):
+        """[(device_id, lag of the last reading, seconds since last seen)] of devices heard by this process, laggiest first."""
+        now = time.time()
+        with self._lock:
+            rows = [(d, e["lag"], now - e["last_seen"] if e["last_seen"] else None)
+                    for d, e in self._devices.items() if e["heard"]]
+        rows.sort(key=lambda r: max(r[1] or 0.0, r[2] or 0.0), reverse=True)
+        return rows[:limit] if limit else rows
+
+    def flush(self, save_fn, now=None):
+        """
+        Write changed devices with save_fn(list of {"device_id", "status", "last_seen", "last_metrics",
+        "last_metrics_at", "last_raw_block_id"}). Includes devices heard by this process that have
+        since gone silent, so their status flips to offline. Returns number saved.
+        """
+        now = now or time.time()
+        self.last_flush = now  # next attempt one interval later even if this one fails
+        with self._lock:
+            dirty = self._dirty
+            self._dirty = set()
+            for device_id, e in self._devices.items():
+                if e["heard"] and e["flushed_status"] != self.status(e, now):
+                    dirty.add(device_id)
+            rows = []
+            for device_id in dirty:
+                e = self._devices[device_id]
+                rows.append({"device_id": device_id, "status": self.status(e, now), "last_seen": _utc(e["last_seen"]),
+                             "last_metrics": e["last_metrics"], "last_metrics_at": _utc(e["last_metrics_at"]),
+                             "last_raw_block_id": e["last_raw_block_id"]})
+        try:
+            save_fn(rows)
+        except Exception:
+            # keep them dirty so the next flush retries
+            with self._lock:
+                self._dirty |= dirty
+            raise
+        with self._lock:
+            for r in rows:
+                self._devices[r["device_id"]]["flushed_status"] = r["status"]
+        return len(rows)
+
+    def flush_due(self, now=None):
+        return ((now or time.time()) - self.last_flush) >= DEVICE_STATE_FLUSH_SEC
+
+    def stats(self) -> dict:
+        now = time.time()
+        with self._lock:
+            online = sum(1 for e in self._devices.values() if self.status(e, now) == "online")
+            return {"devices": len(self._devices), "online": online, "dirty": len(self._dirty),
+                    "messages": self.messages}
@@ -0,0 +1,210 @@
+# Rule based fault detection: rules compiled per device, evaluated in memory with NumPy, alerts emitted on transitions
+import os
+import json
+import math
+import threading
+import numpy as np
+
+FAULT_RULES_FILE = os.getenv("FAULT_RULES_FILE")  # optional JSON list replacing DEFAULT_FAULT_RULES
+FAULT_RULES_REFRESH_SEC = float(os.getenv("FAULT_RULES_REFRESH_SEC", "300"))
+FAULT_ZSCORE_MIN_COUNT = int(os.getenv("FAULT_ZSCORE_MIN_COUNT", "300"))  # baseline samples before z-score rules fire
+
+# Rule fields:
+#   id, type: threshold | rate | zscore | band_ratio, severity: info / warning / critical
+#   metric (threshold/rate/zscore) or axis + band [lo, hi] Hz (band_ratio, ratio to the axis' total band energy)
+#   above (or below): trigger level, clear_below (or clear_above): hysteresis level, defaults to the trigger
+#   for_count: consecutive exceedances before raising, clear_count: consecutive clears before resetting
+DEFAULT_FAULT_RULES = [
+    {"id": "magnitude_peak_high", "type": "threshold", "metric": "magnitude_peak_g",
+     "above": 1.9, "clear_below": 1.7, "for_count": 2, "severity": "critical"},
+    {"id": "magnitude_rms_deviation", "type": "zscore", "metric": "magnitude_rms_g",
+     "above": 4.0, "clear_below": 2.0, "for_count": 3, "clear_count": 5, "severity": "warning"},
+]
+
+READING_RULE_TYPES = ("threshold", "rate", "zscore")
+_KIND = {"threshold": 0, "rate": 1, "zscore": 2}
+
+
+def load_default_rules():
+    if FAULT_RULES_FILE:
+        with open(FAULT_RULES_FILE) as f:
+            return json.load(f)
+    return DEFAULT_FAULT_RULES
+
+
+class _RuleArrays:
+    """Rules of one family (readings or spectra) as parallel NumPy arrays."""
+
+    def __init__(self, rules):
+        self.rules = rules
+        sign = np.array([1.0 if "below" not in r else -1.0 for r in rules])
+        trigger = np.array([float(r.get("above", r.get("below", math.inf))) for r in rules])
+        clear = np.array([float(r.get("clear_below", r.get("clear_above", t))) for r, t in zip(rules, trigger)])
+        # compare in "above" form: sign * value > sign * trigger
+        self.sign = sign
+        self.trigger = sign * trigger
+        self.clear = sign * clear
+        self.for_count = np.array([int(r.get("for_count", 1)) for r in rules])
+        self.clear_count = np.array([int(r.get("clear_count", 1)) for r in rules])
+
+    def __len__(self):
+        return len(self.rules)
+
+
+class CompiledRuleSet:
+    """Rules for one device, pre-split and vectorized so evaluation is index gathers + comparisons."""
+
+    def __init__(self, rules, asset_id=None):
+        self.asset_id = asset_id
+        self.signature = json.dumps(rules, sort_keys=True)
+        reading = [r for r in rules if r.get("type") in READING_RULE_TYPES]
+        spectral = [r for r in rules if r.get("type") == "band_ratio"]
+        self.readings = _RuleArrays(reading)
+        self.spectra = _RuleArrays(spectral)
+        self.metrics = sorted({r["metric"] for r in reading})
+        pos = {m: i for i, m in enumerate(self.metrics)}
+        self.metric_idx = np.array([pos[r["metric"]] for r in reading], dtype=np.intp)
+        self.kind = np.array([_KIND[r["type"]] for r in reading], dtype=np.int8)
+        self.zscore_rules = [i for i, r in enumerate(reading) if r["type"] == "zscore"]
+        self.band_axis = np.array([("ax", "ay", "az").index(r.get("axis", "ax")) for r in spectral], dtype=np.intp)
+        self.band_range = [tuple(r.get("band", (0, math.inf))) for r in spectral]
+
+
+class _DeviceState:
+    def __init__(self, ruleset):
+        self.ruleset = ruleset
+        self.prev_values = np.full(len(ruleset.metrics), np.nan)
+        self.prev_time = None
+        self.reading = [np.zeros(len(ruleset.readings), dtype=np.int32),
+                        np.zeros(len(ruleset.readings), dtype=np.int32),
+                        np.zeros(len(ruleset.readings), dtype=bool)]
+        self.spectra = [np.zeros(len(ruleset.spectra), dtype=np.int32),
+                        np.zeros(len(ruleset.spectra), dtype=np.int32),
+                        np.zeros(len(ruleset.spectra), dtype=bool)]
+
+
+def _step(arrays, state, x):
+    """
+    Debounce / hysteresis state machine over all rules of a family at once.
+    x: rule values (NaN = not evaluable this time). Returns indices of rules that just raised.
+    """
+    up, down, active = state
+    s = arrays.sign * x
+    with np.errstate(invalid="ignore"):
+        exceed = s > arrays.trigger
+        calm = s <= arrays.clear
+    up[:] = np.where(exceed, up + 1, 0)
+    down[:] = np.where(calm, down + 1, 0)
+    raised = ~active & (up >= arrays.for_count)
+    cleared = active & (down >= arrays.clear_count)
+    active[:] = (active | raised) & ~cleared
+    return np.flatnonzero(raised)
+
+
+class FaultEngine:
+    """
+    Evaluates readings and spectrum rows against per-device compiled rules.
+    compile() is called at startup and every FAULT_RULES_REFRESH_SEC, never per message.
+    Alerts are only produced when a rule transitions to active, so repeated exceedances are deduplicated.
+    """
+
+    def __init__(self, baselines=None):
+        self.baselines = baselines
+        self._default = CompiledRuleSet([])
+        self._index = {}
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def compile(self, default_rules, device_rows):
+        """
+        default_rules: list of rule dicts applied to every device.
+        device_rows: list of {"device_id", "asset_id", "fault_rules"} (see db.get_device_fault_rules);
+        device rules extend the defaults and replace default rules with the same id.
+        """
+        default_set = CompiledRuleSet(default_rules)
+        index = {}
+        for row in device_rows:
+            own = row.get("fault_rules") or []
+            if isinstance(own, str):
+                own = json.loads(own)
+            merged = {r["id"]: r for r in default_rules}
+            merged.update({r["id"]: r for r in own})
+            index[row["device_id"]] = CompiledRuleSet(list(merged.values()), asset_id=row.get("asset_id"))
+        with self._lock:
+            self._default = default_set
+            self._index = index
+            # keep debounce state (and active alerts) for devices whose rules did not change
+            self._states = {d: st for d, st in self._states.items()
+                            if st.ruleset.signature == index.get(d, default_set).signature}
+            for d, st in self._states.items():
+                st.ruleset = index.get(d, default_set)  # same rules, but asset_id may have changed
+        return len(index)
+
+    def _state(self, device_id):
+        st = self._states.get(device_id)
+        if st is None:
+            st = self._states[device_id] = _DeviceState(self._index.get(device_id, self._default))
+        return st
+
+    def _alerts(self, device_id, ruleset, arrays, raised, x, ts):
+        out = []
+        for i in raised:
+            r = arrays.rules[i]
+            what = r.get("metric") or f"{r.get('axis', 'ax')} band {r.get('band')} Hz ratio"
+            limit = float(arrays.sign[i] * arrays.trigger[i])
+            out.append({
+                "device_id": device_id,
+                "asset_id": ruleset.asset_id,
+                "severity": r.get("severity", "warning"),
+                "rule": r["id"],
+                "message": r.get("message") or f"{r['id']}: {what} {r['type']} value {x[i]:.4g} (limit {limit:.4g})",
+                "created_at": ts,
+            })
+        return out
+
+    def evaluate_reading(self, device_id, ts, metrics: dict):
+        """ts: aware datetime of the reading. Returns list of alert dicts (usually empty)."""
+        if not isinstance(metrics, dict):
+            return []
+        with self._lock:
+            st = self._state(device_id)
+            rs = st.ruleset
+            if not len(rs.readings):
+                return []
+            vals = np.array([metrics.get(m, np.nan) for m in rs.metrics], dtype=np.float64)
+            x = vals[rs.metric_idx]
+            # rate-of-change rules: units per second against the previous reading
+            if st.prev_time is not None:
+                dt = (ts - st.prev_time).total_seconds()
+                rate = (vals - st.prev_values) / dt if dt > 0 else np.full_like(vals, np.nan)
+            else:
+                rate = np.full_like(vals, np.nan)
+            x = np.where(rs.kind == 1, rate[rs.metric_idx], x)
+            for i in rs.zscore_rules:
+                metric = rs.readings.rules[i]["metric"]
+                base = self.baselines.get(device_id, metric) if self.baselines else None
+                z = base.zscore(x[i]) if base is not None and base.count >= FAULT_ZSCORE_MIN_COUNT else None
+                x[i] = np.nan if z is None else z
+            st.prev_values = vals
+            st.prev_time = ts
+            raised = _step(rs.readings, st.reading, x)
+            return self._alerts(device_id, rs, rs.readings, raised, x, ts) if len(raised) else []
+
+    def evaluate_spectrum(self, row: dict, ts):
+        """row: spectrum row (see spectrum.compute_spectra). Returns list of alert dicts."""
+        device_id = row.get("device_id")
+        with self._lock:
+            st = self._state(device_id)
+            rs = st.ruleset
+            if not len(rs.spectra):
+                return []
+            energy = np.asarray(row["band_energy"], dtype=np.float64)  # (3, bands)
+            edges = np.asarray(row["band_edges_hz"], dtype=np.float64)
+            total = energy.sum(axis=1)
+            x = np.empty(len(rs.spectra))
+            for i, (lo, hi) in enumerate(rs.band_range):
+                sel = (edges[:-1] >= lo) & (edges[1:] <= hi)
+                ax = rs.band_axis[i]
+                x[i] = energy[ax, sel].sum() / total[ax] if total[ax] > 0 else np.nan
+            raised = _step(rs.spectra, st.spectra, x)
+            return self._alerts(device_id, rs, rs.spectra, raised, x, ts) if len(raised) else []
@@ -0,0 +1,472 @@
+# Standalone MQTT ingest service (asyncio): subscription, reassembly, analysis hand-off and batched DB writes.
+# Runs as its own process so the Flask API can be served by any number of WSGI workers:
+#   python app/run.py ingest    (set INGEST_MODE=external on the API so it does not ingest too)
+# Several workers can share the fleet: INGEST_SHARE_GROUP, INGEST_WORKERS, INGEST_WORKER_INDEX (see routing.py)
+import os
+import ssl
+import json
+import time
+import signal
+import asyncio
+import functools
+import traceback
+
+import aiomqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+import db_async
+from db import wait_for_db, pool_stats, get_all_baselines, upsert_baselines, get_device_fault_rules
+from db import get_device_states, update_device_states_bulk
+from analysis import AnalysisExecutor
+from baseline import BaselineStore
+from device_state import DeviceStateCache
+from faults import FaultEngine, load_default_rules, FAULT_RULES_REFRESH_SEC
+from pipeline import IngestProcessor
+from live import LiveHub, LIVE_RELAY, LIVE_RELAY_RATE_HZ, LIVE_RELAY_MAX_PENDING, relay_topic
+from reassembly import ReassemblyBuffer
+from routing import DeviceRouter
+from telemetry import parse_topic, metric_item, raw_block_from_entry, TELEMETRY, RAW_META, RAW_CHUNK
+import metrics
+from metrics import MESSAGES
+from spill import Backpressure, WRITE_SPILL_DIR
+from wal import WriteAheadLog, WalTracker, WAL_DIR, WAL_CHECKPOINT_SEC
+from logs import sampled
+from mqtt_config import MQTT_HOST, MQTT_PORT, MQTT_USERNAME, MQTT_PASSWORD, MQTT_TOPIC_SUB, CA_FILE
+from mqtt_config import INGEST_MQTT_QOS, INGEST_MQTT_PERSISTENT, INGEST_MQTT_SESSION_EXPIRY_SEC
+
+INGEST_CLIENT_ID = os.getenv("INGEST_CLIENT_ID", "cm-ingest")
+INGEST_QUEUE_MAX = int(os.getenv("INGEST_QUEUE_MAX", "10000"))
+INGEST_RECONNECT_SEC = float(os.getenv("INGEST_RECONNECT_SEC", "5"))
+INGEST_STATS_LOG_SEC = float(os.getenv("INGEST_STATS_LOG_SEC", "60"))
+INGEST_YIELD_EVERY = int(os.getenv("INGEST_YIELD_EVERY", "100"))  # writer_loop items between event loop yields
+
+
+class LoggedQueue(asyncio.Queue):
+    """
+    aiomqtt message queue that appends every message to the WAL as it is queued: put_nowait() runs inside
+    paho's on_message callback and paho sends the QoS 1 PUBACK after that returns, so the ack follows the
+    append. Items are (message, lsn); append() holds the lsn until the consumer releases it.
+    """
+
+    def __init__(self, wal, maxsize=0):
+        super().__init__(maxsize)
+        self.wal = wal
+
+    def put_nowait(self, message):
+        lsn = self.wal.append(message.topic.value, message.payload) if self.wal is not None else None
+        super().put_nowait((message, lsn))
+
+
+class IngestService:
+    """
+    One event loop does the MQTT reading, reassembly and batching; DB writes go through an asyncpg
+    pool with one flush in flight per table, so a slow raw block COPY never stalls message intake.
+    Spectrum analysis stays in the process pool (AnalysisExecutor); results come back via the loop.
+    """
+
+    def __init__(self):
+        self.queue = asyncio.Queue(maxsize=INGEST_QUEUE_MAX)
+        # crash-safe intake (WAL_DIR): the log is opened in run(), after the router knows this worker's index
+        self.wal = None
+        self.wal_tracker = WalTracker()
+        self.reassembly = ReassemblyBuffer(wal_tracker=self.wal_tracker)
+        self.baselines = BaselineStore()
+        self.fault_engine = FaultEngine(baselines=self.baselines)
+        # live events for dashboards, relayed to the API processes over MQTT (see live.py)
+        self.live = LiveHub() if LIVE_RELAY else None
+        self.live_relay = self._subscribe_relay() if LIVE_RELAY else None
+        self.device_state = DeviceStateCache()
+        self.writers = {
+            "metrics": db_async.insert_metrics_bulk,
+            "raw_blocks": db_async.insert_raw_blocks_bulk,
+            "spectra": db_async.insert_spectra_bulk,
+            "alerts": db_async.insert_alerts_bulk,
+        }
+        self.router = DeviceRouter()
+        # overload policy in front of the queue; one spill journal directory per worker
+        self.backpressure = Backpressure(self.queue, asyncio.QueueFull, asyncio.QueueEmpty,
+                                         spill_dir=os.path.join(WRITE_SPILL_DIR, f"ingest-{self.router.index}")
+                                         if WRITE_SPILL_DIR else None,
+                                         on_release=lambda item: self.wal_tracker.release(item.get("lsn")))
+        self.processor = IngestProcessor(self.baselines, self.fault_engine, live=self.live,
+                                         on_failure=self.backpressure.spill_failed_batch)
+        self.wal_tracker.add_provider(self.processor.min_lsn)
+        # broker client ids must be unique, one per worker when sharing a subscription
+        self.client_id = f"{INGEST_CLIENT_ID}-{self.router.index}" if self.router.shared else INGEST_CLIENT_ID
+        self.pool = None
+        self.analysis = None
+        self.loop = None
+        self._flushing = {}  # batcher name -> running flush task
+        self.received = 0
+        self.mqtt_connected = False
+
+    # --- intake ---
+    def _enqueue(self, item):
+        # never waits: a full queue is handled by WRITE_QUEUE_POLICY (see spill.py)
+        self.wal_tracker.hold(item.get("lsn"))
+        self.backpressure.offer(item)
+
+    def _on_analysis_result(self, rows, blocks):
+        # called from the executor's result thread
+        self.loop.call_soon_threadsafe(self._analysis_done, rows, blocks)
+
+    def _analysis_done(self, rows, blocks):
+        # the SPECTRUM item takes over the blocks' WAL holds
+        lsns = [b["lsn"] for b in blocks if b.get("lsn") is not None]
+        if rows:
+            self._enqueue({"type": "SPECTRUM", "data": rows, "lsn": min(lsns) if lsns else None})
+        for lsn in lsns:
+            self.wal_tracker.release(lsn)
+
+    async def replay_wal(self):
+        """Feed the messages an earlier run logged but did not commit back through handle_message (before MQTT starts)."""
+        n = 0
+        for lsn, _, topic, payload in self.wal.replay():
+            topic = self.router.unwrap(topic) or topic  # logged as received, forwarded ones included
+            while self.queue.qsize() >= self.queue.maxsize // 2:
+                await asyncio.sleep(0.01)  # let writer_loop keep up instead of overflowing the queue
+            self.wal_tracker.hold(lsn)
+            try:
+                self.handle_message(topic, payload, lsn)
+            finally:
+                self.wal_tracker.release(lsn)
+            n += 1
+        print(f"[WAL] replayed {n} uncommitted messages from {self.wal.directory}", flush=True)
+
+    def handle_message(self, topic, payload, lsn=None):
+        """One device message (live or replayed from the WAL). lsn: its WAL record, held by the caller."""
+        self.received += 1
+        self.reassembly.maybe_sweep()
+        kind, device_id, block_id, chunk_index = parse_topic(topic)
+        MESSAGES.inc(kind or "other")
+        try:
+            if kind == TELEMETRY:
+                item = metric_item(device_id, json.loads(payload))
+                if not item["device_id"]:
+                    sampled("telemetry_no_device", f"[INGEST] telemetry missing device_id on {topic}")
+                    return
+                self._enqueue({"type": "METRIC", "data": item, "lsn": lsn})
+                self.device_state.seen(item["device_id"], metrics=item["metrics"],
+                                       metrics_at=float(item["ts_ms"]) / 1000.0 if item["ts_ms"] else None)
+            elif kind == RAW_META:
+                self.device_state.seen(device_id)
+                meta = json.loads(payload)
+                block_id = meta.get("id")
+                if not block_id or not meta.get("chunks"):
+                    sampled("meta_fields", f"[INGEST] raw/meta missing fields: {meta}")
+                    return
+                self._finish(device_id, block_id, self.reassembly.add_meta(device_id, block_id, meta, lsn=lsn))
+            elif kind == RAW_CHUNK:
+                if chunk_index is None:
+                    sampled("chunk_index", f"[INGEST] invalid chunk index in topic: {topic}")
+                    return
+                self.device_state.seen(device_id)
+                entry = self.reassembly.add_chunk(device_id, block_id, chunk_index, payload, lsn=lsn)
+                self._finish(device_id, block_id, entry)
+            else:
+                sampled("unhandled_topic", f"[INGEST] unhandled topic: {topic}")
+        except Exception as e:
+            sampled("message_error", f"[INGEST] error handling message on {topic}: {e}")
+
+    def _finish(self, device_id, block_id, entry):
+        if entry is None:
+            return
+        # the entry's WAL hold passes to the RAW_BLOCK item and the analysis (each takes its own)
+        lsn = entry.get("lsn")
+        try:
+            block = raw_block_from_entry(device_id, block_id, entry)
+            self._enqueue({"type": "RAW_BLOCK", "data": block, "lsn": lsn})
+            self.device_state.seen(device_id, raw_block_id=block_id)
+            if self.analysis is not None:
+                self.wal_tracker.hold(lsn)
+                if not self.analysis.submit(dict(block, lsn=lsn)):
+                    self.wal_tracker.release(lsn)
+                    sampled("analysis_full", f"[INGEST] analysis backlog full, block {block_id} not analyzed")
+        finally:
+            self.wal_tracker.release(lsn)
+
+    def register_metrics(self):
+        """/metrics collectors for this service's components (read at scrape time)."""
+        metrics.stats_collector("cm_write_queue", lambda: {"depth": self.queue.qsize(), "max": self.queue.maxsize})
+        metrics.stats_collector("cm_backpressure", self.backpressure.stats)
+        metrics.stats_collector("cm_wal", lambda: dict(self.wal.stats(), **self.wal_tracker.stats())
+                                if self.wal is not None else None)
+        metrics.stats_collector("cm_reassembly", self.reassembly.stats)
+        metrics.stats_collector("cm_batches", self.processor.stats)
+        metrics.stats_collector("cm_analysis", lambda: self.analysis.stats() if self.analysis is not None else None)
+        metrics.stats_collector("cm_device_state", self.device_state.stats)
+        metrics.stats_collector("cm_live", lambda: self.live.stats() if self.live is not None else None)
+        metrics.stats_collector("cm_routing", self.router.stats)
+        metrics.stats_collector("cm_db_pools", pool_stats)
+        metrics.stats_collector("cm_mqtt", lambda: {"connected": self.mqtt_connected})
+        metrics.device_collector(self.device_state)
+
+    def _subscribe_relay(self):
+        # rate limited like a dashboard client, so readings / spectra go out coalesced per device
+        return self.live.subscribe(None, max_rate=LIVE_RELAY_RATE_HZ, max_pending=LIVE_RELAY_MAX_PENDING)
+
+    async def live_relay_loop(self, client):
+        while True:
+            await asyncio.sleep(1.0 / LIVE_RELAY_RATE_HZ)
+            if self.live_relay.dropped:
+                print("[INGEST] live relay fell behind, events dropped", flush=True)
+                self.live_relay = self._subscribe_relay()
+            for device_id, kind, payload in self.live_relay.take():
+                await client.publish(relay_topic(device_id, kind), payload, qos=0)
+
+    async def mqtt_loop(self):
+        tls_context = ssl.create_default_context(cafile=CA_FILE)
+        while True:
+            try:
+                async with aiomqtt.Client(MQTT_HOST, MQTT_PORT, username=MQTT_USERNAME, password=MQTT_PASSWORD,
+                                          client_id=self.client_id, tls_context=tls_context, keepalive=60,
+                                          **self._session_args()) as client:
+                    queues = []  # the one messages() creates, drained below if the connection drops
+                    async with client.messages(queue_class=functools.partial(self._logged_queue, queues)) as messages:
+                        topics = self.router.subscriptions(MQTT_TOPIC_SUB)
+                        for topic in topics:
+                            await client.subscribe(topic, qos=INGEST_MQTT_QOS)
+                        self.mqtt_connected = True
+                        print(f"[INGEST] connected to {MQTT_HOST}:{MQTT_PORT} as {self.client_id}, subscribed to {topics}", flush=True)
+                        relay = asyncio.create_task(self.live_relay_loop(client)) if self.live is not None else None
+                        try:
+                            await self._consume(client, messages)
+                        finally:
+                            if relay is not None:
+                                relay.cancel()
+                            self._drain_unconsumed(queues)
+            except aiomqtt.MqttError as e:
+                self.mqtt_connected = False
+                print(f"[INGEST] MQTT connection lost ({e}); reconnecting in {INGEST_RECONNECT_SEC}s", flush=True)
+                await asyncio.sleep(INGEST_RECONNECT_SEC)
+
+    def _session_args(self):
+        if self.router.shared:  # shared subscriptions need MQTT 5: the session lives for an expiry interval
+            args = {"protocol": aiomqtt.ProtocolVersion.V5}
+            if INGEST_MQTT_PERSISTENT:
+                props = Properties(PacketTypes.CONNECT)
+                props.SessionExpiryInterval = INGEST_MQTT_SESSION_EXPIRY_SEC
+                args.update(clean_start=False, properties=props)
+            return args
+        return {"clean_session": not INGEST_MQTT_PERSISTENT}
+
+    def _logged_queue(self, queues, maxsize=0):
+        q = LoggedQueue(self.wal, maxsize)
+        queues.append(q)
+        return q
+
+    async def _consume(self, client, messages):
+        async for msg, lsn in messages:
+            try:
+                topic = msg.topic.value
+                original = self.router.unwrap(topic)
+                if original is None:
+                    # device-affine: raw meta and chunks of a block must reach the same worker
+                    owner = self.router.owner(parse_topic(topic)[1])
+                    if owner != self.router.index:
+                        await client.publish(self.router.forward_topic(owner, topic), msg.payload, qos=INGEST_MQTT_QOS)
+                        self.router.forwarded += 1
+                        continue
+                self.handle_message(original or topic, msg.payload, lsn)
+            finally:
+                self.wal_tracker.release(lsn)
+
+    def _drain_unconsumed(self, queues):
+        """Handle what was received (acknowledged, logged) but not consumed before the connection dropped."""
+        for q in queues:
+            while not q.empty():
+                msg, lsn = q.get_nowait()
+                try:
+                    topic = msg.topic.value
+                    self.handle_message(self.router.unwrap(topic) or topic, msg.payload, lsn)
+                finally:
+                    self.wal_tracker.release(lsn)
+
+    # --- writes ---
+    async def _flush(self, batcher):
+        batch, nbytes = batcher.take()
+        attempts = batcher.taken_attempts
+        t0 = time.perf_counter()
+        ok = True
+        error = None
+        try:
+            await self.writers[batcher.name](self.pool, batch)
+        except Exception as e:
+            ok = False
+            error = e
+            print(f"[INGEST ERROR] Failed to flush {batcher.name} batch ({len(batch)} items):", e)
+            traceback.print_exc()
+        batcher.record(len(batch), nbytes, time.perf_counter() - t0, ok)
+        if not ok:
+            batcher.failed(self.backpressure.spill_failed_batch(batcher.name, batch, attempts, error))
+
+    def _start_due_flushes(self, now):
+        for b in self.processor.due(now):
+            task = self._flushing.get(b.name)
+            if task is None or task.done():
+                # items keep collecting while a flush of the same table is in flight
+                self._flushing[b.name] = asyncio.create_task(self._flush(b))
+
+    def _flush_in_flight(self) -> bool:
+        return any(not t.done() for t in self._flushing.values())
+
+    async def writer_loop(self):
+        last_rules_refresh = time.time()
+        last_stats_log = time.time()
+        last_wal_checkpoint = time.time()
+        checkpoint = None  # sync DB call, runs in the default thread pool
+        state_flush = None  # same for the device state write-back
+        wal_checkpoint = None  # file I/O, same
+        since_yield = 0
+        while True:
+            try:
+                item = self.queue.get_nowait()
+                since_yield += 1
+                if since_yield >= INGEST_YIELD_EVERY:
+                    # a backlog (queue or spill journal replay) must not hold the loop: due flushes,
+                    # MQTT intake and the keepalive run here
+                    since_yield = 0
+                    await asyncio.sleep(0)
+            except asyncio.QueueEmpty:
+                since_yield = 0
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout=0.1)
+                except asyncio.TimeoutError:
+                    item = None
+            if item is not None:
+                try:
+                    self.processor.process(item)
+                except Exception as e:
+                    print(f"[INGEST ERROR] processing item: {e}")
+                    traceback.print_exc()
+                finally:
+                    # its rows are buffered in the batchers now, which keep the WAL position themselves
+                    self.wal_tracker.release(item.get("lsn"))
+
+            now = time.time()
+            self._start_due_flushes(now)
+            if not self._flush_in_flight():
+                # journaled items go back at the pace the DB takes them, not into ever larger batches
+                self.backpressure.replay(self.processor.healthy())
+
+            if self.baselines.checkpoint_due(now) and (checkpoint is None or checkpoint.done()):
+                checkpoint = self.loop.run_in_executor(None, self._checkpoint_baselines)
+            if self.device_state.flush_due(now) and (state_flush is None or state_flush.done()):
+                state_flush = self.loop.run_in_executor(None, self._flush_device_state)
+            if (now - last_rules_refresh) >= FAULT_RULES_REFRESH_SEC:
+                self.loop.run_in_executor(None, self.refresh_fault_rules)
+                last_rules_refresh = now
+            if self.wal is not None and (now - last_wal_checkpoint) >= WAL_CHECKPOINT_SEC \
+                    and (wal_checkpoint is None or wal_checkpoint.done()):
+                # the low-water mark is taken here, on the loop thread that owns the batchers
+                low_water = self.wal_tracker.low_water(self.wal.next_lsn)
+                wal_checkpoint = self.loop.run_in_executor(None, self._checkpoint_wal, low_water)
+                last_wal_checkpoint = now
+            if (now - last_stats_log) >= INGEST_STATS_LOG_SEC:
+                print("[INGEST] stats", self.stats(), flush=True)
+                last_stats_log = now
+
+    def _checkpoint_baselines(self):
+        try:
+            self.baselines.checkpoint(upsert_baselines)
+        except Exception as e:
+            print("[INGEST ERROR] Failed to checkpoint baselines:", e)
+
+    def _checkpoint_wal(self, low_water):
+        try:
+            self.wal.checkpoint(low_water)
+        except Exception as e:
+            print("[INGEST ERROR] Failed to checkpoint the WAL:", e)
+
+    def _flush_device_state(self):
+        try:
+            self.device_state.flush(update_device_states_bulk)
+        except Exception as e:
+            print("[INGEST ERROR] Failed to flush device state:", e)
+
+    def refresh_fault_rules(self):
+        try:
+            n = self.fault_engine.compile(load_default_rules(), get_device_fault_rules())
+            print(f"[FAULTS] compiled fault rules ({n} devices with own config)", flush=True)
+        except Exception as e:
+            print("[FAULTS] could not compile fault rules:", e, flush=True)
+
+    async def drain(self):
+        """Process what is queued and flush every batch (shutdown)."""
+        while not self.queue.empty():
+            item = self.queue.get_nowait()
+            self.processor.process(item)
+            self.wal_tracker.release(item.get("lsn"))
+        await asyncio.gather(*[t for t in self._flushing.values() if not t.done()])
+        await asyncio.gather(*(self._flush(b) for b in self.processor.batchers if len(b)))
+        self._checkpoint_baselines()
+        self._flush_device_state()
+        self.backpressure.close()
+        if self.wal is not None:
+            # open reassembly entries stay held: their messages are replayed on the next start
+            self._checkpoint_wal(self.wal_tracker.low_water(self.wal.next_lsn))
+            self.wal.close()
+
+    def stats(self) -> dict:
+        return {
+            "mqtt_connected": self.mqtt_connected,
+            "received": self.received,
+            "queued": self.queue.qsize(),
+            "backpressure": self.backpressure.stats(),
+            "wal": self.wal.stats() if self.wal is not None else None,
+            "batches": self.processor.stats(),
+            "routing": self.router.stats(),
+            "reassembly": self.reassembly.stats(),
+            "analysis": self.analysis.stats() if self.analysis is not None else None,
+            "device_state": self.device_state.stats(),
+            "live": self.live.stats() if self.live is not None else None,
+            "db_pools": pool_stats(),
+        }
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        await self.loop.run_in_executor(None, wait_for_db)
+        try:
+            print(f"[BASELINE] loaded {self.baselines.load(get_all_baselines())} baseline series", flush=True)
+        except Exception as e:
+            print("[BASELINE] could not load checkpointed baselines:", e, flush=True)
+        self.refresh_fault_rules()
+        try:
+            self.device_state.load(get_device_states())
+        except Exception as e:
+            print("[DEVICE STATE] could not load device state:", e, flush=True)
+        self.pool = await db_async.create_pool()
+        self.register_metrics()
+        metrics.start_http_server()
+        self.analysis = AnalysisExecutor(on_result=self._on_analysis_result).start()
+
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            self.loop.add_signal_handler(sig, stop.set)
+        tasks = [asyncio.create_task(self.writer_loop())]
+        if WAL_DIR:
+            # what the last run logged but did not commit goes in before any new message
+            self.wal = WriteAheadLog(os.path.join(WAL_DIR, f"ingest-{self.router.index}"), tracker=self.wal_tracker)
+            await self.replay_wal()
+        tasks.append(asyncio.create_task(self.mqtt_loop()))
+        await stop.wait()
+
+        print("[INGEST] shutting down", flush=True)
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # let in-flight analysis batches finish; their results are queued via the loop
+        await self.loop.run_in_executor(None, self.analysis.shutdown)
+        await self.drain()
+        await self.pool.close()
+
+
+def serve():
+    """Entry point: python app/run.py ingest"""
+    asyncio.run(IngestService().run())
+
+
+if __name__ == "__main__":
+    # prefer app/run.py: analysis workers re-import __main__, which should not be this module (see run.py)
+    serve()
@@ -0,0 +1,247 @@
+# Live push of readings, alerts and spectrum summaries to dashboards (Server-Sent Events, /api/live)
+# Events come from the ingest pipeline, never from DB polling:
+#   INGEST_MODE=embedded  IngestProcessor publishes straight into this process' LiveHub
+#   INGEST_MODE=external  the ingest service relays coalesced events over MQTT (<LIVE_TOPIC_PREFIX>/<device>/<kind>)
+#                         and every API process runs one subscriber that feeds its own LiveHub
+import os
+import json
+import time
+import threading
+from collections import deque
+
+LIVE_MAX_RATE_HZ = float(os.getenv("LIVE_MAX_RATE_HZ", "2"))  # deliveries per second per client (0 = unthrottled)
+LIVE_CLIENT_MAX_PENDING = int(os.getenv("LIVE_CLIENT_MAX_PENDING", "500"))  # undelivered alerts before a client is dropped
+LIVE_MAX_CLIENTS = int(os.getenv("LIVE_MAX_CLIENTS", "1000"))
+LIVE_HEARTBEAT_SEC = float(os.getenv("LIVE_HEARTBEAT_SEC", "15"))
+LIVE_TOPIC_PREFIX = os.getenv("LIVE_TOPIC_PREFIX", "cm/live")
+LIVE_RELAY = os.getenv("LIVE_RELAY", "1") not in ("0", "false", "no")  # ingest service relays events over MQTT
+LIVE_RELAY_RATE_HZ = float(os.getenv("LIVE_RELAY_RATE_HZ", "5"))  # relay publishes per device and kind
+LIVE_RELAY_MAX_PENDING = int(os.getenv("LIVE_RELAY_MAX_PENDING", "10000"))
+
+READING, SPECTRUM, ALERT = "reading", "spectrum", "alert"
+COALESCED_KINDS = (READING, SPECTRUM)  # only the latest per device is worth sending; alerts are all delivered
+
+
+def _json_default(o):
+    return o.isoformat() if hasattr(o, "isoformat") else str(o)
+
+
+class LiveSubscription:
+    """
+    One client's view of the hub. offer() never blocks the publisher: readings / spectra coalesce to the
+    latest per device, alerts queue up to max_pending, beyond which the client is marked dropped.
+    """
+
+    def __init__(self, device_ids=None, max_rate=LIVE_MAX_RATE_HZ, max_pending=LIVE_CLIENT_MAX_PENDING):
+        self.device_ids = frozenset(device_ids) if device_ids else None  # None = every device
+        self.min_interval = 1.0 / max_rate if max_rate > 0 else 0.0
+        self.max_pending = max_pending
+        self._latest = {}  # (device_id, kind) -> event, coalesced
+        self._queue = deque()  # non-coalesced events in order
+        self._cond = threading.Condition()
+        self.last_delivery = 0.0
+        self.delivered = 0
+        self.coalesced = 0
+        self.dropped = False
+        self.closed = False
+
+    def offer(self, event):
+        """event: (device_id, kind, json string). Returns False if this client is too slow and must go."""
+        device_id, kind, _ = event
+        with self._cond:
+            if self.dropped or self.closed:
+                return False
+            if kind in COALESCED_KINDS:
+                if (device_id, kind) in self._latest:
+                    self.coalesced += 1
+                self._latest[(device_id, kind)] = event
+            elif len(self._queue) >= self.max_pending:
+                self.dropped = True
+                self._cond.notify()
+                return False
+            else:
+                self._queue.append(event)
+            self._cond.notify()
+        return True
+
+    def _take(self):
+        events = list(self._queue) + list(self._latest.values())
+        self._queue.clear()
+        self._latest.clear()
+        self.delivered += len(events)
+        self.last_delivery = time.monotonic()
+        return events
+
+    def take(self):
+        """Pending events now, ignoring the rate limit (relay use)."""
+        with self._cond:
+            return self._take()
+
+    def next_batch(self, timeout):
+        """
+        Block until events are pending and min_interval has passed since the last delivery, or until
+        `timeout`. Returns a list of events ([] on timeout), or None once the client is dropped / closed.
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                if self.dropped or self.closed:
+                    return None
+                now = time.monotonic()
+                ready_at = self.last_delivery + self.min_interval
+                if (self._queue or self._latest) and now >= ready_at:
+                    return self._take()
+                if now >= deadline:
+                    return []
+                wait = deadline - now
+                if self._queue or self._latest:
+                    wait = min(wait, ready_at - now)
+                self._cond.wait(wait)
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {"devices": len(self.device_ids) if self.device_ids else "all", "delivered": self.delivered,
+                    "coalesced": self.coalesced, "pending": len(self._queue) + len(self._latest),
+                    "dropped": self.dropped}
+
+
+class LiveHub:
+    """
+    Fan-out of pipeline events to subscriptions, indexed by device so a publish only touches the
+    clients watching that device. Each event is serialized once, whatever the number of clients.
+    """
+
+    def __init__(self, max_clients=LIVE_MAX_CLIENTS):
+        self.max_clients = max_clients
+        self._by_device = {}
+        self._all = set()
+        self._subs = set()
+        self._lock = threading.Lock()
+        self.published = 0
+        self.dropped_clients = 0
+
+    def subscribe(self, device_ids=None, **kwargs):
+        """New LiveSubscription (see its arguments). Raises RuntimeError when LIVE_MAX_CLIENTS are connected."""
+        sub = LiveSubscription(device_ids, **kwargs)
+        with self._lock:
+            if len(self._subs) >= self.max_clients:
+                raise RuntimeError(f"live stream limit of {self.max_clients} clients reached")
+            self._subs.add(sub)
+            if sub.device_ids is None:
+                self._all.add(sub)
+            else:
+                for d in sub.device_ids:
+                    self._by_device.setdefault(d, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        sub.close()
+        with self._lock:
+            self._subs.discard(sub)
+            self._all.discard(sub)
+            for d in sub.device_ids or ():
+                subs = self._by_device.get(d)
+                if subs is not None:
+                    subs.discard(sub)
+                    if not subs:
+                        del self._by_device[d]
+
+    def publish_json(self, device_id, kind, payload):
+        """Fan out an already serialized event (payload: JSON string)."""
+        with self._lock:
+            targets = list(self._all) + list(self._by_device.get(device_id, ()))
+        if not targets:
+            return
+        self.published += 1
+        event = (device_id, kind, payload)
+        for sub in targets:
+            if not sub.offer(event) and sub.dropped:
+                # slow consumer: stop feeding it; its stream ends on the next next_batch()
+                self.unsubscribe(sub)
+                self.dropped_clients += 1
+                print(f"[LIVE] dropped slow client ({sub.max_pending} undelivered events)", flush=True)
+
+    def publish(self, device_id, kind, data):
+        if not device_id:
+            return
+        with self._lock:
+            if not self._all and device_id not in self._by_device:
+                return  # nobody is watching: skip the serialization
+        self.publish_json(device_id, kind, json.dumps(data, default=_json_default))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"clients": len(self._subs), "watched_devices": len(self._by_device),
+                    "published": self.published, "dropped_clients": self.dropped_clients}
+
+
+# --- pipeline -> hub
+
+def reading_event(row, metrics):
+    return {"time": row["time"], "metrics": metrics}
+
+
+def spectrum_event(row):
+    """Dashboard sized summary of a raw_spectra row (no band matrix)."""
+    return {"time": row.get("time"), "block_id": row.get("block_id"), "rms_g": row.get("rms_g"),
+            "peak_hz": row.get("peak_hz"), "peak_amp_g": row.get("peak_amp_g")}
+
+
+def alert_event(alert):
+    return {k: alert.get(k) for k in ("severity", "rule", "message", "created_at")}
+
+
+# --- MQTT relay between the ingest service and API processes (INGEST_MODE=external)
+
+def relay_topic(device_id, kind):
+    return f"{LIVE_TOPIC_PREFIX}/{device_id}/{kind}"
+
+
+def parse_relay_topic(topic):
+    """(device_id, kind) of a relay topic, or (None, None)."""
+    rest = topic[len(LIVE_TOPIC_PREFIX) + 1:] if topic.startswith(LIVE_TOPIC_PREFIX + "/") else ""
+    device_id, _, kind = rest.rpartition("/")
+    return (device_id, kind) if device_id and kind in (READING, SPECTRUM, ALERT) else (None, None)
+
+
+_subscriber = None
+_subscriber_lock = threading.Lock()
+
+
+def ensure_mqtt_subscriber(hub):
+    """
+    Start (once per process) a paho client that feeds `hub` from the ingest service's relay topics.
+    Lazy, so it also runs under WSGI servers where __main__ does not.
+    """
+    global _subscriber
+    with _subscriber_lock:
+        if _subscriber is not None:
+            return _subscriber
+        import paho.mqtt.client as mqtt
+        from mqtt_config import MQTT_HOST, MQTT_PORT, MQTT_USERNAME, MQTT_PASSWORD, CLIENT_ID, CA_FILE
+
+        def on_connect(client, userdata, flags, rc):
+            print(f"[LIVE] relay subscriber connected rc={rc}", flush=True)
+            if rc == 0:
+                client.subscribe(f"{LIVE_TOPIC_PREFIX}/#", qos=0)
+
+        def on_message(client, userdata, msg):
+            device_id, kind = parse_relay_topic(msg.topic)
+            if device_id:
+                hub.publish_json(device_id, kind, msg.payload.decode("utf-8"))
+
+        client = mqtt.Client(client_id=f"{CLIENT_ID}-live-{os.getpid()}", protocol=mqtt.MQTTv311)
+        client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
+        if CA_FILE and os.path.isfile(CA_FILE):
+            client.tls_set(ca_certs=CA_FILE)
+        client.on_connect = on_connect
+        client.on_message = on_message
+        client.connect_async(MQTT_HOST, MQTT_PORT, keepalive=60)
+        client.loop_start()
+        _subscriber = client
+        return client
@@ -0,0 +1,34 @@
+# Level-gated and sampled logging for hot paths (per-message code must not pay for a stdout write each time)
+#   LOG_LEVEL=DEBUG  per-message lines (queued telemetry, reassembly progress, paho client log)
+#   LOG_LEVEL=INFO   default: repeated warnings / errors at most once per LOG_SAMPLE_SEC per kind
+import os
+import threading
+import time
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_SAMPLE_SEC = float(os.getenv("LOG_SAMPLE_SEC", "10"))
+DEBUG = LOG_LEVEL == "DEBUG"
+
+_last = {}  # key -> [last printed at, suppressed since]
+_lock = threading.Lock()
+
+
+def debug(msg):
+    if DEBUG:
+        print(msg)
+
+
+def sampled(key, msg):
+    """Print msg unless `key` was printed less than LOG_SAMPLE_SEC ago; the next line reports how many were skipped."""
+    if DEBUG:
+        print(msg)
+        return
+    now = time.monotonic()
+    with _lock:
+        entry = _last.get(key)
+        if entry is not None and now - entry[0] < LOG_SAMPLE_SEC:
+            entry[1] += 1
+            return
+        suppressed = entry[1] if entry is not None else 0
+        _last[key] = [now, 0]
+    print(f"{msg} (+{suppressed} similar suppressed)" if suppressed else msg, flush=True)
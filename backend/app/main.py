@@ -1,4 +1,4 @@
-from flask import Flask, jsonify, request, make_response
+from flask import Flask, jsonify, request, make_response, Response, stream_with_context
 from flask_jwt_extended import JWTManager, jwt_required, get_jwt_identity, get_jwt, create_access_token, get_jti
 import paho.mqtt.client as mqtt
 import os
@@ -7,17 +7,43 @@ import time
 import traceback
 from dotenv import load_dotenv
 import json
-from queue import Queue, Empty
+from queue import Queue, Empty, Full
 import secrets
 from datetime import datetime, timedelta, timezone
 from flask_cors import CORS
 from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
 #import db and auth helpers
-from db import engine, get_user_by_email, insert_user, insert_refresh_token, revoke_refresh_token, is_refresh_token_revoked
+from db import engine, pool_stats, insert_refresh_token
 from db import get_device_by_device_id, insert_device, insert_device_credentials, get_active_credentials_for_device
-from db import insert_metrics_bulk, get_recent_metrics, get_all_devices
-from db import wait_for_db, insert_raw_block
-from auth import hash_password, verify_password, build_tokens
+from db import insert_metrics_bulk, get_recent_metrics
+from db import get_metrics_range, get_downsampled_metrics, pick_reading_aggregate
+from db import wait_for_db, insert_raw_blocks_bulk, insert_spectra_bulk
+from db import get_all_baselines, upsert_baselines
+from db import get_device_fault_rules, insert_alerts_bulk
+from db import get_device_states, update_device_states_bulk
+from analysis import AnalysisExecutor
+from pipeline import IngestProcessor
+from telemetry import parse_topic, metric_item, raw_block_from_entry, TELEMETRY, RAW_META, RAW_CHUNK
+from reassembly import ReassemblyBuffer
+from baseline import BaselineStore
+from device_state import DeviceStateCache
+from live import LiveHub, ensure_mqtt_subscriber, LIVE_MAX_RATE_HZ, LIVE_HEARTBEAT_SEC
+from faults import FaultEngine, load_default_rules, FAULT_RULES_REFRESH_SEC
+from auth import hash_password, verify_password, build_tokens, hasher, AuthBusy
+from auth_cache import user_by_email, create_user, is_revoked, revoke, ensure_token_sweeper
+from auth_cache import stats as auth_cache_stats
+from rate_limit import check_auth_rate
+from rate_limit import stats as rate_limit_stats
+from storage import get_storage_report
+from raw_export import EXPORT_FORMATS, check_format, find_raw_block, export_raw_blocks
+import metrics
+from metrics import MESSAGES
+from spill import Backpressure, WRITE_SPILL_DIR
+from wal import WriteAheadLog, WalTracker, WAL_DIR, WAL_CHECKPOINT_SEC
+from logs import debug, sampled, DEBUG as LOG_DEBUG
+from mqtt_config import MQTT_HOST, MQTT_PORT, MQTT_USERNAME, MQTT_PASSWORD, MQTT_TOPIC_SUB, CLIENT_ID, CA_FILE
+from mqtt_config import INGEST_MQTT_QOS, INGEST_MQTT_PERSISTENT
 # Load environment variables from .env file
 load_dotenv()
 
@@ -31,6 +57,17 @@ CORS(app, resources={r"/api/*": {"origins": ["http://localhost:5173"]}})
 
 # Creating a in memmory queue and worker to perform DB writes off the MQTT thread
 write_queue = Queue(maxsize=1000)
+# Running per-device baselines, fed by db_writer_worker and checkpointed to device_baselines
+baselines = BaselineStore()
+# Fault rules compiled per device; evaluated in db_writer_worker, alerts inserted in batches
+fault_engine = FaultEngine(baselines=baselines)
+
+def refresh_fault_rules():
+    try:
+        n = fault_engine.compile(load_default_rules(), get_device_fault_rules())
+        print(f"[FAULTS] compiled fault rules ({n} devices with own config)", flush=True)
+    except Exception as e:
+        print("[FAULTS] could not compile fault rules:", e, flush=True)
 
 import time
 from datetime import datetime, timezone
@@ -38,25 +75,48 @@ import json
 
 import psycopg2
 
+WORKER_STATS_LOG_SEC = float(os.getenv("WORKER_STATS_LOG_SEC", "60"))
+
+# Fan-out of new readings / spectra / alerts to /api/live clients (fed by processor when ingest is embedded)
+live_hub = LiveHub()
+
+# Crash-safe ingest: messages are logged before they are handled and replayed on startup until their
+# rows are committed (WAL_DIR, see wal.py). The log is opened in __main__; the tracker knows what is pending.
+wal = None
+wal_tracker = WalTracker()
+
+# Overload policy in front of write_queue (drop oldest / newest, or spill to disk and replay; see spill.py)
+write_backpressure = Backpressure(write_queue, Full, Empty, task_done=True,
+                                  spill_dir=os.path.join(WRITE_SPILL_DIR, "embedded") if WRITE_SPILL_DIR else None,
+                                  on_release=lambda item: wal_tracker.release(item.get("lsn")))
+
+# Item handling and per-table batches (module level so their stats can be inspected)
+processor = IngestProcessor(baselines, fault_engine, live=live_hub,
+                            on_failure=write_backpressure.spill_failed_batch, writers={
+    "metrics": insert_metrics_bulk,
+    "raw_blocks": insert_raw_blocks_bulk,
+    "spectra": insert_spectra_bulk,
+    "alerts": insert_alerts_bulk,
+})
+wal_tracker.add_provider(processor.min_lsn)
+
 def db_writer_worker():
     """
     Worker that:
      - collects METRIC items and bulk-inserts them periodically
-     - inserts RAW_BLOCK items immediately (they are binary and should not be batched with metrics)
-    Expected queue items:
-      1) {"type": "METRIC", "data": { "device_id":..., "ts_ms":..., "sample_rate_hz":..., "samples":..., "metrics": {...} } }
-      2) {"type": "RAW_BLOCK", "data": { "block_id":..., "device_id":..., "time": ms-or-datetime, "sample_rate":..., "samples":..., "encoding":..., "payload": bytes, "crc32": ... } }
-      3) (legacy) or plain metric dicts { "device_id":..., "ts_ms":..., ... }  <-- supported for backward compat
+     - collects RAW_BLOCK items in a separate size/byte/time bounded batch (multi-row insert or COPY)
+     - collects SPECTRUM result batches from the analysis executor and bulk-inserts them
+     - updates the per-device baselines from METRIC and SPECTRUM items and checkpoints them periodically
+     - evaluates fault rules on METRIC and SPECTRUM items and bulk-inserts raised alerts
+    Item handling lives in pipeline.IngestProcessor (shared with the async ingest service).
     """
-    BATCH_SIZE = 100
-    BATCH_TIMEOUT = 1.0
-
-    metric_buffer = []
-    last_flush = time.time()
+    last_rules_refresh = time.time()
+    last_stats_log = time.time()
+    last_wal_checkpoint = time.time()
 
     while True:
         try:
-            item = write_queue.get(timeout=0.5)
+            item = write_queue.get(timeout=0.1)
         except Empty:
             item = None
 
@@ -68,95 +128,69 @@ def db_writer_worker():
                 break
 
             try:
-                # normalize formats
-                if isinstance(item, dict) and "type" in item:
-                    typ = item["type"]
-                    data = item.get("data", {}) or {}
-                else:
-                    # legacy: plain metric dict; treat as METRIC
-                    typ = "METRIC"
-                    data = item
-
-                if typ == "METRIC":
-                    # extract fields (safe access with defaults)
-                    ts_ms = data.get("ts_ms") or data.get("time") or None
-                    device_id = data.get("device_id")
-                    sample_rate = data.get("sample_rate_hz") or data.get("sample_rate")
-                    samples = data.get("samples")
-                    metrics_obj = data.get("metrics") or data.get("metrics_json") or None
-
-                    # skip invalid metrics (avoid NULL device_id)
-                    if not device_id:
-                        print(f"[DB_WORKER] skipping METRIC with missing device_id: {data}")
-                    else:
-                        # metrics must be JSON serializable string or dict; store JSON string
-                        metrics_json = json.dumps(metrics_obj) if (metrics_obj is not None and not isinstance(metrics_obj, str)) else metrics_obj
-                        # Normalize time to datetime UTC here (same logic as insert_metrics_bulk expects)
-                        if isinstance(ts_ms, (int, float)):
-                            ts = datetime.fromtimestamp(float(ts_ms) / 1000.0, tz=timezone.utc)
-                        elif isinstance(ts_ms, datetime):
-                            ts = ts_ms if ts_ms.tzinfo else ts_ms.replace(tzinfo=timezone.utc)
-                        else:
-                            ts = datetime.now(tz=timezone.utc)
-
-                        metric_buffer.append({
-                            "time": ts,
-                            "device_id": device_id,
-                            "sample_rate": sample_rate,
-                            "samples": samples,
-                            "metrics": metrics_json
-                        })
-
-                elif typ == "RAW_BLOCK":
-                    d = data
-                    # validate minimal fields
-                    if not d.get("device_id") or not d.get("block_id") or not d.get("payload"):
-                        print(f"[DB_WORKER] skipping RAW_BLOCK with missing fields: {d.keys()}")
-                    else:
-                        # Insert raw block immediately
-                        try:
-                            insert_raw_block(
-                                block_id=d["block_id"],
-                                device_id=d["device_id"],
-                                time_ts_ms=d.get("time") or d.get("ts_ms"),
-                                sample_rate=d.get("sample_rate"),
-                                samples=d.get("samples"),
-                                encoding=d.get("encoding", "int16_binary"),
-                                payload_bytes=d["payload"],
-                                crc32=d.get("crc32")
-                            )
-                        except Exception as e:
-                            print("[DB_WORKER] insert_raw_block failed:", e)
-                            import traceback; traceback.print_exc()
-
-                else:
-                    print(f"[DB_WORKER] unknown item type: {typ}")
-
+                processor.process(item)
             except Exception as e:
                 print(f"[DB_WORKER ERROR] processing item: {e}")
                 import traceback; traceback.print_exc()
             finally:
+                # its rows are buffered in the batchers now, which keep the WAL position themselves
+                wal_tracker.release(item.get("lsn"))
                 # mark the queue item done
                 try:
                     write_queue.task_done()
                 except Exception:
                     pass
 
-        # Flush metrics buffer if full or timed out
+        # Flush each batch independently when it is full or timed out
         now = time.time()
-        if metric_buffer and (len(metric_buffer) >= BATCH_SIZE or (now - last_flush) >= BATCH_TIMEOUT):
+        for b in processor.due(now):
+            b.flush()
+        # journaled backlog goes back into the queue once it has room and the DB takes writes again
+        write_backpressure.replay(processor.healthy())
+
+        if baselines.checkpoint_due(now):
             try:
-                # insert_metrics_bulk expects a list of dicts with keys: time, device_id, sample_rate, samples, metrics
-                insert_metrics_bulk(metric_buffer)
+                baselines.checkpoint(upsert_baselines)
             except Exception as e:
-                print("[DB_WORKER ERROR] Failed to insert metric batch:", e)
-                import traceback; traceback.print_exc()
-            finally:
-                metric_buffer = []
-                last_flush = now
+                print("[DB_WORKER ERROR] Failed to checkpoint baselines:", e)
+
+        if device_state.flush_due(now):
+            try:
+                device_state.flush(update_device_states_bulk, now)
+            except Exception as e:
+                print("[DB_WORKER ERROR] Failed to flush device state:", e)
+
+        if (now - last_rules_refresh) >= FAULT_RULES_REFRESH_SEC:
+            refresh_fault_rules()
+            last_rules_refresh = now
+
+        if wal is not None and (now - last_wal_checkpoint) >= WAL_CHECKPOINT_SEC:
+            try:
+                wal.checkpoint(wal_tracker.low_water(wal.next_lsn))
+            except Exception as e:
+                print("[DB_WORKER ERROR] Failed to checkpoint the WAL:", e)
+            last_wal_checkpoint = now
+
+        if (now - last_stats_log) >= WORKER_STATS_LOG_SEC:
+            print("[DB_WORKER] stats", processor.stats(), "backpressure", write_backpressure.stats(),
+                  "wal", wal.stats() if wal is not None else None, "db_pools", pool_stats(), flush=True)
+            last_stats_log = now
 
 
 #------------Authentication endpoints
+def too_many_requests(wait):
+    resp = jsonify({"msg": "Too many attempts, try again later"})
+    resp.headers["Retry-After"] = str(max(1, int(wait + 0.999)))
+    return resp, 429
+
+@app.errorhandler(AuthBusy)
+def auth_busy(e):
+    # bcrypt pool saturated: fail fast instead of tying up a request thread
+    print(f"[AUTH] {e}", flush=True)
+    resp = jsonify({"msg": "Authentication service busy, try again"})
+    resp.headers["Retry-After"] = "1"
+    return resp, 503
+
 @app.route("/api/auth/signup", methods=["POST"])
 def signup():
     data = request.get_json() or {}
@@ -166,8 +200,11 @@ def signup():
     role = data.get("role", "technician")  # default role
     if not email or not password or not username:
         return jsonify({"msg": "Missing email, password or username"}), 400
+    wait = check_auth_rate(request.remote_addr)
+    if wait:
+        return too_many_requests(wait)
     # Check if user already exists
-    if get_user_by_email(email):
+    if user_by_email(email):
         return jsonify({"msg": "User already exists"}), 409
     # Hash password and insert user
     try:
@@ -175,7 +212,11 @@ def signup():
     except ValueError as e:
         return jsonify({"msg": str(e)}), 400
     
-    insert_user(username, email, pw_hash, role)
+    try:
+        create_user(username, email, pw_hash, role)
+    except IntegrityError:
+        # signed up concurrently (the existence check above may be a cached miss)
+        return jsonify({"msg": "User already exists"}), 409
     return jsonify({"msg": "User created successfully"}), 201
 
 @app.route("/api/auth/login", methods=["POST"])
@@ -185,7 +226,12 @@ def login():
     password = data.get("password")
     if not email or not password:
         return jsonify({"msg": "Missing email or password"}), 400
-    user = get_user_by_email(email)
+    # limit guesses per client and per account before any DB or bcrypt work
+    wait = check_auth_rate(request.remote_addr, email)
+    if wait:
+        return too_many_requests(wait)
+    ensure_token_sweeper()
+    user = user_by_email(email)
     if not user:
         return jsonify({"msg": "invalid email or password"}), 401
     user_id = user.get("id")
@@ -209,8 +255,8 @@ def refresh():
     identity = get_jwt_identity()
     claims = get_jwt()
     jti = claims.get("jti")
-    # if jti is revoked, reject
-    if is_refresh_token_revoked(jti):
+    # if jti is revoked, reject (cached, so tabs refreshing together cost one lookup)
+    if is_revoked(jti):
         return jsonify({"msg": "Token has been revoked"}), 401
     # re-issue access token using same identity and additional claims
     additional = {k: claims.get(k) for k in ("email", "role", "username") if claims.get(k) is not None}
@@ -223,8 +269,8 @@ def refresh():
 def logout():
     claims = get_jwt()
     jti = claims.get("jti")
-    # mark this jti as revoked in DB
-    revoke_refresh_token(jti)
+    # mark this jti as revoked in DB and in the revocation cache
+    revoke(jti)
     return jsonify({"msg": "Refresh token revoked"}), 200
 
 # --- Device provisioning endpoints ---
@@ -264,6 +310,7 @@ def provision_device():
     if not device:
         # insert minimal device row and record created_by
         insert_device(device_id, name=device_id, config={"fw_version": fw, "mac": mac}, created_by=created_by)
+        device_state.last_load = 0  # reload the registry on the next read
     else:
         # optional: update last known fw/mac into config
         try:
@@ -300,37 +347,35 @@ def provision_device():
     return jsonify(resp), 200
 
 # --- MQTT stuff ---
-def read_env_val(name, alt=None, required=False, default=None):
-    val = os.getenv(name, alt)
-    if not val and alt:
-        val = os.getenv(alt)
-    if (not val) and (default is not None):
-        val = default
-    if required and (not val):
-        return RuntimeError(f"Required env variable not set: {name} (alt: {alt})")
-    return val
-
-# MQTT Configuration
-MQTT_HOST = read_env_val("MQTT_HOST", alt="MQTT_BROKER" ,required=True)
-MQTT_PORT = int(read_env_val("MQTT_PORT", alt="MQTT_PORT", default="8883"))
-MQTT_USERNAME = read_env_val("MQTT_USER", alt="MQTT_USERNAME", default=None)
-MQTT_PASSWORD = read_env_val("MQTT_PASSWORD", alt="MQTT_PASS", default=None)
-MQTT_TOPIC_SUB = read_env_val("MQTT_TOPIC_SUB", alt="MQTT_TOPIC", default="v1/device/+/telemetry")
-CLIENT_ID = read_env_val("CLIENT_ID", default="cm-backend")
-
-print("[CONFIG] MQTT_HOST=", MQTT_HOST, "MQTT_PORT=", MQTT_PORT, "MQTT_TOPIC_SUB=", MQTT_TOPIC_SUB)
-
-# using absolute path for the certificate
-BASEDIR = os.path.abspath(os.path.dirname(__file__))
-CA_FILE = os.path.join(BASEDIR, "ca-chain.pem")
-
+# "embedded": MQTT client + DB writer threads run inside this process (dev default)
+# "external": ingest runs as its own process (python app/run.py ingest), this process only serves the API
+INGEST_MODE = os.getenv("INGEST_MODE", "embedded").lower()
 # Global storage
-latest_message = {}
+# Latest state per device (last metrics / raw block / last seen), fed by on_message and written to
+# the devices table by db_writer_worker. API routes read the fleet from it instead of querying per request.
+device_state = DeviceStateCache()
+_device_state_load_lock = threading.Lock()
 mqtt_connected = False
 mqtt_client = None
-# Buffer to hold incoming raw chunks before reassembly
-# Structure: { "block_id": { "meta": dict, "chunks": {0: bytes, 1: bytes...}, "received_count": 0 } }
-assembly_buffer = {}
+# Process pool for spectrum analysis of completed raw blocks (started in __main__)
+analysis_executor = None
+# Buffer to hold incoming raw chunks before reassembly, keyed by (device_id, block_id).
+# Bounded by bytes and blocks per device; stale entries are swept after REASSEMBLY_TTL_SEC.
+assembly_buffer = ReassemblyBuffer(wal_tracker=wal_tracker)
+
+# /metrics: pipeline counters (metrics.py) plus the stats() of each component, read at scrape time
+metrics.stats_collector("cm_write_queue", lambda: {"depth": write_queue.qsize(), "max": write_queue.maxsize})
+metrics.stats_collector("cm_backpressure", write_backpressure.stats)
+metrics.stats_collector("cm_wal", lambda: dict(wal.stats(), **wal_tracker.stats()) if wal is not None else None)
+metrics.stats_collector("cm_reassembly", assembly_buffer.stats)
+metrics.stats_collector("cm_batches", processor.stats)
+metrics.stats_collector("cm_analysis", lambda: analysis_executor.stats() if analysis_executor is not None else None)
+metrics.stats_collector("cm_device_state", device_state.stats)
+metrics.stats_collector("cm_live", live_hub.stats)
+metrics.stats_collector("cm_db_pools", pool_stats)
+metrics.stats_collector("cm_auth_hashing", hasher.stats)
+metrics.stats_collector("cm_mqtt", lambda: {"connected": mqtt_connected})
+metrics.device_collector(device_state)
 
 def on_connect(client, userdata, flags, rc):
     global mqtt_connected
@@ -338,7 +383,7 @@ def on_connect(client, userdata, flags, rc):
     if rc == 0:
         mqtt_connected = True
         try:
-            client.subscribe(MQTT_TOPIC_SUB, qos=0)
+            client.subscribe(MQTT_TOPIC_SUB, qos=INGEST_MQTT_QOS)
             print(f"[MQTT CB] Subscribed to {MQTT_TOPIC_SUB}")
         except Exception as e:
             print("[MQTT CB] subscribe() error:", e)
@@ -355,164 +400,151 @@ def on_subscribe(client, userdata, mid, granted_qos):
     print(f"[MQTT CB] on_subscribe mid={mid} granted_qos={granted_qos}")
 
 # Helper function to finish reassembly of raw data
-def finish_reassembly(device_id, block_id):
-    global assembly_buffer
+# entry: completed entry returned (and already removed) by assembly_buffer.add_meta / add_chunk.
+# entry["payload"] is a memoryview over the preallocated block buffer; it is passed on as is.
+# entry["lsn"] (WAL) is held by the entry; the RAW_BLOCK item and the analysis take their own holds.
+def finish_reassembly(device_id, block_id, entry):
+    lsn = entry.get("lsn")
     try:
-        entry = assembly_buffer[block_id]
-        total_chunks = entry["total_chunks"]
-        meta = entry["meta"] or {}
-        ts_ms = None
-        if meta and isinstance(meta, dict):
-            ts_ms = meta.get("ts_ms") or meta.get("time") or None
-        if ts_ms is None:
-            # fallback to parse from block_id or use current time
-            try:
-                ts_ms = int(float(block_id.split("-")[0]) * 1000)
-            except Exception:
-                ts_ms = int(time.time() * 1000)
-        # Stitching bytes in order
-        full_payload = bytearray()
-        for i in range(total_chunks):
-            if i in entry["chunks"]:
-                full_payload.extend(entry["chunks"][i])
-            else:
-                raise ValueError(f"Missing chunk {i} for block_id {block_id}")
-        print(f"[MQTT CB] finish_reassembly: Reassembled block {block_id} with {total_chunks} chunks, total size {len(full_payload)} bytes")
-        samples = int(len(full_payload) / 6)  # 3 channels * int16 => 6 bytes per sample
+        block = raw_block_from_entry(device_id, block_id, entry)
+        debug(f"[MQTT CB] finish_reassembly: Reassembled block {block_id} with {entry['total_chunks']} chunks, total size {len(block['payload'])} bytes")
         # Queue for DB worker (using raw block type)
-        write_queue.put_nowait({
-            "type": "RAW_BLOCK",
-            "data": {
-                "block_id": block_id,
-                "device_id": device_id,
-                "time": ts_ms,
-                "sample_rate": 1000, # Retrieve from meta if available (not being sent rn)
-                "samples": samples, 
-                "encoding": meta.get("encoding", "int16_le_axayaz_bin_chunks"),
-                "payload": bytes(full_payload), # Convert bytearray to immutable bytes
-                "crc32": None # Validate CRC here if needed
-            }
-        })
-        # Cleanup memmory
-        del assembly_buffer[block_id]
+        enqueue_write({"type": "RAW_BLOCK", "data": block, "lsn": lsn})
+        device_state.seen(device_id, raw_block_id=block_id)
+        # Hand the block to the analysis pool; results come back as SPECTRUM items
+        if analysis_executor is not None:
+            wal_tracker.hold(lsn)
+            if not analysis_executor.submit(dict(block, lsn=lsn)):
+                wal_tracker.release(lsn)
+                sampled("analysis_full", f"[MQTT CB] finish_reassembly: analysis backlog full, block {block_id} not analyzed")
 
     except Exception as e:
-        print(f"[MQTT CB] finish_reassembly: No assembly entry for block_id {block_id}: {e}")
-        # Not deleting immediatly if needed for retry logic
-        if block_id in assembly_buffer:
-            del assembly_buffer[block_id]
+        sampled("reassembly_error", f"[MQTT CB] finish_reassembly: failed for block_id {block_id}: {e}")
+    finally:
+        wal_tracker.release(lsn)
+
+def enqueue_write(item):
+    """Queue an item for db_writer_worker without blocking the network loop (WRITE_QUEUE_POLICY when full)."""
+    wal_tracker.hold(item.get("lsn"))
+    return write_backpressure.offer(item)
+
+def on_analysis_result(rows, blocks):
+    # called from the process pool callback thread; the SPECTRUM item takes over the blocks' WAL holds
+    lsns = [b["lsn"] for b in blocks if b.get("lsn") is not None]
+    if rows:
+        # never blocks the result thread; a full queue is handled by WRITE_QUEUE_POLICY like any item
+        enqueue_write({"type": "SPECTRUM", "data": rows, "lsn": min(lsns) if lsns else None})
+    for lsn in lsns:
+        wal_tracker.release(lsn)
 
 def on_message(client, userdata, msg):
-    global assembly_buffer
-
-    topic_parts = msg.topic.split("/")
-
-    # Basic validation
-    if (len(topic_parts) < 3 or topic_parts[0] != "v1" or topic_parts[1] != "device"):
-        print(f"[MQTT CB] on_message: Invalid topic format: {msg.topic}")
-        return
-
-    device_id = topic_parts[2]
-    # If no further part present, ignore
-    if len(topic_parts) < 4:
-        print(f"[MQTT CB] on_message: topic too short: {msg.topic}")
-        return
-
-    msg_type = topic_parts[3]  # expected telemetry or something
+    # logged before it is handled (and, for QoS 1, acknowledged): from here on a crash replays it
+    lsn = wal.append(msg.topic, msg.payload) if wal is not None else None
+    try:
+        handle_message(msg.topic, msg.payload, lsn)
+    finally:
+        wal_tracker.release(lsn)
+
+def replay_wal():
+    """Feed the messages an earlier run logged but did not commit back through handle_message (before MQTT starts)."""
+    n = 0
+    for lsn, _, topic, payload in wal.replay():
+        while write_queue.qsize() >= write_queue.maxsize // 2:
+            time.sleep(0.01)  # let db_writer_worker keep up instead of overflowing the queue
+        wal_tracker.hold(lsn)
+        try:
+            handle_message(topic, payload, lsn)
+        finally:
+            wal_tracker.release(lsn)
+        n += 1
+    print(f"[WAL] replayed {n} uncommitted messages from {wal.directory}", flush=True)
+
+def handle_message(topic, payload, lsn=None):
+    """One device message (live or replayed from the WAL). lsn: its WAL record, held by the caller."""
+    # drop blocks whose meta/chunks never arrived (cheap time check on every message)
+    assembly_buffer.maybe_sweep()
+
+    kind, device_id, block_id, chunk_index = parse_topic(topic)
+    MESSAGES.inc(kind or "other")
+    if kind in (RAW_META, RAW_CHUNK):
+        device_state.seen(device_id)
 
     # CASE A: telemetry JSON (text)
-    if msg_type == "telemetry" and len(topic_parts) == 4:
+    if kind == TELEMETRY:
         try:
-            payload_str = msg.payload.decode("utf-8")
+            payload_str = payload.decode("utf-8")
             data = json.loads(payload_str)
             # ensure device_id in payload or use topic
-            payload_device = data.get("device_id") or device_id
-            if not payload_device:
-                print(f"[MQTT CB] on_message: telemetry missing device_id in payload: {payload_str}")
+            item = metric_item(device_id, data)
+            if not item["device_id"]:
+                sampled("telemetry_no_device", f"[MQTT CB] on_message: telemetry missing device_id in payload: {payload_str}")
                 return
-            write_queue.put_nowait({
-                "type": "METRIC",
-                "data": {
-                    "device_id": payload_device,
-                    "ts_ms": data.get("ts_ms"),
-                    "sample_rate_hz": data.get("sample_rate_hz"),
-                    "samples": data.get("samples"),
-                    "metrics": data.get("metrics")
-                }
-            })
-            print(f"[MQTT CB] on_message: Queued telemetry from device {device_id}")
+            enqueue_write({"type": "METRIC", "data": item, "lsn": lsn})
+            device_state.seen(item["device_id"], metrics=item["metrics"],
+                              metrics_at=float(item["ts_ms"]) / 1000.0 if item["ts_ms"] else None)
+            debug(f"[MQTT CB] on_message: Queued telemetry from device {device_id}")
         except UnicodeDecodeError as e:
-            print(f"[MQTT CB] on_message: telemetry decode error for {device_id}: {e}")
+            sampled("telemetry_decode", f"[MQTT CB] on_message: telemetry decode error for {device_id}: {e}")
         except json.JSONDecodeError as e:
-            print(f"[MQTT CB] on_message: telemetry JSON decode error for {device_id}: {e}")
+            sampled("telemetry_json", f"[MQTT CB] on_message: telemetry JSON decode error for {device_id}: {e}")
         except Exception as e:
-            print(f"[MQTT CB] on_message: Error processing telemetry from {device_id}: {e}")
+            sampled("telemetry_error", f"[MQTT CB] on_message: Error processing telemetry from {device_id}: {e}")
 
     # CASE B: raw meta (JSON header)
-    elif msg_type == "telemetry" and len(topic_parts) >= 5 and topic_parts[4] == "raw" and len(topic_parts) >= 6 and topic_parts[5] == "meta":
+    elif kind == RAW_META:
         try:
-            payload_str = msg.payload.decode("utf-8")
+            payload_str = payload.decode("utf-8")
             meta = json.loads(payload_str)
             block_id = meta.get("id")
             total_chunks = meta.get("chunks")
             if not block_id or not total_chunks:
-                print(f"[MQTT CB] on_message: raw/meta missing fields: {meta}")
+                sampled("meta_fields", f"[MQTT CB] on_message: raw/meta missing fields: {meta}")
                 return
-            assembly_buffer[block_id] = {
-                "meta": meta,
-                "chunks": {},
-                "total_chunks": int(total_chunks),
-                "start_time": time.time(),
-                "device_id": device_id
-            }
-            print(f"[MQTT CB] on_message: Started reassembly for block {block_id} ({total_chunks} chunks)")
+            debug(f"[MQTT CB] on_message: Started reassembly for block {block_id} ({total_chunks} chunks)")
+            # chunks may have arrived before the meta; then this completes the block
+            entry = assembly_buffer.add_meta(device_id, block_id, meta, lsn=lsn)
+            if entry is not None:
+                finish_reassembly(device_id, block_id, entry)
         except UnicodeDecodeError as e:
-            print(f"[MQTT CB] on_message: raw/meta decode error for {device_id}: {e}")
+            sampled("meta_decode", f"[MQTT CB] on_message: raw/meta decode error for {device_id}: {e}")
         except json.JSONDecodeError as e:
-            print(f"[MQTT CB] on_message: raw/meta JSON decode error for {device_id}: {e}")
+            sampled("meta_json", f"[MQTT CB] on_message: raw/meta JSON decode error for {device_id}: {e}")
         except Exception as e:
-            print(f"[MQTT CB] on_message: Error processing raw meta from {device_id}: {e}")
+            sampled("meta_error", f"[MQTT CB] on_message: Error processing raw meta from {device_id}: {e}")
 
     # CASE C: raw chunk (binary) — topic: v1/device/<id>/telemetry/raw/chunk/<block_id>/<seq>
-    elif msg_type == "telemetry" and len(topic_parts) >= 7 and topic_parts[4] == "raw" and topic_parts[5] == "chunk":
+    elif kind == RAW_CHUNK:
         # DO NOT decode payload; it's binary.
-        block_id = topic_parts[6]
-        try:
-            chunk_index = int(topic_parts[7])
-        except Exception:
-            print(f"[MQTT CB] on_message: invalid chunk index in topic: {msg.topic}")
+        if chunk_index is None:
+            sampled("chunk_index", f"[MQTT CB] on_message: invalid chunk index in topic: {topic}")
             return
 
-        if block_id not in assembly_buffer:
-            # If meta hasn't arrived yet, create a placeholder so we can keep the binary chunk
-            assembly_buffer.setdefault(block_id, {"meta": None, "chunks": {}, "total_chunks": None, "start_time": time.time(), "device_id": device_id})
-            print(f"[MQTT CB] on_message: Received chunk for unknown block_id {block_id}, storing until meta arrives")
-
-        # store raw bytes (msg.payload is already bytes)
+        # store raw bytes (payload is already bytes). If meta hasn't arrived yet the buffer
+        # keeps the chunk in a placeholder entry until it does (or the entry expires).
         try:
-            assembly_buffer[block_id]["chunks"][chunk_index] = msg.payload
+            entry = assembly_buffer.add_chunk(device_id, block_id, chunk_index, payload, lsn=lsn)
             # If we have total_chunks and we have all chunks, finish
-            entry = assembly_buffer[block_id]
-            if entry.get("total_chunks") and len(entry["chunks"]) == entry["total_chunks"]:
-                finish_reassembly(device_id, block_id)
+            if entry is not None:
+                finish_reassembly(device_id, block_id, entry)
         except Exception as e:
-            print(f"[MQTT CB] on_message: Error storing chunk for {block_id}: {e}")
+            sampled("chunk_error", f"[MQTT CB] on_message: Error storing chunk for {block_id}: {e}")
 
     else:
-        # unknown subtopic under device
-        print(f"[MQTT CB] on_message: Unhandled topic: {msg.topic}")
+        # not a device telemetry topic / unknown subtopic under device
+        sampled("unhandled_topic", f"[MQTT CB] on_message: Unhandled topic: {topic}")
         return
 
 def on_log(client, userdata, level, buf):
-    # Paho log levels: 0-4. Print everything for debugging:
-    print(f"[MQTT LOG] {level}: {buf}")
+    # paho logs every packet at MQTT_LOG_DEBUG; only warnings / errors unless LOG_LEVEL=DEBUG
+    if LOG_DEBUG or level in (mqtt.MQTT_LOG_WARNING, mqtt.MQTT_LOG_ERR):
+        print(f"[MQTT LOG] {level}: {buf}")
 
 def start_mqtt_thread():
     global mqtt_client, mqtt_connected
     print("[MQTT] START: start_mqtt_thread() called", flush=True)
     try:
         print("[MQTT] creating client object...", flush=True)
-        mqtt_client = mqtt.Client(client_id=CLIENT_ID, protocol=mqtt.MQTTv311)
+        mqtt_client = mqtt.Client(client_id=CLIENT_ID, protocol=mqtt.MQTTv311, clean_session=not INGEST_MQTT_PERSISTENT)
         print("[MQTT] setting username/password...", flush=True)
         mqtt_client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
 
@@ -572,6 +604,17 @@ def start_mqtt_thread():
 def index():
     return jsonify({"message": "Welcome to the Flask API!", "mqtt_connected": mqtt_connected})
 
+def refresh_device_state():
+    """Reload registry and flushed state from the devices table every DEVICE_STATE_REFRESH_SEC (one query per interval)."""
+    # only the very first load makes callers wait; later ones are done by one request while others read the cache
+    if device_state.load_due() and _device_state_load_lock.acquire(blocking=device_state.last_load == 0):
+        try:
+            device_state.load(get_device_states())
+        except Exception as e:
+            print("[DEVICE STATE] reload failed:", e, flush=True)
+        finally:
+            _device_state_load_lock.release()
+
 @app.route("/api/devices", methods=["GET"])
 @jwt_required()
 def api_list_devices():
@@ -588,7 +631,8 @@ def api_list_devices():
         user_id = None
 
     try:
-        rows = get_all_devices(limit=limit, user_id=user_id)
+        refresh_device_state()
+        rows = device_state.list(user_id=user_id, limit=limit)
         return jsonify({"count": len(rows), "devices": rows}), 200
     except Exception as e:
         import traceback; traceback.print_exc()
@@ -598,8 +642,9 @@ def api_list_devices():
 @app.route("/api/devices/<device_id>", methods=["GET"])
 @jwt_required()
 def api_get_device(device_id):
-    # fetch device
-    device = get_device_by_device_id(device_id)
+    # fetch device (from the latest-state cache, the DB only for devices it does not know yet)
+    refresh_device_state()
+    device = device_state.get(device_id) or get_device_by_device_id(device_id)
     if not device:
         return jsonify({"msg": "Device not found"}), 404
     #enforce ownership
@@ -620,41 +665,282 @@ def api_get_device(device_id):
         "name": device.get("name"),
         "status": device.get("status"),
         "last_seen": device.get("last_seen") if device.get("last_seen") else None,
-        "config": cfg_parsed
+        "config": cfg_parsed,
+        "last_metrics": device.get("last_metrics"),
+        "last_metrics_at": device.get("last_metrics_at"),
+        "last_raw_block_id": device.get("last_raw_block_id"),
     }
     return jsonify(resp), 200
 
 
+#------------Admin endpoints
+ADMIN_ROLES = ("admin", "manager")
+
+@app.route("/api/admin/storage", methods=["GET"])
+@jwt_required()
+def api_admin_storage():
+    """Chunk sizes, compression ratios and policy jobs per hypertable (?chunks=1 adds per chunk detail)."""
+    if get_jwt().get("role") not in ADMIN_ROLES:
+        return jsonify({"msg": "Admin role required"}), 403
+    try:
+        with_chunks = request.args.get("chunks", "0").lower() in ("1", "true", "yes")
+        tables = get_storage_report(with_chunks=with_chunks)
+        return jsonify({"hypertables": tables}), 200
+    except Exception as e:
+        import traceback; traceback.print_exc()
+        return jsonify({"msg": "Error retrieving storage stats", "error": str(e)}), 500
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """Prometheus text format; unauthenticated like any scrape target, keep it off the public ingress."""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route("/api/admin/db-pools", methods=["GET"])
+@jwt_required()
+def api_admin_db_pools():
+    """Connection pool usage and checkout wait times of this process (write / read / query engines)."""
+    if get_jwt().get("role") not in ADMIN_ROLES:
+        return jsonify({"msg": "Admin role required"}), 403
+    return jsonify({"pools": pool_stats()}), 200
+
+@app.route("/api/admin/auth", methods=["GET"])
+@jwt_required()
+def api_admin_auth():
+    """Password hashing pool latency, rate limiter and auth cache counters of this process."""
+    if get_jwt().get("role") not in ADMIN_ROLES:
+        return jsonify({"msg": "Admin role required"}), 403
+    return jsonify({"hashing": hasher.stats(), "rate_limits": rate_limit_stats(), "caches": auth_cache_stats()}), 200
+
+READINGS_MAX_POINTS = int(os.getenv("READINGS_MAX_POINTS", "1000"))
+_DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+def parse_time_arg(value, default):
+    """ISO 8601 string or epoch milliseconds -> aware UTC datetime."""
+    if value is None or value == "":
+        return default
+    if value.lstrip("-").isdigit():
+        return datetime.fromtimestamp(int(value) / 1000.0, tz=timezone.utc)
+    dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+def parse_duration_arg(value):
+    """"30s", "5m", "1h", "1d" or plain seconds -> seconds."""
+    if value[-1] in _DURATION_UNITS:
+        return float(value[:-1]) * _DURATION_UNITS[value[-1]]
+    return float(value)
+
 @app.route("/api/devices/<device_id>/readings", methods=["GET"])
 def api_get_device_readings(device_id):
+    """
+    Without from/to/resolution: the newest `limit` raw readings (unchanged).
+    With any of them: readings in [from, to) (ISO 8601 or epoch ms; default the last 24 h) at `resolution`
+    ("raw", a duration like "5m" / "1h", or "auto" = span / READINGS_MAX_POINTS), served from the
+    coarsest continuous aggregate whose bucket fits the resolution.
+    """
     try:
         limit = int(request.args.get("limit", "100"))
     except Exception:
         limit = 100
-    
+
+    if not any(k in request.args for k in ("from", "to", "resolution")):
+        try:
+            rows = get_recent_metrics(device_id, limit=limit)
+            return jsonify({"device_id": device_id, "count": len(rows), "readings": rows}), 200
+        except Exception as e:
+            import traceback; traceback.print_exc()
+            return jsonify({"msg": "Error retrieving readings", "error": str(e)}), 500
+
+    try:
+        end = parse_time_arg(request.args.get("to"), datetime.now(timezone.utc))
+        start = parse_time_arg(request.args.get("from"), end - timedelta(days=1))
+        resolution = request.args.get("resolution", "auto").strip().lower()
+        span = (end - start).total_seconds()
+        if resolution == "raw":
+            resolution_sec = 0
+        elif resolution == "auto":
+            resolution_sec = span / READINGS_MAX_POINTS
+        else:
+            resolution_sec = parse_duration_arg(resolution)
+        limit = min(int(request.args.get("limit", READINGS_MAX_POINTS)), 10 * READINGS_MAX_POINTS)
+    except Exception:
+        return jsonify({"msg": "Invalid from, to, resolution or limit"}), 400
+    if span <= 0 or resolution_sec < 0:
+        return jsonify({"msg": "from must be before to"}), 400
+
     try:
-        rows = get_recent_metrics(device_id, limit=limit)
-        return jsonify({"device_id": device_id, "count": len(rows), "readings": rows}), 200
+        agg = pick_reading_aggregate(resolution_sec)
+        if agg is None:
+            rows = get_metrics_range(device_id, start, end, limit=limit)
+            source, bucket_sec = "readings_parameters", None
+        else:
+            # round the requested resolution up to a whole multiple of the source bucket
+            bucket_sec = int(-(-resolution_sec // agg[0])) * agg[0]
+            source = agg[1]
+            rows = get_downsampled_metrics(device_id, start, end, bucket_sec, source, limit=limit)
+        return jsonify({"device_id": device_id, "from": start.isoformat(), "to": end.isoformat(),
+                        "resolution_sec": bucket_sec, "source": source,
+                        "count": len(rows), "readings": rows}), 200
     except Exception as e:
         import traceback; traceback.print_exc()
         return jsonify({"msg": "Error retrieving readings", "error": str(e)}), 500
 
-if __name__ == "__main__":
-    # Start MQTT thread (guarded by __main__ so it does not run on import)
+#------------Live stream
+@app.route("/api/live", methods=["GET"])
+@jwt_required(locations=["headers", "query_string"])
+def api_live():
+    """
+    Server-Sent Events stream of new readings, spectrum summaries and alerts from the ingest pipeline.
+    ?devices=d1,d2 (default: all of the caller's devices), ?max_rate=<updates/s> (at most LIVE_MAX_RATE_HZ).
+    Readings and spectra are coalesced to the latest per device between updates. EventSource cannot
+    send headers, so the access token may be passed as ?jwt=<token>.
+    """
+    refresh_device_state()
+    try:
+        caller_id = int(get_jwt_identity())
+    except Exception:
+        caller_id = None
+    requested = [d for d in request.args.get("devices", "").split(",") if d]
+    if requested:
+        for device_id in requested:
+            device = device_state.get(device_id)
+            if device is None:
+                return jsonify({"msg": f"Device {device_id} not found"}), 404
+            if device.get("created_by") and device.get("created_by") != caller_id:
+                return jsonify({"msg": f"Not authorized to access device {device_id}"}), 403
+        device_ids = requested
+    else:
+        device_ids = [d["device_id"] for d in device_state.list(user_id=caller_id, limit=None)]
+    if not device_ids:
+        return jsonify({"msg": "No devices to stream"}), 404
+    try:
+        max_rate = float(request.args.get("max_rate", LIVE_MAX_RATE_HZ))
+    except ValueError:
+        return jsonify({"msg": "Invalid max_rate"}), 400
+    if not max_rate > 0:  # 0 / negative would mean unthrottled (and NaN compares false)
+        return jsonify({"msg": "max_rate must be positive"}), 400
+    max_rate = min(max_rate, LIVE_MAX_RATE_HZ)
+
+    if INGEST_MODE != "embedded":
+        ensure_mqtt_subscriber(live_hub)
+    try:
+        sub = live_hub.subscribe(device_ids, max_rate=max_rate)
+    except RuntimeError as e:
+        return jsonify({"msg": str(e)}), 503
+
+    def stream():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                batch = sub.next_batch(LIVE_HEARTBEAT_SEC)
+                if batch is None:
+                    # dropped as a slow consumer (or shut down); the browser reconnects after `retry`
+                    yield "event: dropped\ndata: {}\n\n"
+                    return
+                if not batch:
+                    yield ": keepalive\n\n"
+                    continue
+                yield "".join(f'event: {kind}\ndata: {{"device_id": {json.dumps(device_id)}, "data": {payload}}}\n\n'
+                              for device_id, kind, payload in batch)
+        finally:
+            live_hub.unsubscribe(sub)
+
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+#------------Raw waveform export
+def device_access_error(device_id):
+    """Error response if the caller may not read `device_id` (same ownership rule as /api/devices/<id>), else None."""
+    device = get_device_by_device_id(device_id)
+    if not device:
+        return jsonify({"msg": "Device not found"}), 404
+    try:
+        caller_id = int(get_jwt_identity())
+        if device.get("created_by") and device.get("created_by") != caller_id:
+            return jsonify({"msg": "Not authorized to access this device"}), 403
+    except Exception:
+        pass
+    return None
+
+def raw_export_response(fmt, filename, **query):
+    mimetype, ext = EXPORT_FORMATS[fmt]
+    return Response(stream_with_context(export_raw_blocks(fmt, **query)), mimetype=mimetype,
+                    headers={"Content-Disposition": f'attachment; filename="{filename}.{ext}"'})
+
+@app.route("/api/devices/<device_id>/raw/<block_id>", methods=["GET"])
+@jwt_required()
+def api_get_raw_block(device_id, block_id):
+    """One raw block as ?format=bin (default) | npy | arrow, decoded to int16 ax/ay/az (see raw_export.py)."""
+    err = device_access_error(device_id)
+    if err:
+        return err
+    fmt = request.args.get("format", "bin").lower()
+    try:
+        check_format(fmt)
+    except ValueError as e:
+        return jsonify({"msg": str(e)}), 400
+    if find_raw_block(device_id, block_id)[0] == 0:
+        return jsonify({"msg": "Raw block not found"}), 404
+    return raw_export_response(fmt, f"{device_id}_{block_id}", device_id=device_id, block_id=block_id)
+
+@app.route("/api/devices/<device_id>/raw", methods=["GET"])
+@jwt_required()
+def api_export_raw_blocks(device_id):
+    """
+    Raw blocks in [from, to) (ISO 8601 or epoch ms, default the last hour), oldest first, streamed as
+    ?format=bin (default) | npy | arrow. Optional `limit` caps the number of blocks.
+    """
+    err = device_access_error(device_id)
+    if err:
+        return err
+    fmt = request.args.get("format", "bin").lower()
+    try:
+        check_format(fmt)
+        end = parse_time_arg(request.args.get("to"), datetime.now(timezone.utc))
+        start = parse_time_arg(request.args.get("from"), end - timedelta(hours=1))
+        limit = int(request.args["limit"]) if request.args.get("limit") else None
+    except ValueError as e:
+        return jsonify({"msg": f"Invalid format, from, to or limit: {e}"}), 400
+    if start >= end:
+        return jsonify({"msg": "from must be before to"}), 400
+    stamp = lambda t: t.astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    filename = f"{device_id}_{stamp(start)}_{stamp(end)}"
+    return raw_export_response(fmt, filename, device_id=device_id, start=start, end=end, limit=limit)
+
+def serve():
+    """Start the ingest threads (embedded mode) and the Flask dev server. Entry point: python app/run.py api"""
+    global analysis_executor, wal
     # wait for DB first. To make sure app does not crash on startup if DB is not ready
     wait_for_db()
-    mqtt_thread = threading.Thread(target=start_mqtt_thread, daemon=True)
-    db_worker_thread = threading.Thread(target=db_writer_worker, daemon=True)
-    mqtt_thread.start()
-    db_worker_thread.start()
+    if INGEST_MODE == "embedded":
+        try:
+            print(f"[BASELINE] loaded {baselines.load(get_all_baselines())} baseline series", flush=True)
+        except Exception as e:
+            print("[BASELINE] could not load checkpointed baselines:", e, flush=True)
+        refresh_fault_rules()
+        refresh_device_state()
+        analysis_executor = AnalysisExecutor(on_result=on_analysis_result).start()
+        mqtt_thread = threading.Thread(target=start_mqtt_thread, daemon=True)
+        db_worker_thread = threading.Thread(target=db_writer_worker, daemon=True)
+        db_worker_thread.start()
+        if WAL_DIR:
+            wal = WriteAheadLog(os.path.join(WAL_DIR, "embedded"), tracker=wal_tracker)
+            replay_wal()
+        mqtt_thread.start()
+    else:
+        print(f"[MAIN] INGEST_MODE={INGEST_MODE}: MQTT ingest runs in the separate ingest service (app/run.py ingest)", flush=True)
     # Start Flask (dev). In production, use WSGI server and run mqtt client separately.
     app.run(host="0.0.0.0", port=5000)
 
 
+if __name__ == "__main__":
+    # prefer app/run.py: analysis workers re-import __main__, which should not be this module (see run.py)
+    serve()
+
+
 '''
  Only for development: use threaded=True so the app and the mqtt thread can coexist.
- For production, run via gunicorn / uwsgi. When using multiple worker processes,
- run this MQTT client as a separate service (or use one worker (in docker?)).
+ For production, run via gunicorn / uwsgi with INGEST_MODE=external and run the
+ MQTT ingest as a separate service: python app/run.py ingest (see docker-compose.yml).
 
  For DB schema changes over time (development, production, iterative work) 
  you should use a proper migration tool (Alembic) or explicit psql commands.
@@ -0,0 +1,176 @@
+# Process metrics in the Prometheus text exposition format (served at /metrics)
+# Hot paths update a few counters / histograms; everything components already count in their
+# stats() dicts (reassembly, batches, pools, live hub, ...) is read only when /metrics is scraped.
+import os
+import re
+import threading
+from bisect import bisect_left
+
+METRICS_MAX_DEVICES = int(os.getenv("METRICS_MAX_DEVICES", "500"))  # per-device series (laggiest first)
+INGEST_METRICS_PORT = int(os.getenv("INGEST_METRICS_PORT", "9102"))  # ingest service /metrics (0 = off)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_metrics = []
+_collectors = []
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{n}="{esc(v)}"' for n, v in zip(names, values)) + "}"
+
+
+def _num(v):
+    return str(int(v)) if float(v).is_integer() and abs(v) < 1e15 else repr(float(v))
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labelnames = name, help, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            out += [f"{self.name}{_labels(self.labelnames, k)} {_num(v)}" for k, v in self._values.items()]
+        return out
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)):
+        self.name, self.help, self.labelnames = name, help, tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # labels -> [per-bucket counts (+Inf last), sum]
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value, *labels):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            v = self._values.get(labels)
+            if v is None:
+                v = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            v[0][i] += 1
+            v[1] += value
+
+    def render(self):
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labelnames + ("le",)
+        with self._lock:
+            for k, (counts, total) in self._values.items():
+                cum = 0
+                for le, c in zip(self.buckets + ("+Inf",), counts):
+                    cum += c
+                    out.append(f"{self.name}_bucket{_labels(names, k + (le if le == '+Inf' else _num(le),))} {cum}")
+                out.append(f"{self.name}_sum{_labels(self.labelnames, k)} {_num(total)}")
+                out.append(f"{self.name}_count{_labels(self.labelnames, k)} {cum}")
+        return out
+
+
+def register_collector(fn):
+    """fn() -> iterable of (name, type, help, [(labels dict, value), ...]), called on every scrape."""
+    _collectors.append(fn)
+    return fn
+
+
+def stats_collector(prefix, stats_fn, help="", **labels):
+    """
+    Expose the numeric leaves of a stats() dict as gauges <prefix>_<key>[_<subkey>...] (booleans as 0/1).
+    For counters components already keep (completed, expired, batches, ...); use rate() on them.
+    """
+    def collect():
+        stats = stats_fn()
+        if stats is None:
+            return []
+        samples = {}
+        _flatten(prefix, stats, samples)
+        return [(name, "gauge", help, [(labels, v)]) for name, v in samples.items()]
+    return register_collector(collect)
+
+
+def _flatten(name, value, out):
+    if isinstance(value, bool):
+        out[name] = int(value)
+    elif isinstance(value, (int, float)):
+        out[name] = value
+    elif isinstance(value, dict):
+        for k, v in value.items():
+            _flatten(f"{name}_{re.sub(r'[^a-zA-Z0-9_]', '_', str(k))}", v, out)
+
+
+def render() -> str:
+    lines = []
+    for m in _metrics:
+        lines += m.render()
+    families = {}
+    for fn in _collectors:
+        try:
+            for name, typ, help, samples in fn():
+                fam = families.setdefault(name, (typ, help, []))
+                fam[2].extend(samples)
+        except Exception as e:
+            lines.append(f"# collector {getattr(fn, '__name__', fn)} failed: {e}")
+    for name, (typ, help, samples) in families.items():
+        lines += [f"# HELP {name} {help or name}", f"# TYPE {name} {typ}"]
+        for labels, v in samples:
+            lines.append(f"{name}{_labels(tuple(labels), tuple(labels.values()))} {_num(v)}")
+    return "\n".join(lines) + "\n"
+
+
+def start_http_server(port=INGEST_METRICS_PORT):
+    """Serve render() at /metrics on a daemon thread (processes without Flask, e.g. the ingest service)."""
+    if not port:
+        return None
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass  # scrapes are not worth a log line each
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    print(f"[METRICS] serving /metrics on port {port}", flush=True)
+    return server
+
+
+# --- ingest pipeline metrics (shared by the embedded worker and the ingest service)
+
+MESSAGES = Counter("cm_mqtt_messages_total", "MQTT messages received, by topic kind", ("kind",))
+QUEUE_DROPPED = Counter("cm_write_queue_dropped_total", "Items dropped because the write queue was full", ("type",))
+BATCH_ITEMS = Histogram("cm_db_batch_items", "Rows per DB batch flush", ("table",),
+                        buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500))
+FLUSH_SECONDS = Histogram("cm_db_flush_seconds", "DB batch flush latency", ("table", "result"))
+INGEST_LAG = Histogram("cm_ingest_lag_seconds", "Device timestamp of a reading to its arrival here",
+                       buckets=(.05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 300, 3600))
+
+
+def device_collector(device_state, limit=METRICS_MAX_DEVICES):
+    """Per-device lag / silence gauges from a DeviceStateCache, the `limit` most lagging devices only."""
+    def collect():
+        rows = device_state.lags(limit)
+        return [
+            ("cm_device_lag_seconds", "gauge", "Device timestamp of the last reading to its arrival",
+             [({"device_id": d}, lag) for d, lag, _ in rows if lag is not None]),
+            ("cm_device_last_seen_age_seconds", "gauge", "Seconds since the device was last heard from",
+             [({"device_id": d}, age) for d, _, age in rows if age is not None]),
+        ]
+    return register_collector(collect)
@@ -0,0 +1,35 @@
+# MQTT connection settings shared by the Flask app (main.py) and the ingest service (ingest.py)
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+def read_env_val(name, alt=None, required=False, default=None):
+    val = os.getenv(name, alt)
+    if not val and alt:
+        val = os.getenv(alt)
+    if (not val) and (default is not None):
+        val = default
+    if required and (not val):
+        return RuntimeError(f"Required env variable not set: {name} (alt: {alt})")
+    return val
+
+# MQTT Configuration
+MQTT_HOST = read_env_val("MQTT_HOST", alt="MQTT_BROKER" ,required=True)
+MQTT_PORT = int(read_env_val("MQTT_PORT", alt="MQTT_PORT", default="8883"))
+MQTT_USERNAME = read_env_val("MQTT_USER", alt="MQTT_USERNAME", default=None)
+MQTT_PASSWORD = read_env_val("MQTT_PASSWORD", alt="MQTT_PASS", default=None)
+MQTT_TOPIC_SUB = read_env_val("MQTT_TOPIC_SUB", alt="MQTT_TOPIC", default="v1/device/+/telemetry")
+CLIENT_ID = read_env_val("CLIENT_ID", default="cm-backend")
+# Ingesting client (main.py embedded, ingest.py). With a WAL: QoS 1 subscription and a persistent session, so
+# messages published at QoS 1 that were not acknowledged (= not in the WAL yet) are redelivered after a crash.
+# Messages published at QoS 0 (the current firmware) are delivered at QoS 0 whatever the subscription QoS.
+INGEST_MQTT_QOS = int(os.getenv("INGEST_MQTT_QOS", "1" if os.getenv("WAL_DIR") else "0"))
+INGEST_MQTT_PERSISTENT = os.getenv("INGEST_MQTT_PERSISTENT", "1" if os.getenv("WAL_DIR") else "0").lower() in ("1", "true", "yes")
+INGEST_MQTT_SESSION_EXPIRY_SEC = int(os.getenv("INGEST_MQTT_SESSION_EXPIRY_SEC", "3600"))  # MQTT 5 (shared subscriptions)
+
+print("[CONFIG] MQTT_HOST=", MQTT_HOST, "MQTT_PORT=", MQTT_PORT, "MQTT_TOPIC_SUB=", MQTT_TOPIC_SUB)
+
+# using absolute path for the certificate
+BASEDIR = os.path.abspath(os.path.dirname(__file__))
+CA_FILE = os.path.join(BASEDIR, "ca-chain.pem")
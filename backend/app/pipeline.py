@@ -0,0 +1,124 @@
+# Queue item processing shared by db_writer_worker (threads) and the async ingest service
+import os
+from batcher import Batcher
+from db import to_utc_datetime
+from telemetry import metric_row, raw_block_row
+from live import READING, SPECTRUM, ALERT, reading_event, spectrum_event, alert_event
+
+# Batching limits. Raw blocks get their own (smaller, byte bounded) batches so a slow
+# raw insert never holds back the metric flush and vice versa.
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", "100"))
+BATCH_TIMEOUT = float(os.getenv("BATCH_TIMEOUT", "1.0"))
+RAW_BATCH_SIZE = int(os.getenv("RAW_BATCH_SIZE", "50"))
+RAW_BATCH_MAX_BYTES = int(os.getenv("RAW_BATCH_MAX_BYTES", str(2 * 1024 * 1024)))
+RAW_BATCH_TIMEOUT = float(os.getenv("RAW_BATCH_TIMEOUT", "0.5"))
+
+
+class IngestProcessor:
+    """
+    Turns write-queue items into batched DB rows, baseline updates and fault alerts.
+    It performs no I/O itself: rows collect in one Batcher per table, flushed by the caller
+    (Batcher.flush with the sync db functions, or take()/record() around async writers).
+    writers: {"metrics": fn, "raw_blocks": fn, "spectra": fn, "alerts": fn} (None for async callers)
+    live: optional live.LiveHub; new readings, spectrum summaries and alerts are published to it
+    on_failure: optional fn(table, rows, attempts, error) for batches whose DB write failed (see spill.py)
+    Expected items:
+      1) {"type": "METRIC", "data": { "device_id":..., "ts_ms":..., "sample_rate_hz":..., "samples":..., "metrics": {...} } }
+      2) {"type": "RAW_BLOCK", "data": { "block_id":..., "device_id":..., "time": ms-or-datetime, "sample_rate":..., "samples":..., "encoding":..., "payload": bytes, "crc32": ... } }
+      3) {"type": "SPECTRUM", "data": [ row dicts from spectrum.compute_spectra ] }
+      4) {"type": "ROWS", "table": batcher name, "data": [rows], "attempts": n }  <-- failed batch replayed from the spill journal
+      5) (legacy) or plain metric dicts { "device_id":..., "ts_ms":..., ... }  <-- supported for backward compat
+    Items 1-3 may carry "lsn": the WAL record they came from; the batchers keep it until the rows are written.
+    """
+
+    def __init__(self, baselines, fault_engine, writers=None, live=None, on_failure=None):
+        writers = writers or {}
+        self.baselines = baselines
+        self.fault_engine = fault_engine
+        self.live = live
+        self.metrics = Batcher("metrics", writers.get("metrics"), max_items=BATCH_SIZE, max_age=BATCH_TIMEOUT,
+                               on_failure=on_failure)
+        self.raw_blocks = Batcher("raw_blocks", writers.get("raw_blocks"), max_items=RAW_BATCH_SIZE,
+                                  max_age=RAW_BATCH_TIMEOUT, max_bytes=RAW_BATCH_MAX_BYTES, on_failure=on_failure)
+        self.spectra = Batcher("spectra", writers.get("spectra"), max_items=BATCH_SIZE, max_age=BATCH_TIMEOUT,
+                               on_failure=on_failure)
+        self.alerts = Batcher("alerts", writers.get("alerts"), max_items=BATCH_SIZE, max_age=BATCH_TIMEOUT,
+                              on_failure=on_failure)
+        self.batchers = (self.metrics, self.raw_blocks, self.spectra, self.alerts)
+        self._by_name = {b.name: b for b in self.batchers}
+
+    def process(self, item):
+        # normalize formats
+        lsn = None
+        if isinstance(item, dict) and "type" in item:
+            typ = item["type"]
+            data = item.get("data", {}) or {}
+            lsn = item.get("lsn")
+        else:
+            # legacy: plain metric dict; treat as METRIC
+            typ = "METRIC"
+            data = item
+
+        if typ == "METRIC":
+            row, metrics_obj = metric_row(data)
+            # skip invalid metrics (avoid NULL device_id)
+            if row is None:
+                print(f"[DB_WORKER] skipping METRIC with missing device_id: {data}")
+                return
+            self.metrics.add(row, lsn=lsn)
+            # evaluate against the baseline before this reading is folded into it
+            self._add_alerts(self.fault_engine.evaluate_reading(row["device_id"], row["time"], metrics_obj), lsn)
+            self.baselines.update_metrics(row["device_id"], metrics_obj)
+            if self.live is not None:
+                self.live.publish(row["device_id"], READING, reading_event(row, metrics_obj))
+
+        elif typ == "RAW_BLOCK":
+            row = raw_block_row(data)
+            # validate minimal fields
+            if row is None:
+                print(f"[DB_WORKER] skipping RAW_BLOCK with missing fields: {data.keys()}")
+                return
+            self.raw_blocks.add(row, size=len(row["payload"]), lsn=lsn)
+
+        elif typ == "SPECTRUM":
+            # already computed in the analysis pool; just buffer the rows
+            self.spectra.extend(data or [], lsn=lsn)
+            for row in data or []:
+                self._add_alerts(self.fault_engine.evaluate_spectrum(row, to_utc_datetime(row.get("time"))), lsn)
+                self.baselines.update_spectrum(row)
+                if self.live is not None:
+                    self.live.publish(row.get("device_id"), SPECTRUM, spectrum_event(row))
+
+        elif typ == "ROWS":
+            # rows of a batch that failed to write: already evaluated, only the DB write is repeated
+            batcher = self._by_name.get(item.get("table"))
+            if batcher is None:
+                print(f"[DB_WORKER] ROWS item for unknown table: {item.get('table')}")
+                return
+            for row in data:
+                batcher.add(row, size=len(row["payload"]) if batcher is self.raw_blocks else 0,
+                            attempts=item.get("attempts", 0))
+
+        else:
+            print(f"[DB_WORKER] unknown item type: {typ}")
+
+    def _add_alerts(self, alerts, lsn=None):
+        self.alerts.extend(alerts, lsn=lsn)
+        if self.live is not None:
+            for a in alerts:
+                self.live.publish(a["device_id"], ALERT, alert_event(a))
+
+    def healthy(self) -> bool:
+        """True when the last flush of every table succeeded (spill replay waits for this)."""
+        return all(b.last_ok for b in self.batchers)
+
+    def min_lsn(self):
+        """Oldest WAL LSN whose rows are not written yet (a WalTracker provider)."""
+        lsns = [lsn for lsn in (b.min_lsn() for b in self.batchers) if lsn is not None]
+        return min(lsns) if lsns else None
+
+    def due(self, now=None):
+        return [b for b in self.batchers if b.due(now)]
+
+    def stats(self) -> dict:
+        return {b.name: b.stats() for b in self.batchers}
@@ -0,0 +1,68 @@
+# In-process token bucket rate limiting for the auth endpoints (per client IP and per email)
+import os
+import threading
+import time
+
+AUTH_RATE_IP_PER_MIN = float(os.getenv("AUTH_RATE_IP_PER_MIN", "30"))  # 0 = unlimited
+AUTH_RATE_IP_BURST = int(os.getenv("AUTH_RATE_IP_BURST", "10"))
+AUTH_RATE_EMAIL_PER_MIN = float(os.getenv("AUTH_RATE_EMAIL_PER_MIN", "10"))
+AUTH_RATE_EMAIL_BURST = int(os.getenv("AUTH_RATE_EMAIL_BURST", "5"))
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+
+
+class RateLimiter:
+    """
+    key -> token bucket of `burst` tokens refilled at per_min / 60 per second. hit() takes one token
+    and returns 0.0, or the seconds until one is available (the request must be refused).
+    Full buckets carry no information, so they are dropped when the key table grows past max_keys.
+    """
+
+    def __init__(self, name, per_min, burst, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.name = name
+        self.rate = per_min / 60.0
+        self.burst = float(burst)
+        self.max_keys = max_keys
+        self._buckets = {}  # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+        self.limited = 0
+
+    def hit(self, key, now=None):
+        if self.rate <= 0 or not key:
+            return 0.0
+        now = now or time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < 1.0:
+                self._buckets[key] = (tokens, now)
+                self.limited += 1
+                return (1.0 - tokens) / self.rate
+            self._buckets[key] = (tokens - 1.0, now)
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+            return 0.0
+
+    def _prune(self, now):
+        full = [k for k, (t, u) in self._buckets.items() if t + (now - u) * self.rate >= self.burst]
+        for k in full:
+            del self._buckets[k]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"keys": len(self._buckets), "limited": self.limited}
+
+
+ip_limiter = RateLimiter("ip", AUTH_RATE_IP_PER_MIN, AUTH_RATE_IP_BURST)
+email_limiter = RateLimiter("email", AUTH_RATE_EMAIL_PER_MIN, AUTH_RATE_EMAIL_BURST)
+
+
+def check_auth_rate(ip, email=None):
+    """Seconds the client must wait (0.0 = allowed). The IP is checked first; email only when given."""
+    wait = ip_limiter.hit(ip)
+    if not wait and email:
+        wait = email_limiter.hit(email.strip().lower())
+    return wait
+
+
+def stats() -> dict:
+    return {"ip": ip_limiter.stats(), "email": email_limiter.stats()}
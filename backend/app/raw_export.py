@@ -0,0 +1,130 @@
+# Streaming export of raw waveform blocks for /api/devices/<id>/raw (binary, .npy or Arrow IPC)
+# Blocks are read from a server-side cursor and written out one fetch at a time, so the API worker
+# never holds a whole time range in memory and nothing is base64-encoded into JSON.
+#   bin    per block: <I header length, JSON header {block_id, time, sample_rate, samples},
+#          then samples * 3 little-endian int16 (ax, ay, az interleaved, the firmware layout)
+#   npy    one (total_samples, 3) int16 array, blocks concatenated oldest first
+#          (block boundaries / times: use bin or arrow)
+#   arrow  Arrow IPC stream, one record batch per fetch: time, block_id, sample_rate, samples, ax, ay, az (list<int16>)
+import io
+import json
+import struct
+import numpy as np
+from db import query_engine, count_raw_blocks, iter_raw_blocks
+from codec import RAW_ENCODING, DELTA_ENCODING, SAMPLE_DTYPE, AXES, decode_blocks
+
+EXPORT_FORMATS = {
+    "bin": ("application/octet-stream", "bin"),
+    "npy": ("application/x-npy", "npy"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+}
+EXPORT_ENCODINGS = (RAW_ENCODING, DELTA_ENCODING)  # blocks in other encodings are not exported
+
+_FRAME = struct.Struct("<I")
+
+
+def _decoded(batch):
+    """(row, (N, 3) int16 samples) for a fetched batch; fails if a block does not hold `samples` samples."""
+    for b, samples in zip(batch, decode_blocks(batch)):
+        if b["samples"] is not None and len(samples) != b["samples"]:
+            raise ValueError(f"block {b['block_id']} decodes to {len(samples)} samples, expected {b['samples']}")
+        yield b, samples
+
+
+def _bin_chunks(batches, total_samples):
+    for batch in batches:
+        out = []
+        for b, samples in _decoded(batch):
+            header = json.dumps({"block_id": b["block_id"], "time": b["time"].isoformat(),
+                                 "sample_rate": b["sample_rate"], "samples": len(samples)}).encode()
+            out += [_FRAME.pack(len(header)), header, samples.astype(SAMPLE_DTYPE, copy=False).tobytes()]
+        yield b"".join(out)
+
+
+def _npy_chunks(batches, total_samples):
+    header = io.BytesIO()
+    np.lib.format.write_array_header_1_0(header, {"descr": SAMPLE_DTYPE.str, "fortran_order": False,
+                                                  "shape": (total_samples, AXES)})
+    yield header.getvalue()
+    written = 0
+    for batch in batches:
+        out = [samples.astype(SAMPLE_DTYPE, copy=False).tobytes() for _, samples in _decoded(batch)]
+        written += sum(len(o) for o in out) // (AXES * SAMPLE_DTYPE.itemsize)
+        if written > total_samples:
+            raise ValueError(f"npy export got more than the {total_samples} samples announced in its header")
+        yield b"".join(out)
+    if written != total_samples:
+        raise ValueError(f"npy export wrote {written} of {total_samples} samples")
+
+
+def _arrow_chunks(batches, total_samples):
+    import pyarrow as pa
+    schema = pa.schema([
+        ("time", pa.timestamp("ms", tz="UTC")), ("block_id", pa.string()),
+        ("sample_rate", pa.int32()), ("samples", pa.int32()),
+        ("ax", pa.list_(pa.int16())), ("ay", pa.list_(pa.int16())), ("az", pa.list_(pa.int16())),
+    ])
+    sink = io.BytesIO()
+    writer = pa.ipc.new_stream(sink, schema)
+
+    def flush():
+        data = sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+        return data
+
+    yield flush()  # schema message
+    for batch in batches:
+        rows = list(_decoded(batch))
+        if not rows:
+            continue
+        lengths = np.array([len(s) for _, s in rows], dtype=np.int32)
+        offsets = pa.array(np.concatenate([[0], np.cumsum(lengths)]).astype(np.int32))
+        stacked = np.concatenate([s for _, s in rows]).astype(SAMPLE_DTYPE, copy=False)
+        axes = [pa.ListArray.from_arrays(offsets, pa.array(np.ascontiguousarray(stacked[:, i]))) for i in range(AXES)]
+        writer.write_batch(pa.record_batch([
+            pa.array([b["time"] for b, _ in rows], type=pa.timestamp("ms", tz="UTC")),
+            pa.array([b["block_id"] for b, _ in rows], type=pa.string()),
+            pa.array([b["sample_rate"] for b, _ in rows], type=pa.int32()),
+            pa.array(lengths),
+        ] + axes, schema=schema))
+        yield flush()
+    writer.close()
+    yield flush()
+
+
+_WRITERS = {"bin": _bin_chunks, "npy": _npy_chunks, "arrow": _arrow_chunks}
+
+
+def check_format(fmt):
+    """Raise ValueError if `fmt` cannot be exported here (unknown, or pyarrow missing for arrow)."""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    if fmt == "arrow":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ValueError("arrow export needs pyarrow installed on the server")
+
+
+def find_raw_block(device_id, block_id):
+    """(blocks, samples) for one block id of a device, (0, 0) when it is not stored."""
+    with query_engine.connect() as conn:
+        return count_raw_blocks(conn, device_id, block_id=block_id, encodings=EXPORT_ENCODINGS)
+
+
+def export_raw_blocks(fmt, device_id, start=None, end=None, block_id=None, limit=None):
+    """
+    Generator of response body chunks in `fmt` for the blocks of `device_id` in [start, end) (or one block_id).
+    Count and rows are read in one REPEATABLE READ snapshot, so the npy header matches the data
+    even while new blocks are being written.
+    """
+    with query_engine.connect().execution_options(isolation_level="REPEATABLE READ") as conn, conn.begin():
+        filters = dict(start=start, end=end, block_id=block_id, encodings=EXPORT_ENCODINGS, limit=limit)
+        try:
+            total_samples = count_raw_blocks(conn, device_id, **filters)[1] if fmt == "npy" else None
+            yield from _WRITERS[fmt](iter_raw_blocks(conn, device_id, **filters), total_samples)
+        except Exception as e:
+            # headers are already sent: log and cut the response short so the client sees a truncated body
+            print(f"[RAW EXPORT] {device_id} {fmt} export failed: {e}", flush=True)
+            raise
@@ -0,0 +1,288 @@
+# Bounded reassembly buffer for raw blocks sent as meta + binary chunk messages
+import os
+import time
+import threading
+import zlib
+from collections import OrderedDict
+
+REASSEMBLY_MAX_BYTES = int(os.getenv("REASSEMBLY_MAX_BYTES", str(64 * 1024 * 1024)))  # global budget
+REASSEMBLY_MAX_PER_DEVICE = int(os.getenv("REASSEMBLY_MAX_PER_DEVICE", "8"))  # open blocks per device
+REASSEMBLY_TTL_SEC = float(os.getenv("REASSEMBLY_TTL_SEC", "30"))  # drop blocks idle for longer than this
+REASSEMBLY_SHARDS = int(os.getenv("REASSEMBLY_SHARDS", "16"))
+REASSEMBLY_SWEEP_SEC = float(os.getenv("REASSEMBLY_SWEEP_SEC", "5"))
+
+ENTRY_OVERHEAD_BYTES = 512  # rough per-entry cost (dicts, meta) charged against the budget
+
+
+class _Shard:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (device_id, block_id) -> entry, least recently touched first
+        self.entries = OrderedDict()
+        self.per_device = {}
+
+
+class ReassemblyBuffer:
+    """
+    Holds partially received raw blocks keyed by (device_id, block_id).
+    - once the meta ("chunks", "bytes") and the chunk size are known, the block's bytes are
+      preallocated once and every chunk is copied straight to its offset; the completed entry's
+      "payload" is a memoryview over that buffer (no stitching, no bytes() copy).
+      The chunk size comes from meta["chunk_size"] or is derived from the first chunk seen;
+      chunks that arrive before that are parked and moved in when the buffer is allocated.
+    - entries are sharded by device_id (one lock per shard, a device's blocks always share a shard)
+    - global byte budget: the least recently touched entries are evicted to make room
+    - per-device cap on open blocks: the device's oldest block is evicted first
+    - sweep() drops entries not touched for ttl seconds (meta or chunks that never arrived)
+    add_meta() / add_chunk() return the completed entry (already removed from the buffer) or None.
+    WAL: an entry holds the LSN of the message that opened it (wal_tracker.hold) until it is dropped;
+    a completed entry's "lsn" hold passes to the caller, who must release it.
+    """
+
+    def __init__(self, max_bytes=REASSEMBLY_MAX_BYTES, max_per_device=REASSEMBLY_MAX_PER_DEVICE,
+                 ttl=REASSEMBLY_TTL_SEC, shards=REASSEMBLY_SHARDS, wal_tracker=None):
+        self.max_bytes = max_bytes
+        self.wal_tracker = wal_tracker
+        self.max_per_device = max_per_device
+        self.ttl = ttl
+        self._shards = [_Shard() for _ in range(max(1, shards))]
+        self._bytes_lock = threading.Lock()
+        self.bytes = 0
+        self.last_sweep = time.time()
+
+        self.started = 0
+        self.completed = 0
+        self.expired = 0
+        self.evicted = 0  # budget or per-device cap
+        self.duplicate_chunks = 0
+        self.rejected = 0  # block larger than the whole budget, inconsistent sizes, or a negative chunk index
+
+    def _shard(self, device_id):
+        return self._shards[zlib.crc32(device_id.encode("utf-8")) % len(self._shards)]
+
+    def _charge(self, n):
+        with self._bytes_lock:
+            self.bytes += n
+
+    def _new_entry(self, device_id, now, lsn=None):
+        if lsn is not None and self.wal_tracker is not None:
+            self.wal_tracker.hold(lsn)
+        return {"meta": None, "total_chunks": None, "total_bytes": None, "chunk_size": None,
+                "buffer": None, "received": set(), "pending": {}, "payload": None, "lsn": lsn,
+                "device_id": device_id, "start_time": now, "updated": now, "bytes": ENTRY_OVERHEAD_BYTES}
+
+    @staticmethod
+    def _chunk_span(entry, index):
+        """(offset, expected length) of chunk `index` in the preallocated buffer."""
+        cs = entry["chunk_size"]
+        offset = index * cs
+        return offset, min(cs, entry["total_bytes"] - offset)
+
+    def _write_chunk(self, entry, index, payload):
+        if not 0 <= index < entry["total_chunks"]:
+            raise ValueError(f"chunk index {index} out of range ({entry['total_chunks']} chunks)")
+        offset, length = self._chunk_span(entry, index)
+        if len(payload) != length:
+            raise ValueError(f"chunk {index} has {len(payload)} bytes, expected {length}")
+        entry["buffer"][offset:offset + length] = payload
+        entry["received"].add(index)
+
+    def _try_allocate(self, shard, key, entry):
+        """
+        Allocate the block buffer once meta and chunk size are known, then move parked chunks in.
+        False when the chunk size does not fit the announced size (the entry is rejected).
+        """
+        if entry["buffer"] is not None or not entry["total_chunks"] or entry["total_bytes"] is None:
+            return True
+        n = entry["total_chunks"]
+        if entry["chunk_size"] is None:
+            if not entry["pending"]:
+                return True
+            # any chunk fixes the size: a full one directly, the last one via the remainder
+            index, payload = next(iter(entry["pending"].items()))
+            if index < n - 1:
+                entry["chunk_size"] = len(payload)
+            elif n > 1:
+                entry["chunk_size"] = -(-(entry["total_bytes"] - len(payload)) // (n - 1))
+            else:
+                entry["chunk_size"] = entry["total_bytes"]
+            if entry["chunk_size"] <= 0 or entry["total_bytes"] > n * entry["chunk_size"]:
+                self._reject(shard, key)  # the chunks do not add up to the announced size
+                return False
+        pending = entry["pending"]
+        parked = sum(len(p) for p in pending.values())
+        self._make_room(shard, key, entry["total_bytes"] - parked)
+        entry["buffer"] = bytearray(entry["total_bytes"])
+        entry["pending"] = {}
+        entry["bytes"] += entry["total_bytes"] - parked
+        self._charge(entry["total_bytes"] - parked)
+        for index, payload in pending.items():
+            self._write_chunk(entry, index, payload)
+        return True
+
+    def _reject(self, shard, key):
+        """Drop a block whose meta / chunk sizes are impossible (and whatever was collected for it)."""
+        self.rejected += 1
+        if key in shard.entries:
+            self._remove(shard, key)
+
+    def _remove(self, shard, key, completed=False):
+        entry = shard.entries.pop(key)
+        dev = key[0]
+        shard.per_device[dev] -= 1
+        if not shard.per_device[dev]:
+            del shard.per_device[dev]
+        self._charge(-entry["bytes"])
+        if not completed and self.wal_tracker is not None:
+            self.wal_tracker.release(entry["lsn"])
+        return entry
+
+    def _get_or_create(self, shard, key, now, lsn=None):
+        entry = shard.entries.get(key)
+        if entry is None:
+            dev = key[0]
+            # per-device cap: evict this device's least recently touched block
+            if shard.per_device.get(dev, 0) >= self.max_per_device:
+                oldest = next(k for k in shard.entries if k[0] == dev)
+                self._remove(shard, oldest)
+                self.evicted += 1
+            entry = self._new_entry(dev, now, lsn)
+            shard.entries[key] = entry
+            shard.per_device[dev] = shard.per_device.get(dev, 0) + 1
+            self._charge(entry["bytes"])
+            self.started += 1
+        else:
+            entry["updated"] = now
+            shard.entries.move_to_end(key)
+        return entry
+
+    def _make_room(self, shard, keep_key, needed):
+        """Evict least recently touched entries (this shard first, then the others) until `needed` fits."""
+        if self.bytes + needed <= self.max_bytes:
+            return
+        for s in [shard] + [x for x in self._shards if x is not shard]:
+            # never wait on another shard while holding ours (lock order deadlock); skip busy shards
+            if s is not shard and not s.lock.acquire(blocking=False):
+                continue
+            try:
+                for key in list(s.entries):
+                    if self.bytes + needed <= self.max_bytes:
+                        return
+                    if key == keep_key:
+                        continue
+                    self._remove(s, key)
+                    self.evicted += 1
+            finally:
+                if s is not shard:
+                    s.lock.release()
+
+    def _complete_if_ready(self, shard, key, entry):
+        n = entry["total_chunks"]
+        if not n:
+            return None
+        if entry["buffer"] is not None:
+            if len(entry["received"]) < n:
+                return None
+            entry["payload"] = memoryview(entry["buffer"])
+        else:
+            # meta without "bytes": sizes unknown up front, join the parked chunks once at the end
+            if len(entry["pending"]) < n:
+                return None
+            entry["payload"] = memoryview(b"".join(entry["pending"][i] for i in range(n)))
+            entry["pending"] = {}
+        self._remove(shard, key, completed=True)
+        self.completed += 1
+        return entry
+
+    def add_meta(self, device_id, block_id, meta, lsn=None):
+        now = time.time()
+        shard = self._shard(device_id)
+        key = (device_id, block_id)
+        try:
+            total_chunks = int(meta.get("chunks"))
+            total_bytes = int(meta["bytes"]) if meta.get("bytes") is not None else None
+            chunk_size = int(meta["chunk_size"]) if meta.get("chunk_size") else None
+        except (TypeError, ValueError):
+            total_chunks = 0
+        # sizes come from the device: the buffer is allocated from them, so they must fit the budget
+        if total_chunks <= 0 or (total_bytes is not None and not 0 < total_bytes <= self.max_bytes - ENTRY_OVERHEAD_BYTES) \
+                or (chunk_size is not None and (chunk_size <= 0 or (total_bytes or 0) > total_chunks * chunk_size)):
+            with shard.lock:
+                self._reject(shard, key)
+            return None
+        with shard.lock:
+            entry = self._get_or_create(shard, key, now, lsn)
+            entry["meta"] = meta
+            entry["total_chunks"] = total_chunks
+            entry["total_bytes"] = total_bytes
+            if chunk_size is not None:
+                entry["chunk_size"] = chunk_size
+            if not self._try_allocate(shard, key, entry):
+                return None
+            return self._complete_if_ready(shard, key, entry)
+
+    def add_chunk(self, device_id, block_id, index, payload, lsn=None):
+        now = time.time()
+        n = len(payload)
+        if index < 0 or n + ENTRY_OVERHEAD_BYTES > self.max_bytes:
+            # a negative index would slice the buffer from its end and grow it
+            self.rejected += 1
+            return None
+        shard = self._shard(device_id)
+        key = (device_id, block_id)
+        with shard.lock:
+            entry = self._get_or_create(shard, key, now, lsn)
+            if index in entry["received"] or index in entry["pending"]:
+                self.duplicate_chunks += 1
+                return None
+            if entry["buffer"] is not None:
+                # buffer is already charged against the budget
+                self._write_chunk(entry, index, payload)
+            else:
+                self._make_room(shard, key, n)
+                entry["pending"][index] = payload
+                entry["bytes"] += n
+                self._charge(n)
+                if not self._try_allocate(shard, key, entry):
+                    return None
+            return self._complete_if_ready(shard, key, entry)
+
+    def sweep(self, now=None):
+        """Drop entries idle for more than ttl seconds. Returns the number expired."""
+        now = now or time.time()
+        cutoff = now - self.ttl
+        n = 0
+        for shard in self._shards:
+            with shard.lock:
+                # entries are kept in touch order, so stop at the first fresh one
+                while shard.entries:
+                    key, entry = next(iter(shard.entries.items()))
+                    if entry["updated"] >= cutoff:
+                        break
+                    self._remove(shard, key)
+                    n += 1
+        self.expired += n
+        self.last_sweep = now
+        return n
+
+    def maybe_sweep(self, now=None):
+        now = now or time.time()
+        if now - self.last_sweep >= REASSEMBLY_SWEEP_SEC:
+            return self.sweep(now)
+        return 0
+
+    def __len__(self):
+        return sum(len(s.entries) for s in self._shards)
+
+    def stats(self) -> dict:
+        return {
+            "open_blocks": len(self),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "started": self.started,
+            "completed": self.completed,
+            "expired": self.expired,
+            "evicted": self.evicted,
+            "duplicate_chunks": self.duplicate_chunks,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,66 @@
+# Device-affine routing for running several ingest workers on one MQTT shared subscription
+import os
+import zlib
+
+# Unset: plain subscription (single consumer). Set (e.g. "cm-ingest"): subscribe as $share/<group>/<topic>
+# with MQTT v5, so the broker spreads the fleet's messages over all INGEST_WORKERS workers.
+INGEST_SHARE_GROUP = os.getenv("INGEST_SHARE_GROUP")
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "1"))
+INGEST_WORKER_INDEX = int(os.getenv("INGEST_WORKER_INDEX", "0"))  # 0 .. INGEST_WORKERS-1, unique per worker
+INGEST_FORWARD_PREFIX = os.getenv("INGEST_FORWARD_PREFIX", "cm/ingest")
+
+
+class DeviceRouter:
+    """
+    Every device is owned by exactly one worker (crc32(device_id) % workers). A worker that receives
+    a message for a device it does not own republishes it to the owner's forward topic
+    (<prefix>/<owner>/<original topic>), so raw meta + chunks always meet in one ReassemblyBuffer and
+    a device's baselines / fault debounce state live in one process.
+    All workers must agree on `workers`; change it for every worker at once.
+    """
+
+    def __init__(self, index=INGEST_WORKER_INDEX, workers=INGEST_WORKERS, group=INGEST_SHARE_GROUP,
+                 prefix=INGEST_FORWARD_PREFIX):
+        if not 0 <= index < workers:
+            raise ValueError(f"INGEST_WORKER_INDEX={index} outside 0..{workers - 1}")
+        self.index = index
+        self.workers = workers
+        self.group = group
+        self.prefix = prefix.rstrip("/")
+        self.forwarded = 0
+        self.received_forwarded = 0
+
+    @property
+    def shared(self):
+        return bool(self.group)
+
+    def subscriptions(self, topic):
+        """Topics to subscribe: the (shared) device topic plus this worker's forward inbox."""
+        if not self.shared:
+            return [topic]
+        return [f"$share/{self.group}/{topic}", f"{self.prefix}/{self.index}/#"]
+
+    def owner(self, device_id):
+        if self.workers <= 1 or not device_id:
+            return self.index
+        return zlib.crc32(device_id.encode("utf-8")) % self.workers
+
+    def forward_topic(self, owner, topic):
+        return f"{self.prefix}/{owner}/{topic}"
+
+    def unwrap(self, topic):
+        """Original device topic if `topic` is a message forwarded to this worker, else None."""
+        inbox = f"{self.prefix}/{self.index}/"
+        if topic.startswith(inbox):
+            self.received_forwarded += 1
+            return topic[len(inbox):]
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "index": self.index,
+            "workers": self.workers,
+            "group": self.group,
+            "forwarded": self.forwarded,
+            "received_forwarded": self.received_forwarded,
+        }
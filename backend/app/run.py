@@ -0,0 +1,18 @@
+# Process entry point (Dockerfile / docker-compose.yml):
+#   python app/run.py api       Flask API, plus the embedded MQTT ingest unless INGEST_MODE=external (main.py)
+#   python app/run.py ingest    standalone asyncio ingest service (ingest.py)
+# Kept import-free on purpose: multiprocessing re-runs the __main__ script (as __mp_main__) in every
+# analysis worker (AnalysisExecutor), so the app modules, with their module-level engines, pools, queues
+# and metrics, are only imported under the guard below, i.e. in the parent process.
+import sys
+
+if __name__ == "__main__":
+    role = sys.argv[1] if len(sys.argv) > 1 else "api"
+    if role == "api":
+        import main
+        main.serve()
+    elif role == "ingest":
+        import ingest
+        ingest.serve()
+    else:
+        sys.exit(f"usage: python app/run.py [api|ingest], got {role!r}")
@@ -0,0 +1,143 @@
+# Spectral analysis of reassembled raw blocks (vectorized with NumPy)
+import os
+import numpy as np
+
+from codec import RAW_ENCODING, DELTA_ENCODING, SAMPLE_DTYPE, AXES, decode_blocks
+
+ACCEL_LSB_PER_G = float(os.getenv("ACCEL_LSB_PER_G", "16384.0"))  # MPU9250 at +/-2g
+
+# Band edges in Hz, e.g. "0,10,50,100,200,350,500". Bands above Nyquist stay empty.
+SPECTRUM_BAND_EDGES_HZ = [float(v) for v in os.getenv("SPECTRUM_BAND_EDGES_HZ", "0,10,50,100,200,350,500").split(",")]
+SPECTRUM_PEAKS = int(os.getenv("SPECTRUM_PEAKS", "3"))  # dominant peaks kept per axis
+# a peak is a local maximum of the amplitude spectrum above the axis' noise floor:
+# max(SPECTRUM_PEAK_MIN_G, SPECTRUM_PEAK_SNR x median bin, SPECTRUM_PEAK_REL x strongest bin)
+# (the default SPECTRUM_PEAK_REL is above the Hann window's first sidelobe, -31.5 dB)
+SPECTRUM_PEAK_MIN_G = float(os.getenv("SPECTRUM_PEAK_MIN_G", "0.001"))
+SPECTRUM_PEAK_SNR = float(os.getenv("SPECTRUM_PEAK_SNR", "4"))
+SPECTRUM_PEAK_REL = float(os.getenv("SPECTRUM_PEAK_REL", "0.03"))
+
+_window_cache = {}
+_band_matrix_cache = {}
+
+
+def _hann(n):
+    w = _window_cache.get(n)
+    if w is None:
+        w = np.hanning(n).astype(np.float32)
+        _window_cache[n] = w
+    return w
+
+
+def _band_matrix(n, sample_rate):
+    """(n_bins, n_bands) 0/1 matrix so band energy becomes a single matmul."""
+    key = (n, sample_rate)
+    cached = _band_matrix_cache.get(key)
+    if cached is None:
+        freqs = np.fft.rfftfreq(n, d=1.0 / sample_rate)
+        edges = np.asarray(SPECTRUM_BAND_EDGES_HZ, dtype=np.float64)
+        m = ((freqs[:, None] >= edges[None, :-1]) & (freqs[:, None] < edges[None, 1:])).astype(np.float32)
+        cached = (freqs.astype(np.float32), m)
+        _band_matrix_cache[key] = cached
+    return cached
+
+
+def _peaks(amp, freqs):
+    """Top SPECTRUM_PEAKS local maxima per block and axis of amp (B, bins, 3): (hz, amp), each (B, k, 3)."""
+    inner = amp[:, 1:-1, :]  # neither the DC nor the last bin can be a peak
+    k = min(SPECTRUM_PEAKS, inner.shape[1])
+    if k <= 0:
+        empty = np.full((amp.shape[0], 0, amp.shape[2]), np.nan, dtype=np.float32)
+        return empty, empty
+    is_peak = (inner > amp[:, :-2, :]) & (inner >= amp[:, 2:, :])
+    floor = np.maximum(np.maximum(SPECTRUM_PEAK_MIN_G, SPECTRUM_PEAK_SNR * np.median(inner, axis=1, keepdims=True)),
+                       SPECTRUM_PEAK_REL * inner.max(axis=1, keepdims=True))
+    candidates = np.where(is_peak & (inner >= floor), inner, -1.0)  # amplitudes are >= 0
+    idx = np.argpartition(candidates, -k, axis=1)[:, -k:, :]
+    top = np.take_along_axis(candidates, idx, axis=1)
+    order = np.argsort(-top, axis=1)
+    idx = np.take_along_axis(idx, order, axis=1) + 1
+    top = np.take_along_axis(top, order, axis=1)
+    found = top >= 0
+    return np.where(found, freqs[idx], np.nan), np.where(found, top, np.nan)
+
+
+def _analyze_group(stack, sample_rate):
+    """
+    stack: (B, N, 3) int16 array of blocks sharing N and sample_rate.
+    Returns dict of batched arrays: rms (B,3), band_energy (B,3,bands), peak_hz/peak_amp (B,3,k),
+    strongest peak first, NaN-padded where an axis has fewer than k peaks.
+    """
+    n = stack.shape[1]
+    x = stack.astype(np.float32) / ACCEL_LSB_PER_G
+    x -= x.mean(axis=1, keepdims=True)  # remove DC (gravity) per axis
+    rms = np.sqrt(np.mean(x * x, axis=1))
+
+    w = _hann(n)
+    spec = np.fft.rfft(x * w[None, :, None], axis=1)
+    # single-sided amplitude spectrum corrected for the window's coherent gain
+    amp = np.abs(spec) * (2.0 / w.sum())
+    amp[:, 0, :] *= 0.5
+    if n % 2 == 0:
+        amp[:, -1, :] *= 0.5  # Nyquist bin is not doubled either
+
+    freqs, bands = _band_matrix(n, sample_rate)
+    band_energy = np.einsum("bfa,fk->bak", amp * amp, bands)
+
+    peak_hz, peak_amp = _peaks(amp, freqs)
+    return {
+        "rms": rms,
+        "band_energy": band_energy,
+        "peak_hz": np.transpose(peak_hz, (0, 2, 1)),
+        "peak_amp": np.transpose(peak_amp, (0, 2, 1)),
+    }
+
+
+def _padded_list(a):
+    """Nested list of a NaN-padded array with None (NULL in REAL[], null in JSON) for the padding."""
+    return [[None if v != v else v for v in axis] for axis in a.tolist()]
+
+
+def compute_spectra(blocks: list) -> list:
+    """
+    Batched spectrum computation for many raw blocks.
+    blocks: list of RAW_BLOCK data dicts (block_id, device_id, time, sample_rate, samples, encoding, payload)
+    Returns list of row dicts for insert_spectra_bulk. Blocks with unknown encoding or bad size are skipped.
+    Blocks are grouped by (samples, sample_rate) so each group is one FFT call over a (B, N, 3) stack.
+    """
+    blocks = [b for b in blocks if b.get("encoding", RAW_ENCODING) in (RAW_ENCODING, DELTA_ENCODING) and b.get("payload")]
+    try:
+        views = decode_blocks(blocks)  # delta-encoded payloads are decoded in one batch
+    except ValueError:
+        views = []  # a bad block in the batch: decode one by one so only that block is skipped
+        for b in blocks:
+            try:
+                views.append(decode_blocks([b])[0])
+            except ValueError as e:
+                print(f"[SPECTRUM] skipping block {b.get('block_id')}: {e}")
+                views.append(None)
+
+    groups = {}
+    for b, view in zip(blocks, views):
+        if view is None or view.shape[0] < 2:
+            continue
+        sample_rate = int(b.get("sample_rate") or 1000)
+        groups.setdefault((view.shape[0], sample_rate), []).append((b, view))
+
+    edges = [float(e) for e in SPECTRUM_BAND_EDGES_HZ]
+    rows = []
+    for (n, sample_rate), members in groups.items():
+        res = _analyze_group(np.stack([v for _, v in members]), sample_rate)
+        for i, (b, _) in enumerate(members):
+            rows.append({
+                "time": b.get("time") or b.get("ts_ms"),
+                "device_id": b["device_id"],
+                "block_id": b["block_id"],
+                "sample_rate": sample_rate,
+                "samples": n,
+                "rms_g": res["rms"][i].tolist(),
+                "band_edges_hz": edges,
+                "band_energy": res["band_energy"][i].tolist(),
+                "peak_hz": _padded_list(res["peak_hz"][i]),
+                "peak_amp_g": _padded_list(res["peak_amp"][i]),
+            })
+    return rows
@@ -0,0 +1,332 @@
+# Overload handling for the bounded write queue: drop policies and an on-disk spill journal
+#   WRITE_QUEUE_POLICY=drop_newest  a full queue rejects the new item (the old behaviour)
+#   WRITE_QUEUE_POLICY=drop_oldest  the oldest queued item makes room (fresh telemetry wins)
+#   WRITE_QUEUE_POLICY=spill        overflow is appended to a journal in WRITE_SPILL_DIR and replayed
+#                                   into the queue once it has room and DB writes succeed again;
+#                                   failed DB batches are journaled too (default when WRITE_SPILL_DIR is set)
+# Journal: append-only segment files of WRITE_SPILL_SEGMENT_MB, preallocated and memory-mapped.
+# Record: <I length, <I crc32, pickled item. A zero length marks the end of the written part, and the
+# body is written before its header, so a crash mid-append leaves the record invisible. Segments are
+# deleted once replayed; segments left by a previous run are replayed on startup, from the read position
+# saved by close() (after a crash from the segment start: rows may be written twice, the DB upserts absorb it).
+import os
+import mmap
+import time
+import pickle
+import struct
+import threading
+import zlib
+from collections import deque
+
+from analysis import _picklable
+from logs import sampled
+from metrics import Counter, QUEUE_DROPPED
+
+WRITE_SPILL_DIR = os.getenv("WRITE_SPILL_DIR")  # unset = no journal
+WRITE_QUEUE_POLICY = os.getenv("WRITE_QUEUE_POLICY", "spill" if WRITE_SPILL_DIR else "drop_oldest").lower()
+WRITE_SPILL_SEGMENT_MB = float(os.getenv("WRITE_SPILL_SEGMENT_MB", "64"))
+WRITE_SPILL_MAX_MB = float(os.getenv("WRITE_SPILL_MAX_MB", "1024"))  # journal full -> drop newest
+WRITE_SPILL_FLUSH_SEC = float(os.getenv("WRITE_SPILL_FLUSH_SEC", "1"))  # msync interval (0 = on every append)
+WRITE_SPILL_MAX_RETRIES = int(os.getenv("WRITE_SPILL_MAX_RETRIES", "3"))  # failed batch journaled this often, then dropped
+WRITE_REPLAY_BATCH = int(os.getenv("WRITE_REPLAY_BATCH", "500"))  # items moved back per replay() call
+WRITE_REPLAY_PROBE_SEC = float(os.getenv("WRITE_REPLAY_PROBE_SEC", "5"))  # while DB writes fail: one item per interval
+
+POLICIES = ("drop_newest", "drop_oldest", "spill")
+
+SPILLED = Counter("cm_write_spilled_total", "Items written to the spill journal", ("type",))
+REPLAYED = Counter("cm_write_replayed_total", "Items replayed from the spill journal into the write queue")
+
+_REC = struct.Struct("<II")  # length, crc32
+
+# Exception classes (by name, anywhere in the MRO: psycopg2 / SQLAlchemy / asyncpg) meaning the DB was
+# unreachable rather than the batch being bad. Such failures do not count against WRITE_SPILL_MAX_RETRIES.
+_TRANSIENT = {"OperationalError", "InterfaceError", "DisconnectionError", "PostgresConnectionError",
+              "CannotConnectNowError", "ConnectionError", "TimeoutError", "OSError"}
+
+
+def is_transient(error):
+    return error is not None and any(c.__name__ in _TRANSIENT for c in type(error).__mro__)
+
+
+class SpillJournal:
+    """Append-only journal of write-queue items in memory-mapped segment files. Thread safe."""
+
+    def __init__(self, directory, segment_bytes=int(WRITE_SPILL_SEGMENT_MB * 2**20),
+                 max_bytes=int(WRITE_SPILL_MAX_MB * 2**20), flush_sec=WRITE_SPILL_FLUSH_SEC):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.flush_sec = flush_sec
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._segments = deque()
+        for f in sorted(os.listdir(directory)):
+            if f.startswith("spill-") and f.endswith(".seg"):
+                if os.path.getsize(os.path.join(directory, f)) == 0:
+                    os.remove(os.path.join(directory, f))  # created, never written
+                else:
+                    self._segments.append(int(f[6:-4]))
+        self._maps = {}  # seq -> (file, mmap) of open segments
+        self._write_seq = (self._segments[-1] + 1) if self._segments else 0
+        self._write_pos = 0
+        self._read_pos = self._load_cursor()
+        self._open_write_segment()
+        self._last_flush = time.monotonic()
+        self.appended = 0
+        self.replayed = 0
+        self.full = 0
+        self.corrupt = 0
+        if len(self._segments) > 1:
+            print(f"[SPILL] {len(self._segments) - 1} journal segments left in {directory}, replaying", flush=True)
+
+    def _load_cursor(self):
+        path = os.path.join(self.directory, "cursor")
+        try:
+            with open(path) as f:
+                seq, pos = (int(x) for x in f.read().split())
+            os.remove(path)
+            return pos if self._segments and self._segments[0] == seq else 0
+        except (OSError, ValueError):
+            return 0
+
+    def _path(self, seq):
+        return os.path.join(self.directory, f"spill-{seq:012d}.seg")
+
+    def _map(self, seq):
+        m = self._maps.get(seq)
+        if m is None:
+            f = open(self._path(seq), "r+b")
+            if os.fstat(f.fileno()).st_size < self.segment_bytes and seq == self._write_seq:
+                f.truncate(self.segment_bytes)  # sparse preallocation
+            m = self._maps[seq] = (f, mmap.mmap(f.fileno(), 0))
+        return m[1]
+
+    def _open_write_segment(self):
+        open(self._path(self._write_seq), "ab").close()
+        if not self._segments or self._segments[-1] != self._write_seq:
+            self._segments.append(self._write_seq)
+        self._map(self._write_seq)
+        self._write_pos = 0
+
+    def _close(self, seq, delete=False):
+        f, m = self._maps.pop(seq, (None, None))
+        if m is not None:
+            m.close()
+            f.close()
+        if delete:
+            os.remove(self._path(seq))
+
+    def _disk_bytes(self):
+        return (len(self._segments) - 1) * self.segment_bytes + self._write_pos
+
+    def append(self, item) -> bool:
+        """Journal one item. False when it does not fit (journal at max_bytes or item > segment)."""
+        data = pickle.dumps(_picklable_item(item), protocol=pickle.HIGHEST_PROTOCOL)
+        need = _REC.size + len(data)
+        if need + _REC.size > self.segment_bytes:
+            return False
+        with self._lock:
+            if self._write_pos + need + _REC.size > self.segment_bytes:
+                if self._disk_bytes() + self.segment_bytes > self.max_bytes:
+                    self.full += 1
+                    return False
+                self._map(self._write_seq).flush()
+                if self._segments[0] != self._write_seq:
+                    self._close(self._write_seq)  # the reader reopens it when it gets there
+                self._write_seq += 1
+                self._open_write_segment()
+            m = self._map(self._write_seq)
+            pos = self._write_pos
+            m[pos + _REC.size:pos + need] = data
+            m[pos + need:pos + need + _REC.size] = bytes(_REC.size)  # end mark (the segment may be reused)
+            m[pos:pos + _REC.size] = _REC.pack(len(data), zlib.crc32(data))
+            self._write_pos += need
+            self.appended += 1
+            now = time.monotonic()
+            if now - self._last_flush >= self.flush_sec:
+                m.flush()
+                self._last_flush = now
+        return True
+
+    def pop(self):
+        """Oldest journaled item, or None when the journal is empty."""
+        with self._lock:
+            while True:
+                seq = self._segments[0]
+                m = self._map(seq)
+                pos = self._read_pos
+                length, crc = _REC.unpack_from(m, pos) if pos + _REC.size <= len(m) else (0, 0)
+                if length and pos + _REC.size + length <= len(m):
+                    data = m[pos + _REC.size:pos + _REC.size + length]
+                    self._read_pos = pos + _REC.size + length
+                    if zlib.crc32(data) == crc:
+                        self.replayed += 1
+                        return pickle.loads(data)
+                    self.corrupt += 1
+                    print(f"[SPILL] corrupt record in segment {seq} at {pos}, skipping the rest of it", flush=True)
+                    if seq == self._write_seq:
+                        self._read_pos = self._write_pos
+                        continue
+                elif seq == self._write_seq:
+                    if self._read_pos >= self._write_pos and self._write_pos:
+                        # caught up: start the segment over instead of growing it (appends end-mark their record)
+                        self._read_pos = self._write_pos = 0
+                        m[:_REC.size] = bytes(_REC.size)
+                    return None
+                # end of an older segment (or the rest of a corrupt one): drop it and go on
+                self._segments.popleft()
+                self._close(seq, delete=True)
+                self._read_pos = 0
+
+    def empty(self) -> bool:
+        with self._lock:
+            return len(self._segments) == 1 and self._read_pos >= self._write_pos
+
+    def close(self):
+        with self._lock:
+            with open(os.path.join(self.directory, "cursor"), "w") as f:
+                f.write(f"{self._segments[0]} {self._read_pos}")
+            for seq in list(self._maps):
+                self._maps[seq][1].flush()
+                self._close(seq)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"segments": len(self._segments), "bytes": self._disk_bytes(), "appended": self.appended,
+                    "replayed": self.replayed, "full": self.full, "corrupt": self.corrupt}
+
+
+def _picklable_item(item):
+    data = item.get("data")
+    if item.get("type") == "RAW_BLOCK" and isinstance(data, dict):
+        return dict(item, data=_picklable(data))
+    if item.get("type") == "ROWS":
+        return dict(item, data=[_picklable(r) for r in data])
+    return item
+
+
+class Backpressure:
+    """
+    Applies the overload policy in front of a bounded queue (queue.Queue or asyncio.Queue).
+    offer() never blocks; replay() moves journaled items back while the queue is below half full.
+    The journal is opened on first use, so processes that never write (INGEST_MODE=external API)
+    do not touch spill_dir. One process per spill_dir.
+    on_release(item) is called for items that leave without being queued (dropped, or journaled: a
+    journaled item is durable on its own, so it is stored without its WAL "lsn").
+    """
+
+    def __init__(self, queue, full_exc, empty_exc, policy=WRITE_QUEUE_POLICY, spill_dir=WRITE_SPILL_DIR,
+                 task_done=False, name="write", on_release=None):
+        if policy not in POLICIES:
+            raise ValueError(f"WRITE_QUEUE_POLICY must be one of {', '.join(POLICIES)}")
+        if policy == "spill" and not spill_dir:
+            raise ValueError("WRITE_QUEUE_POLICY=spill needs WRITE_SPILL_DIR")
+        self.queue = queue
+        self.full_exc = full_exc
+        self.empty_exc = empty_exc
+        self.policy = policy
+        self.task_done = task_done  # queue.Queue: balance get_nowait() with task_done()
+        self.name = name
+        self.on_release = on_release
+        self.spill_dir = spill_dir
+        self._journal = None
+        self.dropped = 0
+        self._last_probe = 0.0
+
+    @property
+    def journal(self):
+        if self._journal is None and self.policy == "spill":
+            self._journal = SpillJournal(self.spill_dir)
+        return self._journal
+
+    def _drop(self, item, why):
+        if self.on_release is not None:
+            self.on_release(item)
+        self.dropped += 1
+        QUEUE_DROPPED.inc(item.get("type", "?"))
+        sampled(f"{self.name}_drop", f"[BACKPRESSURE] {self.name} queue: dropped {item.get('type')} ({why}), {self.dropped} so far")
+
+    def _spill(self, item):
+        # the journal makes the item durable on its own, so it goes in without its WAL lsn
+        if self.journal.append({k: v for k, v in item.items() if k != "lsn"} if "lsn" in item else item):
+            SPILLED.inc(item.get("type", "?"))
+            if self.on_release is not None:
+                self.on_release(item)
+            return True
+        self._drop(item, "spill journal full")
+        return False
+
+    def offer(self, item) -> bool:
+        """Queue (or journal) an item. False if it was dropped."""
+        # while a backlog is journaled, new items queue behind it so replay keeps their order
+        if self.journal is not None and not self.journal.empty():
+            return self._spill(item)
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except self.full_exc:
+            pass
+        if self.policy == "spill":
+            return self._spill(item)
+        if self.policy == "drop_oldest":
+            try:
+                oldest = self.queue.get_nowait()
+                if self.task_done:
+                    self.queue.task_done()
+                self._drop(oldest, "drop_oldest")
+            except self.empty_exc:
+                pass
+            try:
+                self.queue.put_nowait(item)
+                return True
+            except self.full_exc:
+                pass
+        self._drop(item, "queue full")
+        return False
+
+    def spill_failed_batch(self, table, rows, attempts=0, error=None):
+        """
+        Journal the rows of a failed DB batch as a ROWS item (IngestProcessor re-batches them on replay).
+        Returns False when they are dropped: no journal, or WRITE_SPILL_MAX_RETRIES non-transient failures.
+        """
+        if self.journal is None or not rows:
+            return False
+        if not is_transient(error):
+            attempts += 1
+            if attempts > WRITE_SPILL_MAX_RETRIES:
+                print(f"[BACKPRESSURE] {table} batch of {len(rows)} rows failed {attempts} times, dropped", flush=True)
+                return False
+        return self._spill({"type": "ROWS", "table": table, "data": rows, "attempts": attempts})
+
+    def replay(self, healthy=True, limit=WRITE_REPLAY_BATCH) -> int:
+        """
+        Move up to `limit` journaled items into the queue while it is below half full. Unless `healthy`
+        (last DB writes ok) only one item per WRITE_REPLAY_PROBE_SEC goes back, to find out when the DB recovers.
+        """
+        if self.journal is None:
+            return 0
+        if not healthy:
+            now = time.monotonic()
+            if now - self._last_probe < WRITE_REPLAY_PROBE_SEC:
+                return 0
+            self._last_probe = now
+            limit = 1
+        n = 0
+        while n < limit and self.queue.qsize() < self.queue.maxsize // 2:
+            item = self.journal.pop()
+            if item is None:
+                break
+            self.queue.put_nowait(item)
+            n += 1
+        if n:
+            REPLAYED.inc(amount=n)
+        return n
+
+    def close(self):
+        """msync and unmap the journal (shutdown); what is left is replayed on the next start."""
+        if self._journal is not None:
+            self._journal.close()
+
+    def stats(self) -> dict:
+        return {"policy": self.policy, "dropped": self.dropped,
+                "journal": self._journal.stats() if self._journal is not None else None}
@@ -0,0 +1,149 @@
+# TimescaleDB storage policies (compression / retention / tiering) and the storage report behind /api/admin/storage
+#   python app/storage.py           apply the STORAGE_* settings below to the database
+#   python app/storage.py --report  print chunk sizes and compression ratios
+import os
+import json
+from sqlalchemy import text
+from db import engine
+
+# Intervals are PostgreSQL interval strings ("1 day", "12 hours"); "" or "off" removes the policy.
+# Defaults match sql/init_schema.sql, so a fresh database already runs with them.
+STORAGE_POLICIES = {
+    "raw_blocks": {
+        "segmentby": "device_id",
+        "orderby": "time DESC, block_id",
+        "compress_after": os.getenv("STORAGE_RAW_COMPRESS_AFTER", "1 day"),
+        "drop_after": os.getenv("STORAGE_RAW_DROP_AFTER", "90 days"),
+        "tier_after": os.getenv("STORAGE_RAW_TIER_AFTER", ""),
+    },
+    "readings_parameters": {
+        "segmentby": "device_id",
+        "orderby": "time DESC",
+        "compress_after": os.getenv("STORAGE_READINGS_COMPRESS_AFTER", "7 days"),
+        "drop_after": os.getenv("STORAGE_READINGS_DROP_AFTER", ""),
+        "tier_after": os.getenv("STORAGE_READINGS_TIER_AFTER", ""),
+    },
+}
+
+# policy kind -> (add function, remove function, background job proc, config key)
+_POLICY_FUNCS = {
+    "compress_after": ("add_compression_policy", "remove_compression_policy", "policy_compression", "compress_after"),
+    "drop_after": ("add_retention_policy", "remove_retention_policy", "policy_retention", "drop_after"),
+    # object storage tiering only exists on Timescale's hosted service; skipped where the function is missing
+    "tier_after": ("add_tiering_policy", "remove_tiering_policy", "policy_tiering", "move_after"),
+}
+
+
+def _off(value):
+    return not value or value.strip().lower() in ("off", "none", "0")
+
+
+def _apply_policy(conn, table, kind, value):
+    add_fn, remove_fn, proc, key = _POLICY_FUNCS[kind]
+    if not conn.execute(text("SELECT EXISTS (SELECT 1 FROM pg_proc WHERE proname = :fn)"), {"fn": add_fn}).scalar():
+        if not _off(value):
+            print(f"[STORAGE] {table}: {add_fn} not available on this server, {kind}={value} skipped", flush=True)
+        return
+    current = conn.execute(text("""
+        SELECT config ->> :key FROM timescaledb_information.jobs
+        WHERE hypertable_name = :table AND proc_name = :proc
+    """), {"key": key, "table": table, "proc": proc}).scalar()
+    if _off(value):
+        if current is not None:
+            conn.execute(text(f"SELECT {remove_fn}(:table, if_exists => TRUE)"), {"table": table})
+            print(f"[STORAGE] {table}: removed {kind} policy", flush=True)
+        return
+    if current is not None:
+        if conn.execute(text("SELECT CAST(:a AS interval) = CAST(:b AS interval)"), {"a": current, "b": value}).scalar():
+            return
+        conn.execute(text(f"SELECT {remove_fn}(:table, if_exists => TRUE)"), {"table": table})
+    conn.execute(text(f"SELECT {add_fn}(:table, CAST(:after AS interval))"), {"table": table, "after": value})
+    print(f"[STORAGE] {table}: {kind} = {value} (was {current})", flush=True)
+
+
+def apply_storage_policies(policies=STORAGE_POLICIES):
+    """Enable compression (segmented by device) and bring the policy jobs in line with `policies`."""
+    with engine.begin() as conn:
+        for table, p in policies.items():
+            enabled = conn.execute(text("""
+                SELECT compression_enabled FROM timescaledb_information.hypertables WHERE hypertable_name = :table
+            """), {"table": table}).scalar()
+            if enabled is None:
+                print(f"[STORAGE] {table} is not a hypertable, skipped", flush=True)
+                continue
+            if not enabled:
+                conn.execute(text(f"""
+                    ALTER TABLE {table} SET (timescaledb.compress,
+                        timescaledb.compress_segmentby = '{p["segmentby"]}',
+                        timescaledb.compress_orderby = '{p["orderby"]}')
+                """))
+                print(f"[STORAGE] {table}: compression enabled (segmentby {p['segmentby']})", flush=True)
+            for kind in ("compress_after", "drop_after", "tier_after"):
+                _apply_policy(conn, table, kind, p[kind])
+
+
+def get_storage_report(with_chunks=False):
+    """Per hypertable: sizes, compression ratio and policy jobs; optionally per chunk."""
+    report = []
+    with engine.connect() as conn:
+        tables = conn.execute(text("""
+            SELECT hypertable_name, compression_enabled, num_chunks
+            FROM timescaledb_information.hypertables ORDER BY hypertable_name
+        """)).fetchall()
+        for t in tables:
+            name = t.hypertable_name
+            size = conn.execute(text("SELECT * FROM hypertable_detailed_size(:t)"), {"t": name}).mappings().fetchone()
+            comp = conn.execute(text("""
+                SELECT coalesce(sum(number_compressed_chunks), 0)::int AS compressed_chunks,
+                       sum(before_compression_total_bytes)::bigint AS before_bytes,
+                       sum(after_compression_total_bytes)::bigint AS after_bytes
+                FROM hypertable_compression_stats(:t)
+            """), {"t": name}).mappings().fetchone()
+            jobs = conn.execute(text("""
+                SELECT proc_name, schedule_interval, config FROM timescaledb_information.jobs WHERE hypertable_name = :t
+            """), {"t": name}).fetchall()
+            entry = {
+                "table": name,
+                "compression_enabled": t.compression_enabled,
+                "chunks": t.num_chunks,
+                "compressed_chunks": comp["compressed_chunks"],
+                "total_bytes": size["total_bytes"],
+                "table_bytes": size["table_bytes"],
+                "index_bytes": size["index_bytes"],
+                "before_compression_bytes": comp["before_bytes"],
+                "after_compression_bytes": comp["after_bytes"],
+                "compression_ratio": round(comp["before_bytes"] / comp["after_bytes"], 2) if comp["after_bytes"] else None,
+                "policies": [{"job": j.proc_name, "schedule_interval": str(j.schedule_interval),
+                              "config": j.config if not isinstance(j.config, str) else json.loads(j.config)} for j in jobs],
+            }
+            if with_chunks:
+                rows = conn.execute(text("""
+                    SELECT c.chunk_name, c.range_start, c.range_end, c.is_compressed, s.total_bytes,
+                           cs.before_compression_total_bytes AS before_bytes, cs.after_compression_total_bytes AS after_bytes
+                    FROM timescaledb_information.chunks c
+                    JOIN chunks_detailed_size(:t) s ON s.chunk_name = c.chunk_name
+                    LEFT JOIN chunk_compression_stats(:t) cs ON cs.chunk_name = c.chunk_name
+                    WHERE c.hypertable_name = :t
+                    ORDER BY c.range_start
+                """), {"t": name}).mappings().fetchall()
+                entry["chunk_details"] = [{
+                    "chunk": r["chunk_name"],
+                    "range_start": r["range_start"].isoformat(),
+                    "range_end": r["range_end"].isoformat(),
+                    "compressed": r["is_compressed"],
+                    "total_bytes": r["total_bytes"],
+                    "before_compression_bytes": r["before_bytes"],
+                    "after_compression_bytes": r["after_bytes"],
+                } for r in rows]
+            report.append(entry)
+    return report
+
+
+if __name__ == "__main__":
+    import sys
+    from db import wait_for_db
+    wait_for_db()
+    if "--report" in sys.argv:
+        print(json.dumps(get_storage_report(with_chunks="--chunks" in sys.argv), indent=2, default=str))
+    else:
+        apply_storage_policies()
@@ -0,0 +1,118 @@
+# Telemetry message helpers shared by the threaded MQTT client (main.py) and the async ingest service (ingest.py)
+import json
+import time
+from db import to_utc_datetime, READINGS_SCHEMA, TYPED_METRICS
+from codec import RAW_ENCODING
+
+_TYPED = frozenset(TYPED_METRICS)
+
+# Topic kinds returned by parse_topic
+TELEMETRY = "telemetry"  # v1/device/<id>/telemetry                          (JSON metrics)
+RAW_META = "raw_meta"    # v1/device/<id>/telemetry/raw/meta                 (JSON block header)
+RAW_CHUNK = "raw_chunk"  # v1/device/<id>/telemetry/raw/chunk/<block_id>/<seq> (binary)
+
+DEFAULT_RAW_ENCODING = RAW_ENCODING
+
+
+def parse_topic(topic):
+    """
+    Split a device topic into (kind, device_id, block_id, chunk_index).
+    kind is None for topics that are not device telemetry; chunk_index is None if it is not an int.
+    """
+    parts = topic.split("/")
+    if len(parts) < 4 or parts[0] != "v1" or parts[1] != "device" or parts[3] != "telemetry":
+        return None, (parts[2] if len(parts) > 2 else None), None, None
+    device_id = parts[2]
+    n = len(parts)
+    if n == 4:
+        return TELEMETRY, device_id, None, None
+    if parts[4] == "raw":
+        if n >= 6 and parts[5] == "meta":
+            return RAW_META, device_id, None, None
+        if n >= 8 and parts[5] == "chunk":
+            try:
+                index = int(parts[7])
+            except ValueError:
+                index = None
+            return RAW_CHUNK, device_id, parts[6], index
+    return None, device_id, None, None
+
+
+def metric_item(device_id, data):
+    """METRIC queue item data from a decoded telemetry JSON payload."""
+    return {
+        "device_id": data.get("device_id") or device_id,
+        "ts_ms": data.get("ts_ms"),
+        "sample_rate_hz": data.get("sample_rate_hz"),
+        "samples": data.get("samples"),
+        "metrics": data.get("metrics")
+    }
+
+
+def raw_block_from_entry(device_id, block_id, entry):
+    """RAW_BLOCK queue item data from a completed reassembly entry (payload stays a memoryview)."""
+    meta = entry.get("meta") or {}
+    ts_ms = meta.get("ts_ms") or meta.get("time") or None
+    if ts_ms is None:
+        # fallback to parse from block_id or use current time
+        try:
+            ts_ms = int(float(block_id.split("-")[0]) * 1000)
+        except Exception:
+            ts_ms = int(time.time() * 1000)
+    payload = entry["payload"]
+    return {
+        "block_id": block_id,
+        "device_id": device_id,
+        "time": ts_ms,
+        "sample_rate": meta.get("sample_rate_hz") or 1000,  # firmware does not send it in the raw meta yet
+        "samples": len(payload) // 6,  # 3 channels * int16 => 6 bytes per sample
+        "encoding": meta.get("encoding", DEFAULT_RAW_ENCODING),
+        "payload": payload,
+        "crc32": None  # Validate CRC here if needed
+    }
+
+
+def metric_row(data):
+    """
+    Normalize METRIC item data to a readings_parameters row.
+    Returns (row, metrics_obj) or (None, None) when device_id is missing.
+    row["metrics"] is a JSON string; metrics_obj is the decoded dict (for baselines / fault rules).
+    With READINGS_SCHEMA=typed the TYPED_METRICS are row keys of their own and row["metrics"] holds the extras.
+    """
+    device_id = data.get("device_id")
+    if not device_id:
+        return None, None
+    metrics_obj = data.get("metrics") or data.get("metrics_json") or None
+    row = {
+        "time": to_utc_datetime(data.get("ts_ms") or data.get("time") or None),
+        "device_id": device_id,
+        "sample_rate": data.get("sample_rate_hz") or data.get("sample_rate"),
+        "samples": data.get("samples"),
+    }
+    if READINGS_SCHEMA == "typed" and isinstance(metrics_obj, dict):
+        # known metrics go to their columns, only the rest is serialized
+        extras = {k: v for k, v in metrics_obj.items() if k not in _TYPED}
+        row.update({m: metrics_obj.get(m) for m in TYPED_METRICS})
+        row["metrics"] = json.dumps(extras) if extras else None
+        return row, metrics_obj
+    if READINGS_SCHEMA == "typed":
+        row.update(dict.fromkeys(TYPED_METRICS))
+    # metrics must be JSON serializable string or dict; store JSON string
+    row["metrics"] = json.dumps(metrics_obj) if (metrics_obj is not None and not isinstance(metrics_obj, str)) else metrics_obj
+    return row, metrics_obj
+
+
+def raw_block_row(d):
+    """Normalize RAW_BLOCK item data to a raw_blocks row, or None if required fields are missing."""
+    if not d.get("device_id") or not d.get("block_id") or not d.get("payload"):
+        return None
+    return {
+        "block_id": d["block_id"],
+        "device_id": d["device_id"],
+        "time": to_utc_datetime(d.get("time") or d.get("ts_ms")),
+        "sample_rate": d.get("sample_rate"),
+        "samples": d.get("samples"),
+        "encoding": d.get("encoding", "int16_binary"),
+        "payload": d["payload"],
+        "crc32": d.get("crc32")
+    }
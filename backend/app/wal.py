@@ -0,0 +1,264 @@
+# Ingest write-ahead log: every device message is appended here before it is processed, and
+# replayed on startup until the DB rows derived from it are committed.
+#   WAL_DIR          enables it (one directory per ingesting process)
+#   WAL_FSYNC        batch (default): fsync every WAL_FSYNC_MS on a background thread
+#                    always: fsync before the message is handled (and acknowledged to the broker)
+#                    off: page cache only (survives a process crash / OOM kill, not power loss)
+# Segments wal-<first lsn>.log of up to WAL_SEGMENT_MB hold records
+#   <I body length, <I crc32(body), body = <Q lsn, <d received_at, <H topic length, topic, payload
+# LSNs increase across restarts. WalTracker knows the oldest LSN whose rows are not committed yet
+# (queued items, open reassembly entries, analysis in flight, buffered / in-flight DB batches);
+# checkpoint() deletes the segments below it and records it, so replay starts there.
+# A DB batch that fails without a spill journal (WRITE_SPILL_DIR) keeps its LSN for WAL_PIN_MAX_SEC, so a
+# restart within that time replays it; after that it is dropped and the WAL trimmed past it (batcher.py).
+# What survives a crash: the messages already appended. Both clients append inside paho's on_message
+# callback (ingest.py via LoggedQueue), and paho sends the QoS 1 PUBACK after it returns, so with a WAL_DIR
+# (QoS 1 subscription, persistent session: INGEST_MQTT_QOS, INGEST_MQTT_PERSISTENT) a message published at
+# QoS 1 that is not logged yet is redelivered by the broker. The current firmware (PubSubClient) publishes
+# at QoS 0: the broker delivers those at QoS 0, keeps no copy, and one lost before the append is gone.
+# Replayed messages go through the normal path; the DB writes are upserts keyed on
+# (time, device_id[, block_id]), alerts on (device_id, rule, created_at), so a replay is idempotent.
+import os
+import heapq
+import struct
+import threading
+import time
+import zlib
+
+WAL_DIR = os.getenv("WAL_DIR")  # unset = no WAL
+WAL_SEGMENT_MB = float(os.getenv("WAL_SEGMENT_MB", "64"))
+WAL_FSYNC = os.getenv("WAL_FSYNC", "batch").lower()
+WAL_FSYNC_MS = float(os.getenv("WAL_FSYNC_MS", "50"))
+WAL_CHECKPOINT_SEC = float(os.getenv("WAL_CHECKPOINT_SEC", "5"))
+WAL_PIN_MAX_SEC = float(os.getenv("WAL_PIN_MAX_SEC", "3600"))  # failed, unjournaled batches hold the WAL this long
+
+_HEAD = struct.Struct("<II")  # body length, crc32
+_BODY = struct.Struct("<QdH")  # lsn, received_at, topic length
+
+
+class WriteAheadLog:
+    """
+    Append-only, checksummed, segment-rotated message log. append() is thread safe and holds the new
+    LSN in `tracker` (the caller releases it once the message is handled), so a concurrent checkpoint
+    never passes a message that is logged but not handled yet.
+    """
+
+    def __init__(self, directory, tracker=None, segment_bytes=int(WAL_SEGMENT_MB * 2**20), fsync=WAL_FSYNC,
+                 fsync_ms=WAL_FSYNC_MS):
+        if fsync not in ("batch", "always", "off"):
+            raise ValueError("WAL_FSYNC must be batch, always or off")
+        self.directory = directory
+        self.tracker = tracker
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.fsync_interval = fsync_ms / 1000.0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.checkpoint_lsn = self._read_checkpoint()
+        self._segments = []
+        for first in sorted(int(f[4:-4]) for f in os.listdir(directory) if f.startswith("wal-") and f.endswith(".log")):
+            if os.path.getsize(self._path(first)):
+                self._segments.append(first)
+            else:
+                os.remove(self._path(first))
+        # records written by earlier runs, replayed by replay(); a new segment is started for this run
+        self._recovered = list(self._segments)
+        self.next_lsn = self.checkpoint_lsn
+        if self._segments:
+            # a segment is named after the LSN that was next when it was opened
+            last = self._last_lsn(self._segments[-1])
+            self.next_lsn = max(self.next_lsn, self._segments[-1], (last + 1) if last is not None else 0)
+        self._fd = None
+        self._size = 0
+        self._open_segment()
+        self._dirty = False
+        self.appended = 0
+        self.bytes = 0
+        self.fsyncs = 0
+        self.replayed = 0
+        if self.fsync == "batch":
+            threading.Thread(target=self._fsync_loop, name="wal-fsync", daemon=True).start()
+
+    def _path(self, first_lsn):
+        return os.path.join(self.directory, f"wal-{first_lsn:016d}.log")
+
+    def _read_checkpoint(self):
+        try:
+            with open(os.path.join(self.directory, "checkpoint")) as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def _open_segment(self):
+        if self._fd is not None:
+            os.fsync(self._fd)
+            os.close(self._fd)
+        self._fd = os.open(self._path(self.next_lsn), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        if not self._segments or self._segments[-1] != self.next_lsn:
+            self._segments.append(self.next_lsn)
+        self._size = 0
+
+    def append(self, topic, payload, received_at=None) -> int:
+        """Log one message; returns its LSN."""
+        t = topic.encode("utf-8")
+        received_at = received_at or time.time()
+        with self._lock:
+            lsn = self.next_lsn
+            body = _BODY.pack(lsn, received_at, len(t)) + t + payload
+            if self._size and self._size + _HEAD.size + len(body) > self.segment_bytes:
+                self._open_segment()
+            os.write(self._fd, _HEAD.pack(len(body), zlib.crc32(body)) + body)
+            self._size += _HEAD.size + len(body)
+            if self.tracker is not None:
+                self.tracker.hold(lsn)
+            self.next_lsn += 1
+            self.appended += 1
+            self.bytes += _HEAD.size + len(body)
+            if self.fsync == "always":
+                os.fsync(self._fd)
+                self.fsyncs += 1
+            else:
+                self._dirty = True
+        return lsn
+
+    def _fsync_loop(self):
+        while True:
+            time.sleep(self.fsync_interval)
+            with self._lock:
+                if self._fd is None:
+                    return  # closed
+                if not self._dirty:
+                    continue
+                self._dirty = False
+                fd = os.dup(self._fd)  # appends continue (and may rotate) while this one syncs
+            try:
+                os.fsync(fd)
+                self.fsyncs += 1
+            finally:
+                os.close(fd)
+
+    def _records(self, first_lsn):
+        """(lsn, received_at, topic, payload) of one segment, up to the first torn or corrupt record."""
+        path = self._path(first_lsn)
+        with open(path, "rb") as f:
+            data = f.read()
+        pos = 0
+        while pos + _HEAD.size <= len(data):
+            length, crc = _HEAD.unpack_from(data, pos)
+            body = data[pos + _HEAD.size:pos + _HEAD.size + length]
+            if length < _BODY.size or len(body) < length or zlib.crc32(body) != crc:
+                print(f"[WAL] {path}: torn or corrupt record at byte {pos}, ignoring the rest of the segment", flush=True)
+                return
+            lsn, received_at, tlen = _BODY.unpack_from(body)
+            yield lsn, received_at, body[_BODY.size:_BODY.size + tlen].decode("utf-8"), body[_BODY.size + tlen:]
+            pos += _HEAD.size + length
+
+    def _last_lsn(self, first_lsn):
+        last = None
+        for lsn, *_ in self._records(first_lsn):
+            last = lsn
+        return last
+
+    def replay(self):
+        """Yield (lsn, received_at, topic, payload) of the records earlier runs left at or after the checkpoint."""
+        for first in self._recovered:
+            if not os.path.exists(self._path(first)):
+                continue
+            for rec in self._records(first):
+                if rec[0] >= self.checkpoint_lsn:
+                    self.replayed += 1
+                    yield rec
+        self._recovered = []
+
+    def checkpoint(self, low_water):
+        """Record that every LSN below low_water is committed and delete the segments holding only those."""
+        with self._lock:
+            if self._recovered:
+                return 0  # replay() has not run (or finished): those records are not held anywhere yet
+            low_water = min(low_water, self.next_lsn)
+            if low_water <= self.checkpoint_lsn:
+                return 0
+            tmp = os.path.join(self.directory, "checkpoint.tmp")
+            with open(tmp, "w") as f:
+                f.write(str(low_water))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, os.path.join(self.directory, "checkpoint"))
+            self.checkpoint_lsn = low_water
+            # a segment is done when the next one starts at or below low_water; the current one never is
+            done = [first for first, nxt in zip(self._segments, self._segments[1:]) if nxt <= low_water]
+            self._segments = self._segments[len(done):]
+        for first in done:
+            try:
+                os.remove(self._path(first))
+            except FileNotFoundError:
+                pass
+        return len(done)
+
+    def close(self):
+        """fsync and close the current segment (shutdown)."""
+        with self._lock:
+            if self._fd is not None:
+                os.fsync(self._fd)
+                os.close(self._fd)
+                self._fd = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"segments": len(self._segments), "next_lsn": self.next_lsn, "checkpoint_lsn": self.checkpoint_lsn,
+                    "appended": self.appended, "bytes": self.bytes, "fsyncs": self.fsyncs, "replayed": self.replayed}
+
+
+class WalTracker:
+    """
+    Oldest LSN not yet committed to the DB. Pipeline stages hold() an LSN while they own work derived
+    from that message and release() it when the work moves on (hold the next owner first) or is
+    committed / dropped. Batchers report their own minimum through add_provider(batcher.min_lsn).
+    None LSNs (no WAL, or items replayed from the spill journal) are ignored.
+    """
+
+    def __init__(self):
+        self._counts = {}
+        self._heap = []
+        self._lock = threading.Lock()
+        self._providers = []
+
+    def hold(self, lsn):
+        if lsn is None:
+            return
+        with self._lock:
+            n = self._counts.get(lsn, 0)
+            self._counts[lsn] = n + 1
+            if not n:
+                heapq.heappush(self._heap, lsn)
+
+    def release(self, lsn):
+        if lsn is None:
+            return
+        with self._lock:
+            n = self._counts.get(lsn)
+            if n is None:
+                return
+            if n > 1:
+                self._counts[lsn] = n - 1
+            else:
+                del self._counts[lsn]
+
+    def add_provider(self, fn):
+        self._providers.append(fn)
+
+    def low_water(self, next_lsn):
+        """Smallest held / provided LSN, or next_lsn when nothing is outstanding."""
+        with self._lock:
+            while self._heap and self._heap[0] not in self._counts:
+                heapq.heappop(self._heap)
+            low = self._heap[0] if self._heap else next_lsn
+        for fn in self._providers:
+            v = fn()
+            if v is not None and v < low:
+                low = v
+        return low
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"held": len(self._counts)}
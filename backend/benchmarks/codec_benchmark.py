@@ -0,0 +1,76 @@
+# Raw block encoding benchmark: firmware int16 format vs delta/zigzag-varint/zstd (codec.py)
+#   python benchmarks/codec_benchmark.py [--samples 256] [--blocks 2000] [--batch 64]
+# Synthetic MPU9250 blocks (+/-2g, 16384 LSB/g): gravity on z, vibration tones of a given amplitude and sensor noise.
+# Reports stored bytes, encode / decode time per block and spectrum time on decoded vs raw blocks.
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import zstandard
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+import codec  # noqa: E402
+from spectrum import compute_spectra  # noqa: E402
+
+
+def make_blocks(n_blocks, samples, amp_lsb, sample_rate=1000, noise_lsb=8.0, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(samples) / sample_rate
+    blocks = []
+    for _ in range(n_blocks):
+        f = rng.uniform(20, 200, size=3)
+        amp = rng.uniform(amp_lsb / 4, amp_lsb, size=3)
+        x = amp[None, :] * np.sin(2 * np.pi * f[None, :] * t[:, None] + rng.uniform(0, 6.28, size=3))
+        x += amp[None, :] * 0.3 * np.sin(2 * np.pi * 2 * f[None, :] * t[:, None])
+        x += rng.normal(0, noise_lsb, size=x.shape)
+        x[:, 2] += 16384  # gravity
+        blocks.append(np.clip(np.round(x), -32768, 32767).astype("<i2").tobytes())
+    return blocks
+
+
+def per_block_us(fn, items, batch):
+    """Time fn over items in slices of `batch`, as the writers / analysis see them. Returns (results, us per item)."""
+    out = []
+    t0 = time.perf_counter()
+    for i in range(0, len(items), batch):
+        out.extend(fn(items[i:i + batch]))
+    return out, (time.perf_counter() - t0) / len(items) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="raw block encoding benchmark")
+    parser.add_argument("--samples", type=int, default=256)
+    parser.add_argument("--blocks", type=int, default=2000)
+    parser.add_argument("--batch", type=int, default=64, help="blocks per encode / decode call")
+    args = parser.parse_args()
+
+    zc = zstandard.ZstdCompressor(level=codec.RAW_BLOCK_ZSTD_LEVEL)
+    print(f"{args.blocks} blocks x {args.samples} samples, batch {args.batch}, zstd level {codec.RAW_BLOCK_ZSTD_LEVEL}")
+    print(f"{'profile':>18} {'raw B':>6} {'zstd B':>7} {'delta B':>8} {'ratio':>6} {'enc us':>7} {'dec us':>7} {'raw dec us':>10}")
+    # (name, vibration amplitude LSB, noise LSB): idle / healthy / rough machine, 16384 LSB = 1 g
+    for name, amp, noise in (("idle", 0, 2.0), ("running 0.01g", 160, 4.0), ("running 0.05g", 800, 8.0),
+                             ("rough 0.1g", 1600, 32.0)):
+        raw = make_blocks(args.blocks, args.samples, amp, noise_lsb=noise)
+        enc, enc_us = per_block_us(lambda ps: codec.encode_many([codec.decode_raw(p) for p in ps]), raw, args.batch)
+        dec, dec_us = per_block_us(codec.decode_many, enc, args.batch)
+        _, raw_us = per_block_us(lambda ps: [codec.decode_raw(p) for p in ps], raw, args.batch)
+        assert all((d == codec.decode_raw(r)).all() for d, r in zip(dec, raw))
+        raw_b = sum(map(len, raw)) / len(raw)
+        zstd_b = sum(len(zc.compress(r)) for r in raw) / len(raw)  # plain zstd of the firmware bytes, for reference
+        enc_b = sum(map(len, enc)) / len(enc)
+        print(f"{name:>18} {raw_b:>6.0f} {zstd_b:>7.0f} {enc_b:>8.0f} {raw_b / enc_b:>6.2f} "
+              f"{enc_us:>7.1f} {dec_us:>7.1f} {raw_us:>10.2f}")
+
+    # analysis of stored blocks: decode + batched FFT, per block
+    raw = make_blocks(args.blocks, args.samples, 800)
+    for encoding in (codec.RAW_ENCODING, codec.DELTA_ENCODING):
+        rows = [{"device_id": "bench", "block_id": str(i), "time": 0, "sample_rate": 1000,
+                 "encoding": codec.RAW_ENCODING, "payload": p} for i, p in enumerate(raw)]
+        rows = codec.encode_rows(rows, encoding)
+        _, us = per_block_us(compute_spectra, rows, args.batch)
+        print(f"spectrum ({encoding}): {us:.1f} us/block")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+# Microbenchmarks of the per-message ingest hot path on firmware-shaped payloads (no broker, no DB by default)
+#   python benchmarks/hotpath_benchmark.py [--only reassembly] [--min-time 0.2] [--repeat 5]
+#       [--json out.json] [--history benchmarks/hotpath_history.jsonl] [--baseline previous.json] [--db]
+# Each case is timed like timeit: autoranged loop count, best of --repeat, reported per op (message, block or row).
+# --history appends {commit, date, python, results} per run so the numbers can be followed across commits;
+# --baseline (a --json report, or the last --history line) prints the change per case and exits 1 when a case
+# got slower by more than --tolerance. --db adds insert_metrics_bulk / get_recent_metrics against DATABASE_URL
+# (rows for device bench-hotpath, deleted afterwards).
+import os
+import sys
+import json
+import time
+import timeit
+import argparse
+import platform
+import itertools
+import subprocess
+from datetime import datetime, timezone
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+import db  # noqa: E402
+from telemetry import parse_topic, metric_item, metric_row, raw_block_row, raw_block_from_entry  # noqa: E402
+from reassembly import ReassemblyBuffer  # noqa: E402
+
+DEVICE = "bench-hotpath"
+TELEMETRY_TOPIC = f"v1/device/{DEVICE}/telemetry"
+METRICS = {"ax_mean_g": 0.001221, "ay_mean_g": -0.002441, "az_mean_g": 1.003418, "ax_rms_g": 0.041687,
+           "ay_rms_g": 0.033203, "az_rms_g": 0.020813, "ax_peak_g": 0.125732, "ay_peak_g": 0.104004,
+           "az_peak_g": 1.062256, "magnitude_rms_g": 1.004272, "magnitude_peak_g": 1.127686}
+CHUNK_BYTES = 256
+BATCH_ROWS = 100
+
+
+def telemetry_payload(ts_ms):
+    return json.dumps({"device_id": DEVICE, "ts_ms": ts_ms, "sample_rate_hz": 1000, "samples": 256,
+                       "metrics": METRICS}).encode()
+
+
+def raw_block_bytes(seed=0):
+    x = np.random.default_rng(seed).normal(0, 600, size=(256, 3))
+    x[:, 2] += 16384
+    return np.round(x).astype("<i2").tobytes()
+
+
+def cases(args):
+    """name -> (fn, ops per call, unit); fn() runs one call."""
+    out = {}
+    ts = int(time.time() * 1000)
+    payload = telemetry_payload(ts)
+    data = raw_block_bytes()
+    n_chunks = -(-len(data) // CHUNK_BYTES)
+    chunks = [data[i * CHUNK_BYTES:(i + 1) * CHUNK_BYTES] for i in range(n_chunks)]
+
+    chunk_topic = f"{TELEMETRY_TOPIC}/raw/chunk/1700000000-ab12/3"
+    out["parse_topic.telemetry"] = (lambda: parse_topic(TELEMETRY_TOPIC), 1, "msg")
+    out["parse_topic.chunk"] = (lambda: parse_topic(chunk_topic), 1, "msg")
+    out["telemetry.decode"] = (lambda: metric_item(DEVICE, json.loads(payload)), 1, "msg")
+
+    # meta + chunks into the reassembly buffer and the RAW_BLOCK dict finish_reassembly queues
+    buf = ReassemblyBuffer()
+    ids = itertools.count()
+
+    def block(reorder):
+        block_id = f"1700000000-{next(ids):x}"
+        meta = {"device_id": DEVICE, "id": block_id, "chunks": n_chunks, "bytes": len(data)}
+        if not reorder:
+            buf.add_meta(DEVICE, block_id, meta)
+        entry = None
+        for i in (reversed(range(n_chunks)) if reorder else range(n_chunks)):
+            entry = buf.add_chunk(DEVICE, block_id, i, chunks[i])
+        if reorder:
+            entry = buf.add_meta(DEVICE, block_id, meta)
+        return raw_block_from_entry(DEVICE, block_id, entry)
+
+    out["reassembly.block"] = (lambda: block(False), 1, "block")
+    out["reassembly.block_reordered"] = (lambda: block(True), 1, "block")
+
+    # db_writer_worker normalization: timestamp conversion and metrics json.dumps per item
+    item = metric_item(DEVICE, json.loads(payload))
+    raw_item = raw_block_from_entry(DEVICE, "1700000000-ab12", {"meta": {"ts_ms": ts}, "payload": memoryview(data)})
+    out["worker.metric_row"] = (lambda: metric_row(item), 1, "msg")
+    out["worker.raw_block_row"] = (lambda: raw_block_row(raw_item), 1, "block")
+
+    # insert_metrics_bulk row building: the rows of one batch, and their COPY encoding (DB_WRITE_MODE=copy)
+    items = [metric_item(DEVICE, json.loads(telemetry_payload(ts + i * 1000))) for i in range(BATCH_ROWS)]
+    rows = [metric_row(it)[0] for it in items]
+    out["insert_metrics.rows"] = (lambda: [metric_row(it)[0] for it in items], BATCH_ROWS, "row")
+    out["insert_metrics.copy_encode"] = (
+        lambda: db.encode_copy_binary(db.fold_metric_rows(rows), db.METRIC_COPY_COLUMNS), BATCH_ROWS, "row")
+
+    # get_recent_metrics row -> dict, on rows shaped like the driver returns them (jsonb already decoded)
+    fetched = []
+    for r in rows:
+        f = dict(r)
+        f["metrics"] = json.loads(r["metrics"]) if isinstance(r["metrics"], str) else r["metrics"]
+        fetched.append(f)
+    out["recent_metrics.to_dict"] = (lambda: [db.reading_dict(r) for r in fetched], BATCH_ROWS, "row")
+
+    if args.db:
+        db.wait_for_db()
+        out["db.insert_metrics_bulk"] = (lambda: db.insert_metrics_bulk(rows), BATCH_ROWS, "row")
+        out["db.get_recent_metrics"] = (lambda: db.get_recent_metrics(DEVICE, BATCH_ROWS), BATCH_ROWS, "row")
+    return out
+
+
+def measure(fn, min_time, repeat):
+    """Best ns per call: the loop count grows until one timing takes min_time, then best of `repeat`."""
+    timer = timeit.Timer(fn)
+    number = 1
+    while True:
+        t = timer.timeit(number)
+        if t >= min_time:
+            break
+        number = max(number * 2, int(number * min_time / max(t, 1e-9) * 1.1))
+    best = min([t] + timer.repeat(repeat=repeat - 1, number=number))
+    return best / number * 1e9
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_baseline(path):
+    with open(path) as f:
+        lines = [line for line in f if line.strip()]
+    # a --json report, or the last run of a --history file
+    return json.loads(lines[-1]) if path.endswith(".jsonl") else json.loads("".join(lines))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ingest hot path microbenchmarks")
+    parser.add_argument("--only", default=None, help="run the cases whose name contains this")
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per timing")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--db", action="store_true", help="also time the DB round trips (DATABASE_URL)")
+    parser.add_argument("--json", default=None, help="write the report here")
+    parser.add_argument("--history", default=None, help="append this run to a JSON lines file")
+    parser.add_argument("--baseline", default=None, help="earlier --json report or --history file to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args()
+
+    results = {}
+    print(f"{'case':>28} {'ns/op':>10}  per")
+    try:
+        for name, (fn, ops, unit) in cases(args).items():
+            if args.only and args.only not in name:
+                continue
+            ns = measure(fn, args.min_time, args.repeat) / ops
+            results[name] = {"ns": round(ns, 1), "per": unit}
+            print(f"{name:>28} {ns:>10.1f}  {unit}")
+    finally:
+        if args.db:
+            with db.write_engine.begin() as conn:
+                conn.execute(db.text("DELETE FROM readings_parameters WHERE device_id = :d"), {"d": DEVICE})
+
+    report = {"commit": git_commit(), "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+              "python": platform.python_version(), "readings_schema": db.READINGS_SCHEMA, "results": results}
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.history:
+        with open(args.history, "a") as f:
+            f.write(json.dumps(report) + "\n")
+
+    if args.baseline:
+        base = load_baseline(args.baseline)
+        print(f"vs {base.get('commit')} ({base.get('date')}):")
+        slower = []
+        for name, r in results.items():
+            before = base.get("results", {}).get(name, {}).get("ns")
+            if not before:
+                continue
+            change = (r["ns"] - before) / before
+            print(f"{name:>28} {before:>10.1f} -> {r['ns']:>10.1f} ({change:+.1%})")
+            if change > args.tolerance:
+                slower.append(name)
+        if slower:
+            print("REGRESSION:", ", ".join(slower))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
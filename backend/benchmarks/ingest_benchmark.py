@@ -0,0 +1,311 @@
+# Ingest load benchmark: a simulated fleet of ESP32 sensors (vibration_sensor.ino message formats) driving the
+# embedded ingest path (main.on_message -> finish_reassembly -> db_writer_worker) against DATABASE_URL.
+#   python benchmarks/ingest_benchmark.py [--devices 100] [--seconds 60] [--speedup 10] [--raw-interval 30]
+#       [--reorder 0.1] [--drop 0.01] [--mode inproc|mqtt] [--json out.json] [--baseline previous.json]
+# inproc: main.on_message is called from a sender thread (as paho's network thread would).
+# mqtt: messages go through a broker without TLS (docker compose --profile bench up mosquitto) to a
+#       subscriber bound to main.on_message; --mqtt-host / --mqtt-port.
+# The fleet is seeded: the same arguments produce the same messages, chunk order and drops. Rows are written
+# for devices bench-NNNN and deleted before and after the run (--keep to leave them).
+# Reports offered / handled msgs/s, handler time per message, send-to-commit latency percentiles of readings
+# and raw blocks, reassembly and queue counters, and RSS. --baseline compares with an earlier --json report
+# and exits 1 when msgs/s, p95 latency or peak RSS got worse by more than --tolerance.
+import os
+import sys
+import json
+import time
+import types
+import random
+import argparse
+import resource
+import threading
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+METRIC_KEYS = ("ax_mean_g", "ay_mean_g", "az_mean_g", "ax_rms_g", "ay_rms_g", "az_rms_g",
+               "ax_peak_g", "ay_peak_g", "az_peak_g", "magnitude_rms_g", "magnitude_peak_g")
+SAMPLE_RATE_HZ = 1000
+BUFFER_SAMPLES = 256
+CHUNK_BYTES = 256
+
+
+class VirtualDevice:
+    """One sensor: a reading every second and a raw block (meta + 256 byte chunks) every raw_interval seconds."""
+
+    def __init__(self, index, rng, raw_interval, raw_header=False):
+        self.device_id = f"bench-{index:04d}"
+        self.topic = f"v1/device/{self.device_id}/telemetry"
+        self.raw_interval = raw_interval
+        self.raw_header = raw_header
+        self.phase = rng.randrange(raw_interval)  # spread raw blocks over the fleet
+        self.level = rng.uniform(0.005, 0.1)  # vibration rms, g
+        self.freq = rng.uniform(20, 200)
+
+    def _reading(self, ts_ms, rng):
+        lvl = self.level * rng.uniform(0.8, 1.2)
+        spike = 2.0 if rng.random() < 0.002 else 0.0  # the odd shock, so fault rules fire
+        m = {"ax_mean_g": rng.gauss(0, 0.002), "ay_mean_g": rng.gauss(0, 0.002), "az_mean_g": 1.0 + rng.gauss(0, 0.002),
+             "ax_rms_g": lvl, "ay_rms_g": lvl * 0.8, "az_rms_g": lvl * 0.5,
+             "ax_peak_g": lvl * 3 + spike, "ay_peak_g": lvl * 2.5, "az_peak_g": 1.0 + lvl * 1.5,
+             "magnitude_rms_g": 1.0 + lvl * 0.1, "magnitude_peak_g": 1.0 + lvl * 3 + spike}
+        return {"device_id": self.device_id, "ts_ms": ts_ms, "sample_rate_hz": SAMPLE_RATE_HZ,
+                "samples": BUFFER_SAMPLES, "metrics": {k: round(m[k], 6) for k in METRIC_KEYS}}
+
+    def _raw_block(self, ts_ms, rng, np_rng):
+        t = np.arange(BUFFER_SAMPLES) / SAMPLE_RATE_HZ
+        x = self.level * 16384 * np.sin(2 * np.pi * self.freq * t)[:, None] * np.array([1.0, 0.8, 0.5])
+        x += np_rng.normal(0, 8, size=x.shape)
+        x[:, 2] += 16384  # gravity
+        data = np.clip(np.round(x), -32768, 32767).astype("<i2").tobytes()
+        block_id = f"{ts_ms // 1000}-{rng.randrange(0xFFFF):x}"
+        n = -(-len(data) // CHUNK_BYTES)  # 1536 bytes -> 6 chunks
+        meta = {"device_id": self.device_id, "id": block_id, "chunks": n, "bytes": len(data)}
+        chunks = [(f"{self.topic}/raw/chunk/{block_id}/{i}", data[i * CHUNK_BYTES:(i + 1) * CHUNK_BYTES])
+                  for i in range(n)]
+        return block_id, (f"{self.topic}/raw/meta", json.dumps(meta).encode()), chunks
+
+    def messages(self, second, ts_ms, rng, np_rng, reorder, drop):
+        """[(topic, payload, key)] of one virtual second; key is set on the message completing a reading / block."""
+        out = [(self.topic, json.dumps(self._reading(ts_ms, rng)).encode(), ("reading", self.device_id, ts_ms))]
+        if (second + self.phase) % self.raw_interval:
+            return out
+        if self.raw_header:
+            # the firmware's extra telemetry JSON before each block: no metrics, same second as the reading
+            header = {"device_id": self.device_id, "ts_ms": ts_ms, "sample_rate_hz": SAMPLE_RATE_HZ,
+                      "samples": BUFFER_SAMPLES, "encoding": "int16_le_axayaz_bin_chunks"}
+            out.append((self.topic, json.dumps(header).encode(), None))
+        block_id, meta, chunks = self._raw_block(ts_ms, rng, np_rng)
+        kept = [c for c in chunks if rng.random() >= drop]
+        block = [meta] + kept
+        if rng.random() < reorder:
+            rng.shuffle(block)  # chunks out of order, possibly before the meta
+        out += [(topic, payload, None) for topic, payload in block]
+        if len(kept) == len(chunks):
+            topic, payload, _ = out[-1]
+            out[-1] = (topic, payload, ("block", self.device_id, block_id))
+        return out
+
+
+def fleet_second(devices, second, ts_ms, rng, np_rng, reorder, drop):
+    """Messages of all devices for one second, interleaved at random but in order per device."""
+    streams = [d.messages(second, ts_ms, rng, np_rng, reorder, drop) for d in devices]
+    pos = [0] * len(streams)
+    live = list(range(len(streams)))
+    out = []
+    while live:
+        i = rng.randrange(len(live))
+        s = live[i]
+        out.append(streams[s][pos[s]])
+        pos[s] += 1
+        if pos[s] == len(streams[s]):
+            live[i] = live[-1]
+            live.pop()
+    return out
+
+
+def percentiles(values):
+    if not values:
+        return {"n": 0}
+    a = np.asarray(values) * 1000.0
+    p50, p95, p99 = np.percentile(a, [50, 95, 99])
+    return {"n": len(a), "p50_ms": round(float(p50), 2), "p95_ms": round(float(p95), 2),
+            "p99_ms": round(float(p99), 2), "max_ms": round(float(a.max()), 2)}
+
+
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def delete_bench_rows(engine, text):
+    with engine.begin() as conn:
+        for table in ("readings_parameters", "raw_blocks", "raw_spectra", "alerts"):
+            conn.execute(text(f"DELETE FROM {table} WHERE device_id LIKE 'bench-%'"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="simulated fleet ingest benchmark")
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument("--seconds", type=int, default=60, help="virtual seconds of fleet traffic")
+    parser.add_argument("--speedup", type=float, default=10.0, help="virtual seconds per wall second (0 = as fast as possible)")
+    parser.add_argument("--raw-interval", type=int, default=30, help="seconds between raw blocks per device")
+    parser.add_argument("--raw-header", action="store_true", help="also send the firmware's telemetry JSON before each raw block")
+    parser.add_argument("--reorder", type=float, default=0.1, help="fraction of blocks sent out of order")
+    parser.add_argument("--drop", type=float, default=0.0, help="fraction of chunks lost")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--start-ms", type=int, default=None, help="timestamp of the first reading (default: now, to the minute)")
+    parser.add_argument("--mode", choices=("inproc", "mqtt"), default="inproc")
+    parser.add_argument("--mqtt-host", default="localhost")
+    parser.add_argument("--mqtt-port", type=int, default=1883)
+    parser.add_argument("--qos", type=int, default=0)
+    parser.add_argument("--no-analysis", action="store_true", help="do not start the spectrum analysis pool")
+    parser.add_argument("--wal", default=None, help="WAL directory (measures write-ahead log overhead)")
+    parser.add_argument("--drain-timeout", type=float, default=60.0)
+    parser.add_argument("--keep", action="store_true", help="keep the bench-* rows")
+    parser.add_argument("--json", default=None, help="write the report here")
+    parser.add_argument("--baseline", default=None, help="earlier --json report to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    import main as app  # noqa: E402  (Flask app module; nothing starts on import)
+    from analysis import AnalysisExecutor  # noqa: E402
+    from wal import WriteAheadLog  # noqa: E402
+
+    rng = random.Random(args.seed)
+    np_rng = np.random.default_rng(args.seed)
+    devices = [VirtualDevice(i, rng, args.raw_interval, args.raw_header) for i in range(args.devices)]
+    start_ms = args.start_ms if args.start_ms is not None else int(time.time() // 60 * 60 * 1000)
+
+    app.wait_for_db()
+    if not args.keep:
+        delete_bench_rows(app.engine, app.text)
+    app.refresh_fault_rules()
+
+    # send -> commit latency: stamp rows as their batches are written
+    sent, committed = {}, {}
+
+    def stamped(flush_fn, key):
+        def flush(rows):
+            flush_fn(rows)
+            now = time.time()
+            for r in rows:
+                committed[key(r)] = now
+        return flush
+
+    p = app.processor
+    p.metrics.flush_fn = stamped(p.metrics.flush_fn, lambda r: ("reading", r["device_id"], int(r["time"].timestamp() * 1000)))
+    p.raw_blocks.flush_fn = stamped(p.raw_blocks.flush_fn, lambda r: ("block", r["device_id"], r["block_id"]))
+
+    if args.wal:
+        app.wal = WriteAheadLog(args.wal, tracker=app.wal_tracker)
+        list(app.wal.replay())
+    if not args.no_analysis:
+        app.analysis_executor = AnalysisExecutor(on_result=app.on_analysis_result).start()
+    threading.Thread(target=app.db_writer_worker, daemon=True).start()
+
+    handled = [0, 0.0]  # messages, seconds spent in on_message
+
+    def on_message(client, userdata, msg):
+        t0 = time.perf_counter()
+        app.on_message(client, userdata, msg)
+        handled[1] += time.perf_counter() - t0
+        handled[0] += 1
+
+    if args.mode == "mqtt":
+        import paho.mqtt.client as mqtt
+        sub = mqtt.Client(client_id=f"cm-bench-sub-{os.getpid()}", protocol=mqtt.MQTTv311)
+        sub.on_message = on_message
+        sub.connect(args.mqtt_host, args.mqtt_port, keepalive=60)
+        sub.subscribe("v1/device/+/telemetry/#", qos=args.qos)
+        sub.loop_start()
+        pub = mqtt.Client(client_id=f"cm-bench-pub-{os.getpid()}", protocol=mqtt.MQTTv311)
+        pub.max_queued_messages_set(0)
+        pub.connect(args.mqtt_host, args.mqtt_port, keepalive=60)
+        pub.loop_start()
+        time.sleep(1.0)  # subscription in place before the first message
+        send = lambda topic, payload: pub.publish(topic, payload, qos=args.qos)
+    else:
+        send = lambda topic, payload: on_message(None, None, types.SimpleNamespace(topic=topic, payload=payload))
+
+    rss_start = rss_mb()
+    offered = 0
+    t_start = time.time()
+    for second in range(args.seconds):
+        batch = fleet_second(devices, second, start_ms + second * 1000, rng, np_rng, args.reorder, args.drop)
+        if args.speedup > 0:
+            # open loop: each virtual second goes out at its scheduled time, spread over its slot
+            slot = 1.0 / args.speedup
+            due = t_start + second * slot
+            step = slot / len(batch)
+        for i, (topic, payload, key) in enumerate(batch):
+            if args.speedup > 0:
+                delay = due + i * step - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            if key is not None:
+                sent[key] = time.time()
+            send(topic, payload)
+        offered += len(batch)
+    t_sent = time.time()
+
+    # drain: every message handled, queue empty, batches written, analysis idle
+    deadline = time.time() + args.drain_timeout
+    while time.time() < deadline:
+        busy = (handled[0] < offered or app.write_queue.qsize() or any(len(b) for b in p.batchers)
+                or (app.analysis_executor is not None and (app.analysis_executor.stats()["pending"]
+                                                           or app.analysis_executor.in_flight)))
+        if not busy:
+            break
+        time.sleep(0.05)
+    t_done = time.time()
+    time.sleep(0.5)  # last flushes (spectra / alerts of the final analysis batch)
+
+    reading_lat = [committed[k] - t for k, t in sent.items() if k[0] == "reading" and k in committed]
+    block_lat = [committed[k] - t for k, t in sent.items() if k[0] == "block" and k in committed]
+    report = {
+        "args": vars(args),
+        "offered_msgs": offered,
+        "handled_msgs": handled[0],
+        "send_sec": round(t_sent - t_start, 3),
+        "total_sec": round(t_done - t_start, 3),
+        "offered_msgs_per_sec": round(offered / max(t_sent - t_start, 1e-9), 1),
+        "msgs_per_sec": round(handled[0] / max(t_done - t_start, 1e-9), 1),
+        "handler_us_per_msg": round(handled[1] / max(handled[0], 1) * 1e6, 2),
+        "readings_latency": percentiles(reading_lat),
+        "raw_block_latency": percentiles(block_lat),
+        "readings_missing": sum(1 for k in sent if k[0] == "reading" and k not in committed),
+        "blocks_missing": sum(1 for k in sent if k[0] == "block" and k not in committed),
+        "rss_mb": {"start": round(rss_start, 1), "end": round(rss_mb(), 1),
+                   "peak": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)},
+        "reassembly": app.assembly_buffer.stats(),
+        "backpressure": app.write_backpressure.stats(),
+        "batches": p.stats(),
+        "analysis": app.analysis_executor.stats() if app.analysis_executor is not None else None,
+        "wal": app.wal.stats() if app.wal is not None else None,
+    }
+
+    print(f"{args.devices} devices x {args.seconds}s (speedup {args.speedup}, mode {args.mode}): "
+          f"{offered} msgs offered at {report['offered_msgs_per_sec']}/s, handled {report['msgs_per_sec']}/s, "
+          f"{report['handler_us_per_msg']} us/msg in on_message")
+    print("readings  send->commit", report["readings_latency"], "missing", report["readings_missing"])
+    print("raw blocks send->commit", report["raw_block_latency"], "missing", report["blocks_missing"])
+    r = report["reassembly"]
+    print(f"reassembly: completed {r['completed']} expired {r['expired']} evicted {r['evicted']} "
+          f"duplicate chunks {r['duplicate_chunks']} open {r['open_blocks']}; "
+          f"queue dropped {report['backpressure']['dropped']}; RSS MB {report['rss_mb']}")
+
+    if args.mode == "mqtt":
+        pub.loop_stop()
+        sub.loop_stop()
+    if app.analysis_executor is not None:
+        app.analysis_executor.shutdown()
+    if not args.keep:
+        delete_bench_rows(app.engine, app.text)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            base = json.load(f)
+        worse = []
+        # (label, value now, value before, higher is better)
+        for label, now, before, higher in (
+                ("msgs/s", report["msgs_per_sec"], base.get("msgs_per_sec"), True),
+                ("readings p95 ms", report["readings_latency"].get("p95_ms"), base.get("readings_latency", {}).get("p95_ms"), False),
+                ("raw blocks p95 ms", report["raw_block_latency"].get("p95_ms"), base.get("raw_block_latency", {}).get("p95_ms"), False),
+                ("peak RSS MB", report["rss_mb"]["peak"], base.get("rss_mb", {}).get("peak"), False)):
+            if now is None or not before:
+                continue
+            change = (now - before) / before
+            print(f"{label:>18}: {before} -> {now} ({change:+.1%})")
+            if (-change if higher else change) > args.tolerance:
+                worse.append(label)
+        if worse:
+            print("REGRESSION:", ", ".join(worse))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
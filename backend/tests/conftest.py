@@ -0,0 +1,5 @@
+# The app modules import each other script-style (python app/main.py), so the tests put app/ on the path
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
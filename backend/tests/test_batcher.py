@@ -0,0 +1,34 @@
+import time
+
+from batcher import Batcher
+
+
+def db_down(batch):
+    raise ConnectionError("db down")
+
+
+def test_written_batch_frees_its_wal_position():
+    b = Batcher("metrics", lambda batch: None)
+    b.add({"n": 1}, lsn=5)
+    assert b.min_lsn() == 5
+    assert b.flush()
+    assert b.min_lsn() is None
+
+
+def test_journaled_batch_frees_its_wal_position():
+    b = Batcher("metrics", db_down, on_failure=lambda *args: True)
+    b.add({"n": 1}, lsn=5)
+    assert not b.flush()
+    assert b.min_lsn() is None
+
+
+def test_dropped_batch_pins_its_wal_position_for_a_while():
+    b = Batcher("metrics", db_down, on_failure=lambda *args: False, pin_max_age=0.2)
+    b.add({"n": 1}, lsn=5)
+    b.flush()
+    b.add({"n": 2}, lsn=9)
+    assert b.min_lsn() == 5  # not checkpointed past: a restart replays the dropped rows
+    assert b.stats()["wal_pinned"]
+    time.sleep(0.25)
+    assert b.min_lsn() == 9  # given up on, the WAL can be trimmed
+    assert b.pins_released == 1
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+import zstandard
+
+import codec
+from codec import DELTA_ENCODING, RAW_ENCODING
+
+RNG = np.random.default_rng(0)
+
+
+def samples(n):
+    return RNG.integers(-32768, 32768, size=(n, 3)).astype("<i2")
+
+
+def test_roundtrip():
+    blocks = [samples(256), samples(100), samples(256), samples(0), samples(1),
+              np.array([[-32768, 32767, 0], [32767, -32768, 0]], dtype="<i2")]  # largest possible deltas
+    decoded = codec.decode_many(codec.encode_many(blocks))
+    assert len(decoded) == len(blocks)
+    for got, want in zip(decoded, blocks):
+        assert got.dtype == want.dtype and np.array_equal(got, want)
+
+
+def test_decode_blocks_mixes_encodings():
+    a, b = samples(64), samples(32)
+    blocks = [{"payload": codec.encode_samples(a), "encoding": DELTA_ENCODING},
+              {"payload": b.tobytes(), "encoding": RAW_ENCODING}]
+    got = codec.decode_blocks(blocks)
+    assert np.array_equal(got[0], a) and np.array_equal(got[1], b)
+
+
+GOOD = codec.encode_samples(samples(256))
+
+
+@pytest.mark.parametrize("payload", [
+    b"",
+    GOOD[:3],  # cut inside the header
+    GOOD[:codec._HEADER.size],  # header only
+    GOOD[:-4],  # cut inside the zstd frame
+    bytes([9]) + GOOD[1:],  # unknown version
+    codec._HEADER.pack(1, 256) + b"not zstd",
+    codec._HEADER.pack(1, 10) + GOOD[codec._HEADER.size:],  # frame bigger than the announced samples
+    codec._HEADER.pack(1, 256) + zstandard.ZstdCompressor().compress(bytes([0x80]) * 10),  # truncated varint
+    codec._HEADER.pack(1, 256) + zstandard.ZstdCompressor().compress(b"\x00" * 10),  # too few values
+])
+def test_corrupt_payload_raises_value_error(payload):
+    with pytest.raises(ValueError):
+        codec.decode_many([GOOD, payload])
+
+
+def test_corrupt_payload_in_decode_blocks():
+    with pytest.raises(ValueError):
+        codec.decode_blocks([{"payload": b"", "encoding": DELTA_ENCODING}])
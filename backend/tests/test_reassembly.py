@@ -0,0 +1,111 @@
+import os
+
+import pytest
+
+from reassembly import ReassemblyBuffer
+
+BLOCK = os.urandom(1536)
+CHUNK = 256
+CHUNKS = [BLOCK[i:i + CHUNK] for i in range(0, len(BLOCK), CHUNK)]
+META = {"device_id": "d1", "id": "b1", "chunks": len(CHUNKS), "bytes": len(BLOCK)}
+
+
+def test_in_order():
+    buf = ReassemblyBuffer()
+    assert buf.add_meta("d1", "b1", META) is None
+    for i, chunk in enumerate(CHUNKS[:-1]):
+        assert buf.add_chunk("d1", "b1", i, chunk) is None
+    entry = buf.add_chunk("d1", "b1", len(CHUNKS) - 1, CHUNKS[-1])
+    assert bytes(entry["payload"]) == BLOCK
+    assert entry["meta"] == META
+    assert len(buf) == 0
+
+
+def test_out_of_order_chunks_before_meta():
+    buf = ReassemblyBuffer()
+    order = [5, 2, 0, 4]
+    for i in order:
+        assert buf.add_chunk("d1", "b1", i, CHUNKS[i]) is None
+    assert buf.add_meta("d1", "b1", META) is None
+    assert buf.add_chunk("d1", "b1", 3, CHUNKS[3]) is None
+    entry = buf.add_chunk("d1", "b1", 1, CHUNKS[1])
+    assert bytes(entry["payload"]) == BLOCK
+
+
+def test_short_last_chunk():
+    block = BLOCK[:1000]
+    chunks = [block[i:i + CHUNK] for i in range(0, len(block), CHUNK)]
+    meta = dict(META, chunks=len(chunks), bytes=len(block))
+    buf = ReassemblyBuffer()
+    buf.add_chunk("d1", "b1", len(chunks) - 1, chunks[-1])  # the short one fixes the chunk size too
+    buf.add_meta("d1", "b1", meta)
+    entry = None
+    for i in range(len(chunks) - 1):
+        entry = buf.add_chunk("d1", "b1", i, chunks[i])
+    assert bytes(entry["payload"]) == block
+
+
+def test_duplicate_chunk():
+    buf = ReassemblyBuffer()
+    buf.add_meta("d1", "b1", META)
+    buf.add_chunk("d1", "b1", 0, CHUNKS[0])
+    assert buf.add_chunk("d1", "b1", 0, CHUNKS[0]) is None
+    assert buf.duplicate_chunks == 1
+
+
+def test_negative_index_rejected():
+    buf = ReassemblyBuffer()
+    buf.add_meta("d1", "b1", META)
+    for i in range(len(CHUNKS) - 1):
+        buf.add_chunk("d1", "b1", i, CHUNKS[i])
+    # .../chunk/b1/-1 must not land at the end of the buffer and count as a chunk
+    assert buf.add_chunk("d1", "b1", -1, CHUNKS[-1]) is None
+    assert buf.rejected == 1
+    entry = buf.add_chunk("d1", "b1", len(CHUNKS) - 1, CHUNKS[-1])
+    assert bytes(entry["payload"]) == BLOCK
+
+
+def test_negative_index_before_meta_rejected():
+    buf = ReassemblyBuffer()
+    assert buf.add_chunk("d1", "b1", -1, CHUNKS[0]) is None
+    assert len(buf) == 0
+
+
+def test_index_past_the_end_rejected():
+    buf = ReassemblyBuffer()
+    buf.add_meta("d1", "b1", META)
+    with pytest.raises(ValueError):
+        buf.add_chunk("d1", "b1", len(CHUNKS), CHUNKS[0])
+
+
+def test_wrong_chunk_length_rejected():
+    buf = ReassemblyBuffer()
+    buf.add_meta("d1", "b1", META)
+    buf.add_chunk("d1", "b1", 0, CHUNKS[0])
+    with pytest.raises(ValueError):
+        buf.add_chunk("d1", "b1", 1, CHUNKS[1][:100])
+
+
+@pytest.mark.parametrize("meta", [
+    dict(META, bytes=300 * 2**20),  # far beyond the budget: never allocated
+    dict(META, bytes=-1),
+    dict(META, bytes=0),
+    dict(META, chunks=0),
+    dict(META, chunks=None),
+    dict(META, chunk_size=100),  # 6 x 100 < 1536
+    dict(META, chunk_size=-256),
+])
+def test_impossible_meta_rejected(meta):
+    buf = ReassemblyBuffer(max_bytes=2**20)
+    buf.add_chunk("d1", "b1", 0, CHUNKS[0])
+    assert buf.add_meta("d1", "b1", meta) is None
+    assert buf.rejected == 1
+    assert len(buf) == 0 and buf.bytes == 0  # what was parked for the block is dropped too
+
+
+def test_chunks_smaller_than_announced_size_rejected():
+    buf = ReassemblyBuffer()
+    buf.add_meta("d1", "b1", dict(META, bytes=len(BLOCK) * 4))  # chunk size only known from the first chunk
+    assert buf.add_chunk("d1", "b1", 0, CHUNKS[0]) is None
+    assert buf.rejected == 1
+    assert len(buf) == 0 and buf.bytes == 0
@@ -0,0 +1,44 @@
+import numpy as np
+
+from spectrum import compute_spectra, ACCEL_LSB_PER_G
+
+N = 256
+RATE = 1000
+
+
+def block(x, block_id="b1"):
+    counts = np.round(x * ACCEL_LSB_PER_G).astype("<i2")
+    return {"device_id": "d1", "block_id": block_id, "time": 0, "sample_rate": RATE, "samples": N,
+            "payload": counts.tobytes()}
+
+
+def tone(hz, g):
+    return g * np.sin(2 * np.pi * hz * np.arange(N) / RATE)
+
+
+def test_single_tone_is_one_peak():
+    x = np.zeros((N, 3))
+    x[:, 0] = tone(120, 0.5)
+    row = compute_spectra([block(x)])[0]
+    # the Hann main lobe's neighbouring bins are not peaks of their own
+    hz, others = row["peak_hz"][0][0], row["peak_hz"][0][1:]
+    assert abs(hz - 120) <= RATE / N
+    assert others == [None, None]
+    assert row["peak_amp_g"][0][0] > 0.4
+
+
+def test_peaks_ordered_by_amplitude():
+    x = np.zeros((N, 3))
+    x[:, 1] = tone(60, 0.3) + tone(250, 0.1) + np.random.default_rng(0).normal(0, 0.01, N)
+    row = compute_spectra([block(x)])[0]
+    hz = row["peak_hz"][1]
+    assert abs(hz[0] - 60) <= RATE / N and abs(hz[1] - 250) <= RATE / N
+    assert row["peak_amp_g"][1][0] > row["peak_amp_g"][1][1]
+
+
+def test_silent_axis_has_no_peaks():
+    x = np.zeros((N, 3))
+    x[:, 2] = 1.0  # gravity only
+    row = compute_spectra([block(x)])[0]
+    assert row["peak_hz"] == [[None] * 3] * 3
+    assert row["peak_amp_g"] == [[None] * 3] * 3
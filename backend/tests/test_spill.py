@@ -0,0 +1,175 @@
+import os
+import queue
+
+import pytest
+
+import spill
+from spill import SpillJournal, Backpressure
+
+
+def journal_files(directory):
+    return sorted(f for f in os.listdir(directory) if f.startswith("spill-"))
+
+
+def drain(journal):
+    out = []
+    while True:
+        item = journal.pop()
+        if item is None:
+            return out
+        out.append(item)
+
+
+def test_journal_fifo(tmp_path):
+    j = SpillJournal(str(tmp_path), segment_bytes=4096)
+    for i in range(5):
+        assert j.append({"type": "METRIC", "data": {"n": i}})
+    assert not j.empty()
+    assert [item["data"]["n"] for item in drain(j)] == list(range(5))
+    assert j.empty()
+    j.close()
+
+
+def test_journal_rotates_and_deletes_replayed_segments(tmp_path):
+    j = SpillJournal(str(tmp_path), segment_bytes=4096, max_bytes=1 << 20)
+    for i in range(200):
+        assert j.append({"type": "METRIC", "data": {"n": i, "pad": "x" * 50}})
+    assert len(journal_files(tmp_path)) > 2
+    assert [item["data"]["n"] for item in drain(j)] == list(range(200))
+    assert len(journal_files(tmp_path)) == 1  # only the write segment is left
+    j.close()
+
+
+def test_journal_full(tmp_path):
+    j = SpillJournal(str(tmp_path), segment_bytes=4096, max_bytes=8192)
+    results = [j.append({"type": "METRIC", "data": {"pad": "x" * 100}}) for i in range(200)]
+    assert results[0] and not results[-1]
+    assert j.stats()["full"] > 0
+    assert j.append({"type": "METRIC", "data": "x" * 5000}) is False  # larger than a segment
+    j.close()
+
+
+def test_journal_resumes_after_close(tmp_path):
+    j = SpillJournal(str(tmp_path), segment_bytes=4096)
+    for i in range(10):
+        j.append({"n": i})
+    assert [j.pop()["n"] for i in range(4)] == [0, 1, 2, 3]
+    j.close()
+
+    j = SpillJournal(str(tmp_path), segment_bytes=4096)
+    assert [item["n"] for item in drain(j)] == list(range(4, 10))
+    j.close()
+
+
+def test_journal_replays_from_segment_start_after_crash(tmp_path):
+    j = SpillJournal(str(tmp_path), segment_bytes=4096, flush_sec=0)
+    for i in range(10):
+        j.append({"n": i})
+    j.pop()
+    # no close(): no saved read position, everything in the segment comes back (the DB upserts absorb it)
+    for _, m in j._maps.values():
+        m.flush()
+
+    j2 = SpillJournal(str(tmp_path), segment_bytes=4096)
+    assert [item["n"] for item in drain(j2)] == list(range(10))
+    j2.close()
+
+
+def test_journal_skips_corrupt_record(tmp_path):
+    j = SpillJournal(str(tmp_path), segment_bytes=4096)
+    j.append({"n": 0})
+    j.close()
+    path = tmp_path / journal_files(tmp_path)[0]
+    data = bytearray(path.read_bytes())
+    data[spill._REC.size + 5] ^= 0xFF
+    path.write_bytes(bytes(data))
+    os.remove(tmp_path / "cursor")
+
+    j = SpillJournal(str(tmp_path), segment_bytes=4096)
+    assert j.pop() is None
+    assert j.stats()["corrupt"] == 1
+    j.append({"n": 1})
+    assert j.pop() == {"n": 1}
+    j.close()
+
+
+def test_journal_stores_picklable_items(tmp_path):
+    j = SpillJournal(str(tmp_path), segment_bytes=4096)
+    j.append({"type": "RAW_BLOCK", "data": {"payload": memoryview(b"abc")}})
+    assert j.pop()["data"]["payload"] == b"abc"
+    j.close()
+
+
+def test_drop_oldest():
+    q = queue.Queue(maxsize=2)
+    released = []
+    bp = Backpressure(q, queue.Full, queue.Empty, policy="drop_oldest", spill_dir=None, on_release=released.append)
+    for i in range(3):
+        assert bp.offer({"type": "METRIC", "n": i})
+    assert [q.get_nowait()["n"] for i in range(2)] == [1, 2]
+    assert [item["n"] for item in released] == [0]
+    assert bp.dropped == 1
+
+
+def test_drop_newest():
+    q = queue.Queue(maxsize=2)
+    bp = Backpressure(q, queue.Full, queue.Empty, policy="drop_newest", spill_dir=None)
+    assert [bp.offer({"n": i}) for i in range(3)] == [True, True, False]
+    assert [q.get_nowait()["n"] for i in range(2)] == [0, 1]
+
+
+def test_spill_keeps_order_and_replays(tmp_path):
+    q = queue.Queue(maxsize=4)
+    released = []
+    bp = Backpressure(q, queue.Full, queue.Empty, policy="spill", spill_dir=str(tmp_path),
+                      on_release=released.append)
+    for i in range(10):
+        assert bp.offer({"type": "METRIC", "n": i, "lsn": 100 + i})
+    # 0-3 queued, the rest journaled without their WAL lsn (the journal keeps them on its own)
+    assert [item["lsn"] for item in released] == list(range(104, 110))
+    assert [q.get_nowait()["n"] for i in range(4)] == [0, 1, 2, 3]
+
+    # the journal is not empty: a new item goes behind the backlog even though the queue has room
+    bp.offer({"type": "METRIC", "n": 10})
+    got = []
+    while len(got) < 7:
+        assert bp.replay(healthy=True) > 0
+        while not q.empty():
+            got.append(q.get_nowait())
+    assert [item["n"] for item in got] == list(range(4, 11))
+    assert all("lsn" not in item for item in got)
+    bp.close()
+
+
+def test_replay_probes_while_unhealthy(tmp_path):
+    q = queue.Queue(maxsize=100)
+    bp = Backpressure(q, queue.Full, queue.Empty, policy="spill", spill_dir=str(tmp_path))
+    for i in range(5):
+        bp.journal.append({"n": i})
+    assert bp.replay(healthy=False) == 1
+    assert bp.replay(healthy=False) == 0  # next probe after WRITE_REPLAY_PROBE_SEC
+    assert bp.replay(healthy=True) == 4
+    bp.close()
+
+
+def test_spill_failed_batch(tmp_path, monkeypatch):
+    monkeypatch.setattr(spill, "WRITE_SPILL_MAX_RETRIES", 2)
+    q = queue.Queue(maxsize=10)
+    rows = [{"device_id": "d", "n": 1}]
+
+    no_journal = Backpressure(q, queue.Full, queue.Empty, policy="drop_oldest", spill_dir=None)
+    assert no_journal.spill_failed_batch("metrics", rows, 0, ValueError("bad row")) is False
+
+    bp = Backpressure(q, queue.Full, queue.Empty, policy="spill", spill_dir=str(tmp_path))
+    assert bp.spill_failed_batch("metrics", rows, 0, ValueError("bad row"))
+    assert bp.spill_failed_batch("metrics", rows, 2, ValueError("bad row")) is False  # third failure
+    # an unreachable DB does not count as an attempt
+    assert bp.spill_failed_batch("metrics", rows, 5, ConnectionRefusedError("down"))
+    assert bp.journal.pop() == {"type": "ROWS", "table": "metrics", "data": rows, "attempts": 1}
+    assert bp.journal.pop()["attempts"] == 5
+    bp.close()
+
+
+def test_spill_policy_needs_a_directory():
+    with pytest.raises(ValueError):
+        Backpressure(queue.Queue(), queue.Full, queue.Empty, policy="spill", spill_dir=None)
@@ -0,0 +1,169 @@
+import os
+
+from wal import WriteAheadLog, WalTracker
+
+
+def segments(directory):
+    return sorted(f for f in os.listdir(directory) if f.startswith("wal-"))
+
+
+def open_wal(directory, tracker=None, segment_bytes=1 << 20):
+    return WriteAheadLog(str(directory), tracker=tracker, segment_bytes=segment_bytes, fsync="off")
+
+
+def test_replay_after_restart(tmp_path):
+    wal = open_wal(tmp_path)
+    lsns = [wal.append(f"v1/device/d{i}/telemetry", b"payload-%d" % i, received_at=100.0 + i) for i in range(3)]
+    wal.close()
+    assert lsns == [0, 1, 2]
+
+    wal = open_wal(tmp_path)
+    assert [(lsn, t, topic, bytes(p)) for lsn, t, topic, p in wal.replay()] == [
+        (i, 100.0 + i, f"v1/device/d{i}/telemetry", b"payload-%d" % i) for i in range(3)]
+    # LSNs keep increasing across restarts
+    assert wal.append("t", b"x") == 3
+    wal.close()
+
+
+def test_torn_record_is_ignored(tmp_path):
+    wal = open_wal(tmp_path)
+    for i in range(3):
+        wal.append("t", b"x" * 100)
+    wal.close()
+    path = tmp_path / segments(tmp_path)[0]
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 10)  # last append cut short by a crash
+
+    wal = open_wal(tmp_path)
+    assert [lsn for lsn, *_ in wal.replay()] == [0, 1]
+    assert wal.append("t", b"y") == 2  # the torn record's LSN was never handed out for good
+    wal.close()
+
+
+def test_corrupt_record_stops_the_segment(tmp_path):
+    wal = open_wal(tmp_path)
+    for i in range(3):
+        wal.append("t", bytes([i]) * 100)
+    wal.close()
+    path = tmp_path / segments(tmp_path)[0]
+    data = bytearray(path.read_bytes())
+    record = len(data) // 3
+    data[record + 50] ^= 0xFF  # flip a payload byte of the second record
+    path.write_bytes(bytes(data))
+
+    wal = open_wal(tmp_path)
+    assert [lsn for lsn, *_ in wal.replay()] == [0]
+    wal.close()
+
+
+def test_checkpoint_deletes_committed_segments(tmp_path):
+    wal = open_wal(tmp_path, segment_bytes=300)  # ~2 records of 100 bytes per segment
+    for i in range(10):
+        wal.append("t", b"x" * 100)
+    before = segments(tmp_path)
+    assert len(before) > 3
+
+    assert wal.checkpoint(4) > 0
+    assert (tmp_path / "checkpoint").read_text() == "4"
+    # segments starting at or below 4 may only go if the next one starts at or below 4 too
+    remaining = [int(f[4:-4]) for f in segments(tmp_path)]
+    assert remaining[0] <= 4 < remaining[1]
+
+    assert wal.checkpoint(wal.next_lsn) > 0
+    assert segments(tmp_path) == [before[-1]]  # the current segment is never deleted
+    assert wal.checkpoint(3) == 0  # never goes back
+    wal.close()
+
+    wal = open_wal(tmp_path)
+    assert list(wal.replay()) == []
+    assert wal.append("t", b"x") == 10
+    wal.close()
+
+
+def test_checkpoint_waits_for_replay(tmp_path):
+    wal = open_wal(tmp_path)
+    for i in range(3):
+        wal.append("t", b"x")
+    wal.close()
+
+    wal = open_wal(tmp_path)
+    # nothing holds the recovered records yet: checkpointing now would lose them
+    assert wal.checkpoint(wal.next_lsn) == 0
+    assert wal.checkpoint_lsn == 0
+    assert len(list(wal.replay())) == 3
+    wal.append("t", b"x")
+    assert wal.checkpoint(wal.next_lsn) == 1
+    assert wal.checkpoint_lsn == 4
+    wal.close()
+
+
+def test_replay_skips_checkpointed_records(tmp_path):
+    wal = open_wal(tmp_path)
+    for i in range(5):
+        wal.append("t", b"x")
+    wal.checkpoint(3)  # 0-2 committed, same segment as 3-4
+    wal.close()
+
+    wal = open_wal(tmp_path)
+    assert [lsn for lsn, *_ in wal.replay()] == [3, 4]
+    wal.close()
+
+
+def test_append_holds_lsn_until_released(tmp_path):
+    tracker = WalTracker()
+    wal = open_wal(tmp_path, tracker=tracker)
+    a = wal.append("t", b"a")
+    b = wal.append("t", b"b")
+    assert tracker.low_water(wal.next_lsn) == a
+    tracker.release(a)
+    assert tracker.low_water(wal.next_lsn) == b
+    tracker.release(b)
+    assert tracker.low_water(wal.next_lsn) == wal.next_lsn
+    wal.close()
+
+
+def test_tracker_counts_holds():
+    tracker = WalTracker()
+    tracker.hold(5)
+    tracker.hold(5)  # e.g. a queued item and an open reassembly entry from the same message
+    tracker.hold(7)
+    tracker.release(5)
+    assert tracker.low_water(100) == 5
+    tracker.release(5)
+    assert tracker.low_water(100) == 7
+    tracker.release(7)
+    tracker.release(7)  # unknown LSNs are ignored
+    tracker.hold(None)
+    tracker.release(None)
+    assert tracker.low_water(100) == 100
+    assert tracker.stats() == {"held": 0}
+
+
+def test_tracker_providers():
+    tracker = WalTracker()
+    buffered = [None]
+    tracker.add_provider(lambda: buffered[0])
+    tracker.hold(10)
+    assert tracker.low_water(100) == 10
+    buffered[0] = 4
+    assert tracker.low_water(100) == 4
+    buffered[0] = None
+    tracker.release(10)
+    assert tracker.low_water(100) == 100
+
+
+def test_logged_queue_appends_before_the_consumer_runs(tmp_path, monkeypatch):
+    from types import SimpleNamespace
+    monkeypatch.setenv("MQTT_PORT", os.getenv("MQTT_PORT", "1883"))  # read by mqtt_config at import
+    from ingest import LoggedQueue
+
+    tracker = WalTracker()
+    wal = open_wal(tmp_path, tracker=tracker)
+    q = LoggedQueue(wal)
+    # what aiomqtt calls from paho's on_message, before the PUBACK goes out
+    q.put_nowait(SimpleNamespace(topic=SimpleNamespace(value="v1/device/d1/telemetry"), payload=b"{}"))
+    assert wal.stats()["appended"] == 1
+    msg, lsn = q.get_nowait()
+    assert msg.payload == b"{}" and lsn == 0
+    assert tracker.low_water(wal.next_lsn) == 0  # held until the consumer releases it
+    wal.close()
@@ -35,7 +35,9 @@ ChartJS.register(
  * Props:
  *  - deviceId: string (required) — the device to show
  *  - limit: number (optional) — number of recent readings to fetch (default 200)
- *  - refreshMs: number (optional) — auto-refresh interval in ms (default 5000)
+ *  - refreshMs: number (optional) — polling interval in ms, used only while the live stream is down (default 5000)
+ *
+ * New readings are pushed over /api/live (Server-Sent Events); REST is used for the initial history.
  *
  * Expects API to return rows with { time: ISO-string, ax, ay, az }
  */
@@ -80,14 +82,37 @@ export default function DeviceReadingsChart({ deviceId, limit = 200, refreshMs =
       }
     }
 
+    const startPolling = () => {
+      if (refreshMs > 0 && !intervalRef.current) {
+        intervalRef.current = setInterval(fetchData, refreshMs);
+      }
+    };
+    const stopPolling = () => {
+      if (intervalRef.current) clearInterval(intervalRef.current);
+      intervalRef.current = null;
+    };
+
     fetchData();
-    // schedule periodic refresh
-    if (refreshMs > 0) {
-      intervalRef.current = setInterval(fetchData, refreshMs);
+    // live updates; fall back to polling while the stream is down (EventSource reconnects by itself)
+    let source = null;
+    try {
+      source = deviceService.openLive([deviceId]);
+      source.addEventListener("open", stopPolling);
+      source.addEventListener("error", startPolling);
+      source.addEventListener("reading", (e) => {
+        if (!mounted) return;
+        const { data } = JSON.parse(e.data);
+        if (!data || !data.time) return;
+        setReadings(prev => [...prev, { time: data.time, metrics: data.metrics || {} }].slice(-limit));
+      });
+    } catch (err) {
+      console.error("DeviceReadingsChart: live stream unavailable", err);
+      startPolling();
     }
     return () => {
       mounted = false;
-      if (intervalRef.current) clearInterval(intervalRef.current);
+      if (source) source.close();
+      stopPolling();
     };
   }, [deviceId, limit, refreshMs]);
 
@@ -1,4 +1,5 @@
 import api from "../api";
+import { tokenService } from "./tokenService";
 
 export const deviceService = {
   listDevices: (limit = 100) => api.get(`/devices?limit=${limit}`).then(r => r.data),
@@ -6,5 +7,10 @@ export const deviceService = {
   provisionDevice: ({ device_id, claim_token, mac, fw_version }) =>
     api.post("/devices/provision", { device_id, claim_token, mac, fw_version }).then(r => r.data),
   getReadings: (deviceId, limit = 50) =>
-    api.get(`/devices/${deviceId}/readings?limit=${limit}`).then(r => r.data)
+    api.get(`/devices/${deviceId}/readings?limit=${limit}`).then(r => r.data),
+  // Server-Sent Events stream of new readings / spectra / alerts (EventSource cannot send headers -> token in query)
+  openLive: (deviceIds) => {
+    const params = new URLSearchParams({ devices: deviceIds.join(","), jwt: tokenService.getAccess() || "" });
+    return new EventSource(`${api.defaults.baseURL}/live?${params}`);
+  }
 };
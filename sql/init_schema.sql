@@ -40,7 +40,11 @@ CREATE TABLE IF NOT EXISTS devices (
   last_seen TIMESTAMPTZ,
   config JSONB DEFAULT '{}'::jsonb,
   created_by INTEGER REFERENCES users(id) ON DELETE SET NULL,
-  created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+  created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  -- latest state, written in coalesced batches by ingest (backend/app/device_state.py)
+  last_metrics JSONB,
+  last_metrics_at TIMESTAMPTZ,
+  last_raw_block_id TEXT
 );
 
 CREATE TABLE IF NOT EXISTS device_credentials (
@@ -72,7 +76,19 @@ CREATE TABLE IF NOT EXISTS readings_parameters (
   device_id TEXT NOT NULL,
   sample_rate INTEGER,
   samples INTEGER,
-  metrics JSONB, -- e.g. {"device_id":"dev000","ts_ms":1763239260000,"sample_rate_hz":1000,"samples":256,"metrics":{"ax_mean_g":0.935537338,"ay_mean_g":0.034338951,"az_mean_g":0.423355103,"ax_rms_g":0.935540127,"ay_rms_g":0.0343999,"az_rms_g":0.423374336,"ax_peak_g":0.941650391,"ay_peak_g":0.039794922,"az_peak_g":0.43359375,"magnitude_rms_g":1.027455357,"magnitude_peak_g":1.035909213}
+  -- fixed firmware metric set, filled when the backend runs with READINGS_SCHEMA=typed
+  ax_mean_g REAL,
+  ay_mean_g REAL,
+  az_mean_g REAL,
+  ax_rms_g REAL,
+  ay_rms_g REAL,
+  az_rms_g REAL,
+  ax_peak_g REAL,
+  ay_peak_g REAL,
+  az_peak_g REAL,
+  magnitude_rms_g REAL,
+  magnitude_peak_g REAL,
+  metrics JSONB, -- unknown extras only in typed mode, all metrics in jsonb mode. e.g. {"device_id":"dev000","ts_ms":1763239260000,"sample_rate_hz":1000,"samples":256,"metrics":{"ax_mean_g":0.935537338,"ay_mean_g":0.034338951,"az_mean_g":0.423355103,"ax_rms_g":0.935540127,"ay_rms_g":0.0343999,"az_rms_g":0.423374336,"ax_peak_g":0.941650391,"ay_peak_g":0.039794922,"az_peak_g":0.43359375,"magnitude_rms_g":1.027455357,"magnitude_peak_g":1.035909213}
   PRIMARY KEY (time, device_id)
 );
 
@@ -90,10 +106,185 @@ CREATE TABLE IF NOT EXISTS raw_blocks (
   PRIMARY KEY (time, device_id, block_id)
 );
 
+-- spectra computed from raw blocks (one row per block)
+CREATE TABLE IF NOT EXISTS raw_spectra (
+  time TIMESTAMPTZ NOT NULL, -- same time as the source raw block
+  device_id TEXT NOT NULL,
+  block_id TEXT NOT NULL,
+  sample_rate INTEGER,
+  samples INTEGER,
+  rms_g REAL[], -- per-axis AC rms [ax, ay, az] (DC removed)
+  band_edges_hz REAL[], -- band boundaries, e.g. {0,10,50,100,200,350,500}
+  band_energy REAL[], -- 3 x bands, g^2 per axis per band
+  peak_hz REAL[], -- 3 x k dominant peak frequencies per axis
+  peak_amp_g REAL[], -- 3 x k matching peak amplitudes
+  PRIMARY KEY (time, device_id, block_id)
+);
+
+-- streaming baseline statistics per device and metric (checkpointed by the ingest worker)
+CREATE TABLE IF NOT EXISTS device_baselines (
+  device_id TEXT NOT NULL,
+  metric TEXT NOT NULL, -- e.g. ax_rms_g, magnitude_peak_g, ax_band_50_100_g2
+  state JSONB NOT NULL, -- serialized baseline.RunningStat (welford, ewma, quantile markers)
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  PRIMARY KEY (device_id, metric)
+);
+
 -- convert readings to hypertable (TimescaleDB)
 SELECT create_hypertable('readings_parameters', 'time', if_not_exists => TRUE);
 SELECT create_hypertable('raw_blocks', 'time', if_not_exists => TRUE);
+SELECT create_hypertable('raw_spectra', 'time', if_not_exists => TRUE);
 
 -- indexes for quick device/time queries
 CREATE INDEX IF NOT EXISTS idx_raw_blocks_device_time ON raw_blocks(device_id, time DESC);
-CREATE INDEX IF NOT EXISTS idx_readings_device_time ON readings_parameters(device_id, time DESC);
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS idx_readings_device_time ON readings_parameters(device_id, time DESC);
+CREATE INDEX IF NOT EXISTS idx_raw_spectra_device_time ON raw_spectra(device_id, time DESC);
+CREATE INDEX IF NOT EXISTS idx_refresh_tokens_expires_at ON refresh_tokens(expires_at);
+-- one alert per rule and reading: replaying the ingest WAL after a crash re-raises the same alerts
+CREATE UNIQUE INDEX IF NOT EXISTS idx_alerts_device_rule_time ON alerts(device_id, rule, created_at);
+
+-- storage: native compression segmented by device (one compressed batch per device per chunk) and retention.
+-- Defaults mirror backend/app/storage.py; per deployment values (STORAGE_* env) are applied with
+--   python app/storage.py
+ALTER TABLE raw_blocks SET (timescaledb.compress, timescaledb.compress_segmentby = 'device_id',
+  timescaledb.compress_orderby = 'time DESC, block_id');
+ALTER TABLE readings_parameters SET (timescaledb.compress, timescaledb.compress_segmentby = 'device_id',
+  timescaledb.compress_orderby = 'time DESC');
+SELECT add_compression_policy('raw_blocks', INTERVAL '1 day', if_not_exists => TRUE);
+SELECT add_retention_policy('raw_blocks', INTERVAL '90 days', if_not_exists => TRUE);
+SELECT add_compression_policy('readings_parameters', INTERVAL '7 days', if_not_exists => TRUE);
+
+-- downsampled readings: continuous aggregates at 1 minute, 1 hour and 1 day (min / max / avg of the key metrics)
+-- metrics are read from the typed column, falling back to the JSONB key (rows written in jsonb mode)
+-- 1h is rolled up from 1m and 1d from 1h. <metric>_n counts the rows that have the metric (n counts all rows):
+-- rolled up averages are weighted by it, so rows without a metric do not pull its average towards 0.
+-- materialized_only = false: the not yet materialized tail is aggregated on the fly (real-time aggregation)
+CREATE MATERIALIZED VIEW IF NOT EXISTS readings_1m
+WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+SELECT time_bucket(INTERVAL '1 minute', time) AS bucket,
+       device_id,
+       count(*) AS n,
+       count(COALESCE(ax_rms_g, (metrics->>'ax_rms_g')::double precision)) AS ax_rms_g_n,
+       min(COALESCE(ax_rms_g, (metrics->>'ax_rms_g')::double precision)) AS ax_rms_g_min,
+       max(COALESCE(ax_rms_g, (metrics->>'ax_rms_g')::double precision)) AS ax_rms_g_max,
+       avg(COALESCE(ax_rms_g, (metrics->>'ax_rms_g')::double precision)) AS ax_rms_g_avg,
+       count(COALESCE(ay_rms_g, (metrics->>'ay_rms_g')::double precision)) AS ay_rms_g_n,
+       min(COALESCE(ay_rms_g, (metrics->>'ay_rms_g')::double precision)) AS ay_rms_g_min,
+       max(COALESCE(ay_rms_g, (metrics->>'ay_rms_g')::double precision)) AS ay_rms_g_max,
+       avg(COALESCE(ay_rms_g, (metrics->>'ay_rms_g')::double precision)) AS ay_rms_g_avg,
+       count(COALESCE(az_rms_g, (metrics->>'az_rms_g')::double precision)) AS az_rms_g_n,
+       min(COALESCE(az_rms_g, (metrics->>'az_rms_g')::double precision)) AS az_rms_g_min,
+       max(COALESCE(az_rms_g, (metrics->>'az_rms_g')::double precision)) AS az_rms_g_max,
+       avg(COALESCE(az_rms_g, (metrics->>'az_rms_g')::double precision)) AS az_rms_g_avg,
+       count(COALESCE(magnitude_rms_g, (metrics->>'magnitude_rms_g')::double precision)) AS magnitude_rms_g_n,
+       min(COALESCE(magnitude_rms_g, (metrics->>'magnitude_rms_g')::double precision)) AS magnitude_rms_g_min,
+       max(COALESCE(magnitude_rms_g, (metrics->>'magnitude_rms_g')::double precision)) AS magnitude_rms_g_max,
+       avg(COALESCE(magnitude_rms_g, (metrics->>'magnitude_rms_g')::double precision)) AS magnitude_rms_g_avg,
+       count(COALESCE(ax_peak_g, (metrics->>'ax_peak_g')::double precision)) AS ax_peak_g_n,
+       min(COALESCE(ax_peak_g, (metrics->>'ax_peak_g')::double precision)) AS ax_peak_g_min,
+       max(COALESCE(ax_peak_g, (metrics->>'ax_peak_g')::double precision)) AS ax_peak_g_max,
+       avg(COALESCE(ax_peak_g, (metrics->>'ax_peak_g')::double precision)) AS ax_peak_g_avg,
+       count(COALESCE(ay_peak_g, (metrics->>'ay_peak_g')::double precision)) AS ay_peak_g_n,
+       min(COALESCE(ay_peak_g, (metrics->>'ay_peak_g')::double precision)) AS ay_peak_g_min,
+       max(COALESCE(ay_peak_g, (metrics->>'ay_peak_g')::double precision)) AS ay_peak_g_max,
+       avg(COALESCE(ay_peak_g, (metrics->>'ay_peak_g')::double precision)) AS ay_peak_g_avg,
+       count(COALESCE(az_peak_g, (metrics->>'az_peak_g')::double precision)) AS az_peak_g_n,
+       min(COALESCE(az_peak_g, (metrics->>'az_peak_g')::double precision)) AS az_peak_g_min,
+       max(COALESCE(az_peak_g, (metrics->>'az_peak_g')::double precision)) AS az_peak_g_max,
+       avg(COALESCE(az_peak_g, (metrics->>'az_peak_g')::double precision)) AS az_peak_g_avg,
+       count(COALESCE(magnitude_peak_g, (metrics->>'magnitude_peak_g')::double precision)) AS magnitude_peak_g_n,
+       min(COALESCE(magnitude_peak_g, (metrics->>'magnitude_peak_g')::double precision)) AS magnitude_peak_g_min,
+       max(COALESCE(magnitude_peak_g, (metrics->>'magnitude_peak_g')::double precision)) AS magnitude_peak_g_max,
+       avg(COALESCE(magnitude_peak_g, (metrics->>'magnitude_peak_g')::double precision)) AS magnitude_peak_g_avg
+FROM readings_parameters
+GROUP BY bucket, device_id
+WITH NO DATA;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS readings_1h
+WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+SELECT time_bucket(INTERVAL '1 hour', bucket) AS bucket,
+       device_id,
+       sum(n) AS n,
+       sum(ax_rms_g_n) AS ax_rms_g_n,
+       min(ax_rms_g_min) AS ax_rms_g_min,
+       max(ax_rms_g_max) AS ax_rms_g_max,
+       sum(ax_rms_g_avg * ax_rms_g_n) / NULLIF(sum(ax_rms_g_n), 0) AS ax_rms_g_avg,
+       sum(ay_rms_g_n) AS ay_rms_g_n,
+       min(ay_rms_g_min) AS ay_rms_g_min,
+       max(ay_rms_g_max) AS ay_rms_g_max,
+       sum(ay_rms_g_avg * ay_rms_g_n) / NULLIF(sum(ay_rms_g_n), 0) AS ay_rms_g_avg,
+       sum(az_rms_g_n) AS az_rms_g_n,
+       min(az_rms_g_min) AS az_rms_g_min,
+       max(az_rms_g_max) AS az_rms_g_max,
+       sum(az_rms_g_avg * az_rms_g_n) / NULLIF(sum(az_rms_g_n), 0) AS az_rms_g_avg,
+       sum(magnitude_rms_g_n) AS magnitude_rms_g_n,
+       min(magnitude_rms_g_min) AS magnitude_rms_g_min,
+       max(magnitude_rms_g_max) AS magnitude_rms_g_max,
+       sum(magnitude_rms_g_avg * magnitude_rms_g_n) / NULLIF(sum(magnitude_rms_g_n), 0) AS magnitude_rms_g_avg,
+       sum(ax_peak_g_n) AS ax_peak_g_n,
+       min(ax_peak_g_min) AS ax_peak_g_min,
+       max(ax_peak_g_max) AS ax_peak_g_max,
+       sum(ax_peak_g_avg * ax_peak_g_n) / NULLIF(sum(ax_peak_g_n), 0) AS ax_peak_g_avg,
+       sum(ay_peak_g_n) AS ay_peak_g_n,
+       min(ay_peak_g_min) AS ay_peak_g_min,
+       max(ay_peak_g_max) AS ay_peak_g_max,
+       sum(ay_peak_g_avg * ay_peak_g_n) / NULLIF(sum(ay_peak_g_n), 0) AS ay_peak_g_avg,
+       sum(az_peak_g_n) AS az_peak_g_n,
+       min(az_peak_g_min) AS az_peak_g_min,
+       max(az_peak_g_max) AS az_peak_g_max,
+       sum(az_peak_g_avg * az_peak_g_n) / NULLIF(sum(az_peak_g_n), 0) AS az_peak_g_avg,
+       sum(magnitude_peak_g_n) AS magnitude_peak_g_n,
+       min(magnitude_peak_g_min) AS magnitude_peak_g_min,
+       max(magnitude_peak_g_max) AS magnitude_peak_g_max,
+       sum(magnitude_peak_g_avg * magnitude_peak_g_n) / NULLIF(sum(magnitude_peak_g_n), 0) AS magnitude_peak_g_avg
+FROM readings_1m
+GROUP BY 1, device_id
+WITH NO DATA;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS readings_1d
+WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+SELECT time_bucket(INTERVAL '1 day', bucket) AS bucket,
+       device_id,
+       sum(n) AS n,
+       sum(ax_rms_g_n) AS ax_rms_g_n,
+       min(ax_rms_g_min) AS ax_rms_g_min,
+       max(ax_rms_g_max) AS ax_rms_g_max,
+       sum(ax_rms_g_avg * ax_rms_g_n) / NULLIF(sum(ax_rms_g_n), 0) AS ax_rms_g_avg,
+       sum(ay_rms_g_n) AS ay_rms_g_n,
+       min(ay_rms_g_min) AS ay_rms_g_min,
+       max(ay_rms_g_max) AS ay_rms_g_max,
+       sum(ay_rms_g_avg * ay_rms_g_n) / NULLIF(sum(ay_rms_g_n), 0) AS ay_rms_g_avg,
+       sum(az_rms_g_n) AS az_rms_g_n,
+       min(az_rms_g_min) AS az_rms_g_min,
+       max(az_rms_g_max) AS az_rms_g_max,
+       sum(az_rms_g_avg * az_rms_g_n) / NULLIF(sum(az_rms_g_n), 0) AS az_rms_g_avg,
+       sum(magnitude_rms_g_n) AS magnitude_rms_g_n,
+       min(magnitude_rms_g_min) AS magnitude_rms_g_min,
+       max(magnitude_rms_g_max) AS magnitude_rms_g_max,
+       sum(magnitude_rms_g_avg * magnitude_rms_g_n) / NULLIF(sum(magnitude_rms_g_n), 0) AS magnitude_rms_g_avg,
+       sum(ax_peak_g_n) AS ax_peak_g_n,
+       min(ax_peak_g_min) AS ax_peak_g_min,
+       max(ax_peak_g_max) AS ax_peak_g_max,
+       sum(ax_peak_g_avg * ax_peak_g_n) / NULLIF(sum(ax_peak_g_n), 0) AS ax_peak_g_avg,
+       sum(ay_peak_g_n) AS ay_peak_g_n,
+       min(ay_peak_g_min) AS ay_peak_g_min,
+       max(ay_peak_g_max) AS ay_peak_g_max,
+       sum(ay_peak_g_avg * ay_peak_g_n) / NULLIF(sum(ay_peak_g_n), 0) AS ay_peak_g_avg,
+       sum(az_peak_g_n) AS az_peak_g_n,
+       min(az_peak_g_min) AS az_peak_g_min,
+       max(az_peak_g_max) AS az_peak_g_max,
+       sum(az_peak_g_avg * az_peak_g_n) / NULLIF(sum(az_peak_g_n), 0) AS az_peak_g_avg,
+       sum(magnitude_peak_g_n) AS magnitude_peak_g_n,
+       min(magnitude_peak_g_min) AS magnitude_peak_g_min,
+       max(magnitude_peak_g_max) AS magnitude_peak_g_max,
+       sum(magnitude_peak_g_avg * magnitude_peak_g_n) / NULLIF(sum(magnitude_peak_g_n), 0) AS magnitude_peak_g_avg
+FROM readings_1h
+GROUP BY 1, device_id
+WITH NO DATA;
+
+SELECT add_continuous_aggregate_policy('readings_1m', start_offset => INTERVAL '2 hours',
+  end_offset => INTERVAL '1 minute', schedule_interval => INTERVAL '1 minute', if_not_exists => TRUE);
+SELECT add_continuous_aggregate_policy('readings_1h', start_offset => INTERVAL '3 days',
+  end_offset => INTERVAL '1 hour', schedule_interval => INTERVAL '30 minutes', if_not_exists => TRUE);
+SELECT add_continuous_aggregate_policy('readings_1d', start_offset => INTERVAL '30 days',
+  end_offset => INTERVAL '1 day', schedule_interval => INTERVAL '1 hour', if_not_exists => TRUE);
@@ -0,0 +1,135 @@
+-- sql/migrations/001_typed_metrics.sql
+-- Typed metric columns on an existing database (fresh databases get them from init_schema.sql).
+-- Run with psql (not inside a transaction, refresh_continuous_aggregate needs autocommit):
+--   psql "$DATABASE_URL" -f sql/migrations/001_typed_metrics.sql
+-- then switch the backend / ingest service to READINGS_SCHEMA=typed and move old rows over with
+--   python app/backfill_typed_metrics.py
+
+ALTER TABLE readings_parameters
+  ADD COLUMN IF NOT EXISTS ax_mean_g REAL,
+  ADD COLUMN IF NOT EXISTS ay_mean_g REAL,
+  ADD COLUMN IF NOT EXISTS az_mean_g REAL,
+  ADD COLUMN IF NOT EXISTS ax_rms_g REAL,
+  ADD COLUMN IF NOT EXISTS ay_rms_g REAL,
+  ADD COLUMN IF NOT EXISTS az_rms_g REAL,
+  ADD COLUMN IF NOT EXISTS ax_peak_g REAL,
+  ADD COLUMN IF NOT EXISTS ay_peak_g REAL,
+  ADD COLUMN IF NOT EXISTS az_peak_g REAL,
+  ADD COLUMN IF NOT EXISTS magnitude_rms_g REAL,
+  ADD COLUMN IF NOT EXISTS magnitude_peak_g REAL;
+
+-- the readings aggregates read the typed columns first (falling back to the JSONB keys):
+-- continuous aggregates cannot be altered, so they are recreated and refreshed
+DROP MATERIALIZED VIEW IF EXISTS readings_1d;
+DROP MATERIALIZED VIEW IF EXISTS readings_1h;
+DROP MATERIALIZED VIEW IF EXISTS readings_1m;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS readings_1m
+WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+SELECT time_bucket(INTERVAL '1 minute', time) AS bucket,
+       device_id,
+       count(*) AS n,
+       min(COALESCE(ax_rms_g, (metrics->>'ax_rms_g')::double precision)) AS ax_rms_g_min,
+       max(COALESCE(ax_rms_g, (metrics->>'ax_rms_g')::double precision)) AS ax_rms_g_max,
+       avg(COALESCE(ax_rms_g, (metrics->>'ax_rms_g')::double precision)) AS ax_rms_g_avg,
+       min(COALESCE(ay_rms_g, (metrics->>'ay_rms_g')::double precision)) AS ay_rms_g_min,
+       max(COALESCE(ay_rms_g, (metrics->>'ay_rms_g')::double precision)) AS ay_rms_g_max,
+       avg(COALESCE(ay_rms_g, (metrics->>'ay_rms_g')::double precision)) AS ay_rms_g_avg,
+       min(COALESCE(az_rms_g, (metrics->>'az_rms_g')::double precision)) AS az_rms_g_min,
+       max(COALESCE(az_rms_g, (metrics->>'az_rms_g')::double precision)) AS az_rms_g_max,
+       avg(COALESCE(az_rms_g, (metrics->>'az_rms_g')::double precision)) AS az_rms_g_avg,
+       min(COALESCE(magnitude_rms_g, (metrics->>'magnitude_rms_g')::double precision)) AS magnitude_rms_g_min,
+       max(COALESCE(magnitude_rms_g, (metrics->>'magnitude_rms_g')::double precision)) AS magnitude_rms_g_max,
+       avg(COALESCE(magnitude_rms_g, (metrics->>'magnitude_rms_g')::double precision)) AS magnitude_rms_g_avg,
+       min(COALESCE(ax_peak_g, (metrics->>'ax_peak_g')::double precision)) AS ax_peak_g_min,
+       max(COALESCE(ax_peak_g, (metrics->>'ax_peak_g')::double precision)) AS ax_peak_g_max,
+       avg(COALESCE(ax_peak_g, (metrics->>'ax_peak_g')::double precision)) AS ax_peak_g_avg,
+       min(COALESCE(ay_peak_g, (metrics->>'ay_peak_g')::double precision)) AS ay_peak_g_min,
+       max(COALESCE(ay_peak_g, (metrics->>'ay_peak_g')::double precision)) AS ay_peak_g_max,
+       avg(COALESCE(ay_peak_g, (metrics->>'ay_peak_g')::double precision)) AS ay_peak_g_avg,
+       min(COALESCE(az_peak_g, (metrics->>'az_peak_g')::double precision)) AS az_peak_g_min,
+       max(COALESCE(az_peak_g, (metrics->>'az_peak_g')::double precision)) AS az_peak_g_max,
+       avg(COALESCE(az_peak_g, (metrics->>'az_peak_g')::double precision)) AS az_peak_g_avg,
+       min(COALESCE(magnitude_peak_g, (metrics->>'magnitude_peak_g')::double precision)) AS magnitude_peak_g_min,
+       max(COALESCE(magnitude_peak_g, (metrics->>'magnitude_peak_g')::double precision)) AS magnitude_peak_g_max,
+       avg(COALESCE(magnitude_peak_g, (metrics->>'magnitude_peak_g')::double precision)) AS magnitude_peak_g_avg
+FROM readings_parameters
+GROUP BY bucket, device_id
+WITH NO DATA;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS readings_1h
+WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+SELECT time_bucket(INTERVAL '1 hour', bucket) AS bucket,
+       device_id,
+       sum(n) AS n,
+       min(ax_rms_g_min) AS ax_rms_g_min,
+       max(ax_rms_g_max) AS ax_rms_g_max,
+       sum(ax_rms_g_avg * n) / sum(n) AS ax_rms_g_avg,
+       min(ay_rms_g_min) AS ay_rms_g_min,
+       max(ay_rms_g_max) AS ay_rms_g_max,
+       sum(ay_rms_g_avg * n) / sum(n) AS ay_rms_g_avg,
+       min(az_rms_g_min) AS az_rms_g_min,
+       max(az_rms_g_max) AS az_rms_g_max,
+       sum(az_rms_g_avg * n) / sum(n) AS az_rms_g_avg,
+       min(magnitude_rms_g_min) AS magnitude_rms_g_min,
+       max(magnitude_rms_g_max) AS magnitude_rms_g_max,
+       sum(magnitude_rms_g_avg * n) / sum(n) AS magnitude_rms_g_avg,
+       min(ax_peak_g_min) AS ax_peak_g_min,
+       max(ax_peak_g_max) AS ax_peak_g_max,
+       sum(ax_peak_g_avg * n) / sum(n) AS ax_peak_g_avg,
+       min(ay_peak_g_min) AS ay_peak_g_min,
+       max(ay_peak_g_max) AS ay_peak_g_max,
+       sum(ay_peak_g_avg * n) / sum(n) AS ay_peak_g_avg,
+       min(az_peak_g_min) AS az_peak_g_min,
+       max(az_peak_g_max) AS az_peak_g_max,
+       sum(az_peak_g_avg * n) / sum(n) AS az_peak_g_avg,
+       min(magnitude_peak_g_min) AS magnitude_peak_g_min,
+       max(magnitude_peak_g_max) AS magnitude_peak_g_max,
+       sum(magnitude_peak_g_avg * n) / sum(n) AS magnitude_peak_g_avg
+FROM readings_1m
+GROUP BY 1, device_id
+WITH NO DATA;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS readings_1d
+WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+SELECT time_bucket(INTERVAL '1 day', bucket) AS bucket,
+       device_id,
+       sum(n) AS n,
+       min(ax_rms_g_min) AS ax_rms_g_min,
+       max(ax_rms_g_max) AS ax_rms_g_max,
+       sum(ax_rms_g_avg * n) / sum(n) AS ax_rms_g_avg,
+       min(ay_rms_g_min) AS ay_rms_g_min,
+       max(ay_rms_g_max) AS ay_rms_g_max,
+       sum(ay_rms_g_avg * n) / sum(n) AS ay_rms_g_avg,
+       min(az_rms_g_min) AS az_rms_g_min,
+       max(az_rms_g_max) AS az_rms_g_max,
+       sum(az_rms_g_avg * n) / sum(n) AS az_rms_g_avg,
+       min(magnitude_rms_g_min) AS magnitude_rms_g_min,
+       max(magnitude_rms_g_max) AS magnitude_rms_g_max,
+       sum(magnitude_rms_g_avg * n) / sum(n) AS magnitude_rms_g_avg,
+       min(ax_peak_g_min) AS ax_peak_g_min,
+       max(ax_peak_g_max) AS ax_peak_g_max,
+       sum(ax_peak_g_avg * n) / sum(n) AS ax_peak_g_avg,
+       min(ay_peak_g_min) AS ay_peak_g_min,
+       max(ay_peak_g_max) AS ay_peak_g_max,
+       sum(ay_peak_g_avg * n) / sum(n) AS ay_peak_g_avg,
+       min(az_peak_g_min) AS az_peak_g_min,
+       max(az_peak_g_max) AS az_peak_g_max,
+       sum(az_peak_g_avg * n) / sum(n) AS az_peak_g_avg,
+       min(magnitude_peak_g_min) AS magnitude_peak_g_min,
+       max(magnitude_peak_g_max) AS magnitude_peak_g_max,
+       sum(magnitude_peak_g_avg * n) / sum(n) AS magnitude_peak_g_avg
+FROM readings_1h
+GROUP BY 1, device_id
+WITH NO DATA;
+
+SELECT add_continuous_aggregate_policy('readings_1m', start_offset => INTERVAL '2 hours',
+  end_offset => INTERVAL '1 minute', schedule_interval => INTERVAL '1 minute', if_not_exists => TRUE);
+SELECT add_continuous_aggregate_policy('readings_1h', start_offset => INTERVAL '3 days',
+  end_offset => INTERVAL '1 hour', schedule_interval => INTERVAL '30 minutes', if_not_exists => TRUE);
+SELECT add_continuous_aggregate_policy('readings_1d', start_offset => INTERVAL '30 days',
+  end_offset => INTERVAL '1 day', schedule_interval => INTERVAL '1 hour', if_not_exists => TRUE);
+
+CALL refresh_continuous_aggregate('readings_1m', NULL, NULL);
+CALL refresh_continuous_aggregate('readings_1h', NULL, NULL);
+CALL refresh_continuous_aggregate('readings_1d', NULL, NULL);
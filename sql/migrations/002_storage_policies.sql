@@ -0,0 +1,12 @@
+-- sql/migrations/002_storage_policies.sql
+-- Compression and retention on an existing database (fresh databases get them from init_schema.sql).
+--   psql "$DATABASE_URL" -f sql/migrations/002_storage_policies.sql
+-- Deployment specific intervals (STORAGE_* env, see backend/app/storage.py) are applied afterwards with
+--   python app/storage.py
+ALTER TABLE raw_blocks SET (timescaledb.compress, timescaledb.compress_segmentby = 'device_id',
+  timescaledb.compress_orderby = 'time DESC, block_id');
+ALTER TABLE readings_parameters SET (timescaledb.compress, timescaledb.compress_segmentby = 'device_id',
+  timescaledb.compress_orderby = 'time DESC');
+SELECT add_compression_policy('raw_blocks', INTERVAL '1 day', if_not_exists => TRUE);
+SELECT add_retention_policy('raw_blocks', INTERVAL '90 days', if_not_exists => TRUE);
+SELECT add_compression_policy('readings_parameters', INTERVAL '7 days', if_not_exists => TRUE);
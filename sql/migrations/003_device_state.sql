@@ -0,0 +1,7 @@
+-- sql/migrations/003_device_state.sql
+-- Latest device state columns on an existing database (fresh databases get them from init_schema.sql).
+--   psql "$DATABASE_URL" -f sql/migrations/003_device_state.sql
+-- Written by ingest in coalesced batches from its in-memory DeviceStateCache (backend/app/device_state.py).
+ALTER TABLE devices ADD COLUMN IF NOT EXISTS last_metrics JSONB;
+ALTER TABLE devices ADD COLUMN IF NOT EXISTS last_metrics_at TIMESTAMPTZ;
+ALTER TABLE devices ADD COLUMN IF NOT EXISTS last_raw_block_id TEXT;
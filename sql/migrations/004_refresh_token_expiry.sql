@@ -0,0 +1,5 @@
+-- sql/migrations/004_refresh_token_expiry.sql
+-- Index for the expired refresh token sweeper on an existing database (fresh databases get it from init_schema.sql).
+--   psql "$DATABASE_URL" -f sql/migrations/004_refresh_token_expiry.sql
+-- Rows are purged in batches by backend/app/auth_cache.py (REFRESH_TOKEN_SWEEP_SEC, REFRESH_TOKEN_SWEEP_BATCH).
+CREATE INDEX IF NOT EXISTS idx_refresh_tokens_expires_at ON refresh_tokens(expires_at);
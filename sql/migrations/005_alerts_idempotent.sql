@@ -0,0 +1,10 @@
+-- sql/migrations/005_alerts_idempotent.sql
+-- Unique key for alerts on an existing database (fresh databases get it from init_schema.sql), so the
+-- ingest WAL replay (backend/app/wal.py) can re-insert alerts with ON CONFLICT DO NOTHING.
+--   psql "$DATABASE_URL" -f sql/migrations/005_alerts_idempotent.sql
+-- Existing duplicates are removed first, keeping the oldest row (lowest id) of each.
+DELETE FROM alerts a
+USING alerts b
+WHERE a.device_id = b.device_id AND a.rule = b.rule AND a.created_at = b.created_at AND a.id > b.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_alerts_device_rule_time ON alerts(device_id, rule, created_at);
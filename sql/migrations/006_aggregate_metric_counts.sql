@@ -0,0 +1,145 @@
+-- sql/migrations/006_aggregate_metric_counts.sql
+-- Per-metric row counts (<metric>_n) in the readings aggregates on an existing database (fresh databases
+-- get them from init_schema.sql). The 1h / 1d averages were weighted by n, which also counts rows where
+-- the metric is NULL, so they were biased towards 0; they are now weighted by <metric>_n.
+-- Run with psql (not inside a transaction, refresh_continuous_aggregate needs autocommit):
+--   psql "$DATABASE_URL" -f sql/migrations/006_aggregate_metric_counts.sql
+
+-- continuous aggregates cannot be altered, so they are recreated and refreshed
+DROP MATERIALIZED VIEW IF EXISTS readings_1d;
+DROP MATERIALIZED VIEW IF EXISTS readings_1h;
+DROP MATERIALIZED VIEW IF EXISTS readings_1m;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS readings_1m
+WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+SELECT time_bucket(INTERVAL '1 minute', time) AS bucket,
+       device_id,
+       count(*) AS n,
+       count(COALESCE(ax_rms_g, (metrics->>'ax_rms_g')::double precision)) AS ax_rms_g_n,
+       min(COALESCE(ax_rms_g, (metrics->>'ax_rms_g')::double precision)) AS ax_rms_g_min,
+       max(COALESCE(ax_rms_g, (metrics->>'ax_rms_g')::double precision)) AS ax_rms_g_max,
+       avg(COALESCE(ax_rms_g, (metrics->>'ax_rms_g')::double precision)) AS ax_rms_g_avg,
+       count(COALESCE(ay_rms_g, (metrics->>'ay_rms_g')::double precision)) AS ay_rms_g_n,
+       min(COALESCE(ay_rms_g, (metrics->>'ay_rms_g')::double precision)) AS ay_rms_g_min,
+       max(COALESCE(ay_rms_g, (metrics->>'ay_rms_g')::double precision)) AS ay_rms_g_max,
+       avg(COALESCE(ay_rms_g, (metrics->>'ay_rms_g')::double precision)) AS ay_rms_g_avg,
+       count(COALESCE(az_rms_g, (metrics->>'az_rms_g')::double precision)) AS az_rms_g_n,
+       min(COALESCE(az_rms_g, (metrics->>'az_rms_g')::double precision)) AS az_rms_g_min,
+       max(COALESCE(az_rms_g, (metrics->>'az_rms_g')::double precision)) AS az_rms_g_max,
+       avg(COALESCE(az_rms_g, (metrics->>'az_rms_g')::double precision)) AS az_rms_g_avg,
+       count(COALESCE(magnitude_rms_g, (metrics->>'magnitude_rms_g')::double precision)) AS magnitude_rms_g_n,
+       min(COALESCE(magnitude_rms_g, (metrics->>'magnitude_rms_g')::double precision)) AS magnitude_rms_g_min,
+       max(COALESCE(magnitude_rms_g, (metrics->>'magnitude_rms_g')::double precision)) AS magnitude_rms_g_max,
+       avg(COALESCE(magnitude_rms_g, (metrics->>'magnitude_rms_g')::double precision)) AS magnitude_rms_g_avg,
+       count(COALESCE(ax_peak_g, (metrics->>'ax_peak_g')::double precision)) AS ax_peak_g_n,
+       min(COALESCE(ax_peak_g, (metrics->>'ax_peak_g')::double precision)) AS ax_peak_g_min,
+       max(COALESCE(ax_peak_g, (metrics->>'ax_peak_g')::double precision)) AS ax_peak_g_max,
+       avg(COALESCE(ax_peak_g, (metrics->>'ax_peak_g')::double precision)) AS ax_peak_g_avg,
+       count(COALESCE(ay_peak_g, (metrics->>'ay_peak_g')::double precision)) AS ay_peak_g_n,
+       min(COALESCE(ay_peak_g, (metrics->>'ay_peak_g')::double precision)) AS ay_peak_g_min,
+       max(COALESCE(ay_peak_g, (metrics->>'ay_peak_g')::double precision)) AS ay_peak_g_max,
+       avg(COALESCE(ay_peak_g, (metrics->>'ay_peak_g')::double precision)) AS ay_peak_g_avg,
+       count(COALESCE(az_peak_g, (metrics->>'az_peak_g')::double precision)) AS az_peak_g_n,
+       min(COALESCE(az_peak_g, (metrics->>'az_peak_g')::double precision)) AS az_peak_g_min,
+       max(COALESCE(az_peak_g, (metrics->>'az_peak_g')::double precision)) AS az_peak_g_max,
+       avg(COALESCE(az_peak_g, (metrics->>'az_peak_g')::double precision)) AS az_peak_g_avg,
+       count(COALESCE(magnitude_peak_g, (metrics->>'magnitude_peak_g')::double precision)) AS magnitude_peak_g_n,
+       min(COALESCE(magnitude_peak_g, (metrics->>'magnitude_peak_g')::double precision)) AS magnitude_peak_g_min,
+       max(COALESCE(magnitude_peak_g, (metrics->>'magnitude_peak_g')::double precision)) AS magnitude_peak_g_max,
+       avg(COALESCE(magnitude_peak_g, (metrics->>'magnitude_peak_g')::double precision)) AS magnitude_peak_g_avg
+FROM readings_parameters
+GROUP BY bucket, device_id
+WITH NO DATA;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS readings_1h
+WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+SELECT time_bucket(INTERVAL '1 hour', bucket) AS bucket,
+       device_id,
+       sum(n) AS n,
+       sum(ax_rms_g_n) AS ax_rms_g_n,
+       min(ax_rms_g_min) AS ax_rms_g_min,
+       max(ax_rms_g_max) AS ax_rms_g_max,
+       sum(ax_rms_g_avg * ax_rms_g_n) / NULLIF(sum(ax_rms_g_n), 0) AS ax_rms_g_avg,
+       sum(ay_rms_g_n) AS ay_rms_g_n,
+       min(ay_rms_g_min) AS ay_rms_g_min,
+       max(ay_rms_g_max) AS ay_rms_g_max,
+       sum(ay_rms_g_avg * ay_rms_g_n) / NULLIF(sum(ay_rms_g_n), 0) AS ay_rms_g_avg,
+       sum(az_rms_g_n) AS az_rms_g_n,
+       min(az_rms_g_min) AS az_rms_g_min,
+       max(az_rms_g_max) AS az_rms_g_max,
+       sum(az_rms_g_avg * az_rms_g_n) / NULLIF(sum(az_rms_g_n), 0) AS az_rms_g_avg,
+       sum(magnitude_rms_g_n) AS magnitude_rms_g_n,
+       min(magnitude_rms_g_min) AS magnitude_rms_g_min,
+       max(magnitude_rms_g_max) AS magnitude_rms_g_max,
+       sum(magnitude_rms_g_avg * magnitude_rms_g_n) / NULLIF(sum(magnitude_rms_g_n), 0) AS magnitude_rms_g_avg,
+       sum(ax_peak_g_n) AS ax_peak_g_n,
+       min(ax_peak_g_min) AS ax_peak_g_min,
+       max(ax_peak_g_max) AS ax_peak_g_max,
+       sum(ax_peak_g_avg * ax_peak_g_n) / NULLIF(sum(ax_peak_g_n), 0) AS ax_peak_g_avg,
+       sum(ay_peak_g_n) AS ay_peak_g_n,
+       min(ay_peak_g_min) AS ay_peak_g_min,
+       max(ay_peak_g_max) AS ay_peak_g_max,
+       sum(ay_peak_g_avg * ay_peak_g_n) / NULLIF(sum(ay_peak_g_n), 0) AS ay_peak_g_avg,
+       sum(az_peak_g_n) AS az_peak_g_n,
+       min(az_peak_g_min) AS az_peak_g_min,
+       max(az_peak_g_max) AS az_peak_g_max,
+       sum(az_peak_g_avg * az_peak_g_n) / NULLIF(sum(az_peak_g_n), 0) AS az_peak_g_avg,
+       sum(magnitude_peak_g_n) AS magnitude_peak_g_n,
+       min(magnitude_peak_g_min) AS magnitude_peak_g_min,
+       max(magnitude_peak_g_max) AS magnitude_peak_g_max,
+       sum(magnitude_peak_g_avg * magnitude_peak_g_n) / NULLIF(sum(magnitude_peak_g_n), 0) AS magnitude_peak_g_avg
+FROM readings_1m
+GROUP BY 1, device_id
+WITH NO DATA;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS readings_1d
+WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+SELECT time_bucket(INTERVAL '1 day', bucket) AS bucket,
+       device_id,
+       sum(n) AS n,
+       sum(ax_rms_g_n) AS ax_rms_g_n,
+       min(ax_rms_g_min) AS ax_rms_g_min,
+       max(ax_rms_g_max) AS ax_rms_g_max,
+       sum(ax_rms_g_avg * ax_rms_g_n) / NULLIF(sum(ax_rms_g_n), 0) AS ax_rms_g_avg,
+       sum(ay_rms_g_n) AS ay_rms_g_n,
+       min(ay_rms_g_min) AS ay_rms_g_min,
+       max(ay_rms_g_max) AS ay_rms_g_max,
+       sum(ay_rms_g_avg * ay_rms_g_n) / NULLIF(sum(ay_rms_g_n), 0) AS ay_rms_g_avg,
+       sum(az_rms_g_n) AS az_rms_g_n,
+       min(az_rms_g_min) AS az_rms_g_min,
+       max(az_rms_g_max) AS az_rms_g_max,
+       sum(az_rms_g_avg * az_rms_g_n) / NULLIF(sum(az_rms_g_n), 0) AS az_rms_g_avg,
+       sum(magnitude_rms_g_n) AS magnitude_rms_g_n,
+       min(magnitude_rms_g_min) AS magnitude_rms_g_min,
+       max(magnitude_rms_g_max) AS magnitude_rms_g_max,
+       sum(magnitude_rms_g_avg * magnitude_rms_g_n) / NULLIF(sum(magnitude_rms_g_n), 0) AS magnitude_rms_g_avg,
+       sum(ax_peak_g_n) AS ax_peak_g_n,
+       min(ax_peak_g_min) AS ax_peak_g_min,
+       max(ax_peak_g_max) AS ax_peak_g_max,
+       sum(ax_peak_g_avg * ax_peak_g_n) / NULLIF(sum(ax_peak_g_n), 0) AS ax_peak_g_avg,
+       sum(ay_peak_g_n) AS ay_peak_g_n,
+       min(ay_peak_g_min) AS ay_peak_g_min,
+       max(ay_peak_g_max) AS ay_peak_g_max,
+       sum(ay_peak_g_avg * ay_peak_g_n) / NULLIF(sum(ay_peak_g_n), 0) AS ay_peak_g_avg,
+       sum(az_peak_g_n) AS az_peak_g_n,
+       min(az_peak_g_min) AS az_peak_g_min,
+       max(az_peak_g_max) AS az_peak_g_max,
+       sum(az_peak_g_avg * az_peak_g_n) / NULLIF(sum(az_peak_g_n), 0) AS az_peak_g_avg,
+       sum(magnitude_peak_g_n) AS magnitude_peak_g_n,
+       min(magnitude_peak_g_min) AS magnitude_peak_g_min,
+       max(magnitude_peak_g_max) AS magnitude_peak_g_max,
+       sum(magnitude_peak_g_avg * magnitude_peak_g_n) / NULLIF(sum(magnitude_peak_g_n), 0) AS magnitude_peak_g_avg
+FROM readings_1h
+GROUP BY 1, device_id
+WITH NO DATA;
+
+SELECT add_continuous_aggregate_policy('readings_1m', start_offset => INTERVAL '2 hours',
+  end_offset => INTERVAL '1 minute', schedule_interval => INTERVAL '1 minute', if_not_exists => TRUE);
+SELECT add_continuous_aggregate_policy('readings_1h', start_offset => INTERVAL '3 days',
+  end_offset => INTERVAL '1 hour', schedule_interval => INTERVAL '30 minutes', if_not_exists => TRUE);
+SELECT add_continuous_aggregate_policy('readings_1d', start_offset => INTERVAL '30 days',
+  end_offset => INTERVAL '1 day', schedule_interval => INTERVAL '1 hour', if_not_exists => TRUE);
+
+CALL refresh_continuous_aggregate('readings_1m', NULL, NULL);
+CALL refresh_continuous_aggregate('readings_1h', NULL, NULL);
+CALL refresh_continuous_aggregate('readings_1d', NULL, NULL);